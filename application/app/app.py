@@ -1,28 +1,47 @@
 import os
 import time
+import atexit
 import pymysql
 import logging
-import json
 from datetime import datetime
-from flask import Flask, request
+from flask import Flask, g, request
 from models import *
+from migrations import BACKFILL_ENABLED, LegacyBackfill, MigrationLockTimeout, run_migrations
+from partitions import CHAT_PARTITIONING, partition_status
+from hub import MessageHub
+from backplane import LocalBackplane, create_backplane
+from database import engine_options_from_env, replica_binds
+from log_pipeline import AccessLogPolicy, start_log_pipeline
+from write_buffer import WRITE_BUFFER_ENABLED, WriteBuffer
+from purge import ROOM_PURGE_ENABLED, RoomPurger
+from room_cache import ROOM_CACHE_ENABLED, RoomCache
 from sqlalchemy.exc import OperationalError
 from flask_cors import CORS
 
+# Worker processes serving this pod; gunicorn.conf.py exports the actual count
+SERVER_WORKERS = int(os.getenv('GUNICORN_WORKERS', '1'))
+
 
 # Configure structured logging
 class StructuredLogger:
     def __init__(self, service_name="chatapp"):
         self.service_name = service_name
         self.logger = logging.getLogger(service_name)
-        
-        # Configure JSON formatter for structured logs
-        handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter('%(message)s'))
-        self.logger.addHandler(handler)
         self.logger.setLevel(logging.INFO)
+
+        # JSON encoding and writes happen on a background thread behind a
+        # bounded queue, never on the request thread
+        if not self.logger.handlers:
+            listener = start_log_pipeline(self.logger)
+            atexit.register(listener.stop)
     
     def log(self, level, message, **kwargs):
+        levelno = logging.getLevelName(level)
+        if not isinstance(levelno, int):
+            levelno = logging.INFO
+        if not self.logger.isEnabledFor(levelno):
+            return
+
         log_entry = {
             "timestamp": datetime.utcnow().isoformat() + "Z",
             "level": level,
@@ -45,14 +64,7 @@ class StructuredLogger:
         except:
             pass
         
-        if level == "ERROR":
-            self.logger.error(json.dumps(log_entry))
-        elif level == "WARNING":
-            self.logger.warning(json.dumps(log_entry))
-        elif level == "DEBUG":
-            self.logger.debug(json.dumps(log_entry))
-        else:
-            self.logger.info(json.dumps(log_entry))
+        self.logger.log(levelno, message, extra={"structured": log_entry})
     
     def info(self, message, **kwargs):
         self.log("INFO", message, **kwargs)
@@ -103,7 +115,8 @@ def create_app():
         origins=["https://dvfx7k0839335.cloudfront.net"],
         supports_credentials=True,
         methods=["GET", "POST", "PUT", "DELETE"],
-        allow_headers=["Content-Type"]
+        allow_headers=["Content-Type", "If-None-Match"],
+        expose_headers=["X-Last-Message-Id", "X-Has-More", "X-Room-Generation", "ETag"]
     )
 
     MYSQL_URI = os.getenv('MYSQL_URI', 'MYSQL uri not set')
@@ -111,14 +124,33 @@ def create_app():
 
     app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
+    # Pool size, overflow, recycling and pre-ping from DB_POOL_* variables
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env()
+
+    # Optional read replica for room history; writes always go to MYSQL_URI
+    MYSQL_READ_URI = os.getenv('MYSQL_READ_URI')
+    if MYSQL_READ_URI:
+        app.config['SQLALCHEMY_BINDS'] = replica_binds(f'mysql+pymysql://{MYSQL_READ_URI}')
 
     db.init_app(app)
 
     # Initialize Prometheus metrics only if not in testing mode
     if not app.config.get('TESTING', False):
         try:
-            from prometheus_flask_exporter import PrometheusMetrics
-            metrics = PrometheusMetrics(app)
+            # Room, user and daily message totals are computed at scrape time,
+            # at most once per GAUGE_REFRESH_SECONDS, instead of on every write
+            from collectors import ChatGaugeCollector
+            gauge_collector = ChatGaugeCollector(app, db)
+
+            if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+                # Several gunicorn workers: aggregate samples from all of them
+                from collectors import MultiprocessChatMetrics
+                metrics = MultiprocessChatMetrics(app, collectors=[gauge_collector])
+            else:
+                from prometheus_flask_exporter import PrometheusMetrics
+                from prometheus_client import REGISTRY
+                metrics = PrometheusMetrics(app)
+                REGISTRY.register(gauge_collector)
             
             # Add custom application info
             metrics.info('chatapp_info', 'ChatApp application info', version='1.0.0')
@@ -132,10 +164,9 @@ def create_app():
             chat_clears = Counter('chatapp_chat_clears_total', 'Total chat clears', ['room'])
             
             # Gauges (can go up and down)
-            active_rooms = Gauge('chatapp_active_rooms', 'Number of active rooms')
-            total_users = Gauge('chatapp_total_users', 'Total number of users')
-            database_connection = Gauge('chatapp_database_connected', 'Database connection status (1=connected, 0=disconnected)')
-            messages_today = Gauge('chatapp_messages_today', 'Messages sent today')
+            # In multiprocess mode report 0 if any live worker lost the database
+            database_connection = Gauge('chatapp_database_connected', 'Database connection status (1=connected, 0=disconnected)',
+                                        multiprocess_mode='livemin')
             
             # Histograms (for measuring distributions)
             message_length = Histogram('chatapp_message_length_chars', 'Distribution of message lengths', buckets=[10, 50, 100, 200, 500, 1000])
@@ -145,10 +176,7 @@ def create_app():
                 'messages_sent': messages_sent,
                 'username_changes': username_changes,
                 'chat_clears': chat_clears,
-                'active_rooms': active_rooms,
-                'total_users': total_users,
                 'database_connection': database_connection,
-                'messages_today': messages_today,
                 'message_length': message_length
             }
         except ImportError:
@@ -158,7 +186,7 @@ def create_app():
                     pass
                 def labels(self, **kwargs):
                     return self
-                def inc(self):
+                def inc(self, amount=1):
                     pass
                 def set(self, value):
                     pass
@@ -169,10 +197,7 @@ def create_app():
                 'messages_sent': MockMetrics(),
                 'username_changes': MockMetrics(),
                 'chat_clears': MockMetrics(),
-                'active_rooms': MockMetrics(),
-                'total_users': MockMetrics(),
                 'database_connection': MockMetrics(),
-                'messages_today': MockMetrics(),
                 'message_length': MockMetrics()
             }
 
@@ -186,12 +211,32 @@ def create_app():
         while True:
             try:
                 with app.app_context():
-                    db.create_all()
+                    applied = run_migrations(db, app.logger)
+                    if applied:
+                        app.logger.info("Schema migrations applied", versions=applied)
+                    if CHAT_PARTITIONING:
+                        # Converting rebuilds the table; that is left to the CLI
+                        existing, missing = partition_status(db)
+                        if not existing:
+                            app.logger.warning("Chat table is not partitioned; "
+                                               "run `flask partitions enable`")
+                        elif missing:
+                            app.logger.warning("Upcoming chat partitions missing; "
+                                               "run `flask partitions maintain`",
+                                               missing=missing)
+                        else:
+                            app.logger.info("Chat table partitioned",
+                                            partitions=len(existing))
                     # Set initial database connection status
                     if hasattr(app, 'metrics') and 'database_connection' in app.metrics:
                         app.metrics['database_connection'].set(1)
                     app.logger.info("Database connection established successfully")
                 break
+            except MigrationLockTimeout as e:
+                # Another pod is still migrating; wait for it instead of failing to boot
+                app.logger.warning("Schema migrations still running elsewhere",
+                                   error=str(e), retry_in_seconds=5)
+                time.sleep(5)
             except OperationalError as e:
                 app.logger.error("Failed to connect to MySQL database", 
                                error=str(e), retry_in_seconds=5)
@@ -199,25 +244,82 @@ def create_app():
                     app.metrics['database_connection'].set(0)
                 time.sleep(5)
 
+    # Rows with only the legacy columns are converted in the background
+    if BACKFILL_ENABLED and legacy_columns and not app.config.get('TESTING', False):
+        app.legacy_backfill = LegacyBackfill(db)
+        app.legacy_backfill.start(app)
+        app.logger.info("Legacy backfill started", columns=sorted(legacy_columns))
+
+    # Room event fan-out: local hub fed by the configured cross-replica backplane
+    app.hub = MessageHub()
+    app.backplane = create_backplane(app.hub)
+    if not app.config.get('TESTING', False):
+        app.backplane.start(app)
+        app.logger.info("Event backplane started",
+                       backplane=type(app.backplane).__name__)
+
+    # Optional group commit for posted messages
+    app.write_buffer = None
+    if WRITE_BUFFER_ENABLED and not app.config.get('TESTING', False):
+        app.write_buffer = WriteBuffer(app, db)
+        app.write_buffer.start()
+        atexit.register(app.write_buffer.stop)
+        app.logger.info("Write buffer started",
+                       max_batch=app.write_buffer.max_batch,
+                       flush_ms=app.write_buffer.flush_seconds * 1000)
+
+    # Newest messages of busy rooms, kept current by room events. The local
+    # backplane never tells a worker about posts handled by its siblings, so
+    # with several workers its cache would keep serving stale pages.
+    app.room_cache = None
+    if ROOM_CACHE_ENABLED and not app.config.get('TESTING', False):
+        if isinstance(app.backplane, LocalBackplane) and SERVER_WORKERS > 1:
+            app.logger.warning("Room cache disabled: the local backplane does not "
+                               "reach other workers", workers=SERVER_WORKERS)
+        else:
+            app.room_cache = RoomCache()
+            app.hub.add_listener(app.room_cache.on_event)
+            app.logger.info("Room cache enabled",
+                           room_messages=app.room_cache.room_messages,
+                           max_bytes=app.room_cache.max_bytes)
+
+    # Deletes the messages of cleared rooms in small batches
+    if ROOM_PURGE_ENABLED and not app.config.get('TESTING', False):
+        app.room_purger = RoomPurger(db)
+        app.room_purger.start(app)
+        app.logger.info("Room purge started",
+                       batch_size=app.room_purger.batch_size)
+
     from routes import register_routes
     register_routes(app, db)
 
-    # Add request logging middleware only if not testing
+    from commands import register_commands
+    register_commands(app, db)
+
+    if not app.config.get('TESTING', False):
+        app.stats.start(app)
+
+    # One access-log line per request, sampled per path (see log_pipeline)
     if not app.config.get('TESTING', False):
+        access_log = AccessLogPolicy.from_env()
+
         @app.before_request
-        def log_request_info():
-            app.logger.info("Incoming request", 
-                           method=request.method,
-                           path=request.path,
-                           remote_addr=request.remote_addr)
+        def start_request_timer():
+            g.request_started = time.perf_counter()
 
         @app.after_request
-        def log_response_info(response):
-            app.logger.info("Request completed",
-                           method=request.method,
-                           path=request.path,
-                           status_code=response.status_code,
-                           content_length=response.content_length)
+        def log_access(response):
+            sample_rate = access_log.sample(request.path, response.status_code)
+            if sample_rate is not None:
+                # Streamed responses are timed to the first byte
+                duration = time.perf_counter() - g.get('request_started', time.perf_counter())
+                app.logger.info("Request completed",
+                               method=request.method,
+                               path=request.path,
+                               status_code=response.status_code,
+                               content_length=response.content_length,
+                               duration_ms=round(duration * 1000, 2),
+                               sample_rate=sample_rate)
             return response
 
     return app
\ No newline at end of file
@@ -0,0 +1,236 @@
+"""Cross-replica delivery of chat events.
+
+Routes publish room events (new messages, renames, clears) through a backplane
+rather than the hub directly. The backplane makes sure every replica's local
+`MessageHub` sees the event:
+
+- `LocalBackplane` delivers straight to the local hub. Correct for a single
+  process only.
+- `DatabaseBackplane` needs nothing but the MySQL database already in use.
+  Every process that builds the app (each gunicorn worker, since the app is
+  not preloaded) runs one poller thread. It reads new `chat` rows by id and
+  new `chat_event` rows (renames and clears) and delivers them locally, so
+  each worker costs two cheap indexed queries per interval no matter how many
+  clients are connected. The default interval grows with GUNICORN_WORKERS to
+  keep that at about four queries a second per pod; with many workers or pods
+  prefer Redis. New messages are not written twice: the `chat` table itself
+  is the log.
+- `RedisBackplane` relays every event over a Redis pub/sub channel. Requires
+  the optional `redis` package.
+
+Select one with `CHAT_BACKPLANE=local|database|redis`.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+from sqlalchemy import delete, func, or_, select
+from models import Chat, ChatEvent, db, legacy_fields, utcnow, with_legacy
+
+log = logging.getLogger(__name__)
+
+# Per worker: the pod's workers together poll about every 0.5 seconds
+POLL_SECONDS = float(os.getenv('CHAT_BACKPLANE_POLL_SECONDS',
+                               str(0.5 * int(os.getenv('GUNICORN_WORKERS', '1')))))
+EVENT_RETENTION_SECONDS = int(os.getenv('CHAT_BACKPLANE_EVENT_RETENTION_SECONDS', '3600'))
+REDIS_CHANNEL = os.getenv('CHAT_BACKPLANE_REDIS_CHANNEL', 'chatapp:events')
+
+# Ids skipped by the poller are re-checked for this long, because a row with a
+# lower auto-increment id can commit after one with a higher id
+GAP_TIMEOUT_SECONDS = 5.0
+MAX_TRACKED_GAP = 100
+
+
+class Backplane:
+    """Base class: publish events so that every replica's hub receives them"""
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.node_id = uuid.uuid4().hex
+
+    def publish(self, room, event, data):
+        raise NotImplementedError
+
+    def start(self, app):
+        """Start background delivery (no-op for in-process backplanes)"""
+
+    def stop(self):
+        """Stop background delivery"""
+
+
+class LocalBackplane(Backplane):
+    def publish(self, room, event, data):
+        self.hub.publish(room, event, data)
+
+
+class DatabaseBackplane(Backplane):
+    def __init__(self, hub, database=db, poll_seconds=POLL_SECONDS, batch_size=500):
+        super().__init__(hub)
+        self.db = database
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self.chat_cursor = None
+        self.event_cursor = None
+        self.gaps = {}
+        self.last_prune = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def publish(self, room, event, data):
+        if event == 'message' or (event == 'bulk' and 'counts' in data):
+            # New rows are picked up from the chat table by every pod's poller,
+            # including this one, and delivered as individual messages
+            return
+        self.db.session.add(ChatEvent(origin=self.node_id, room=room, event=event,
+                                      payload=json.dumps(data)))
+        self.db.session.commit()
+
+    def start(self, app):
+        with app.app_context():
+            self.reset_cursors()
+        self._thread = threading.Thread(target=self._run, args=(app,),
+                                        name='chat-backplane', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_seconds * 2)
+
+    def reset_cursors(self):
+        """Start delivering from the current end of both logs"""
+        session = self.db.session
+        self.chat_cursor = session.execute(select(func.max(Chat.id))).scalar() or 0
+        self.event_cursor = session.execute(select(func.max(ChatEvent.id))).scalar() or 0
+        self.gaps = {}
+
+    def _run(self, app):
+        while not self._stop.is_set():
+            try:
+                with app.app_context():
+                    self.poll_once()
+            except Exception:
+                log.exception("Backplane poll failed")
+            self._stop.wait(self.poll_seconds)
+
+    def poll_once(self):
+        """Deliver everything committed since the last poll. Returns the event count."""
+        if self.chat_cursor is None:
+            self.reset_cursors()
+        try:
+            delivered = self._poll_messages() + self._poll_events()
+            self._prune()
+        finally:
+            self.db.session.remove()
+        return delivered
+
+    def _poll_messages(self):
+        condition = Chat.id > self.chat_cursor
+        if self.gaps:
+            condition = or_(condition, Chat.id.in_(list(self.gaps)))
+        entries = with_legacy(self.db.session.execute(
+            select(Chat, *legacy_fields()).where(condition).order_by(Chat.id).limit(self.batch_size)
+        ))
+
+        now = time.monotonic()
+        for entry in entries:
+            self.gaps.pop(entry.id, None)
+            if entry.id > self.chat_cursor:
+                if entry.id - self.chat_cursor - 1 <= MAX_TRACKED_GAP:
+                    for missing in range(self.chat_cursor + 1, entry.id):
+                        self.gaps[missing] = now
+                self.chat_cursor = entry.id
+            self.hub.publish(entry.room, 'message', entry.to_event())
+
+        # Ids that never showed up belonged to rolled back transactions
+        self.gaps = {gap: seen for gap, seen in self.gaps.items()
+                     if now - seen < GAP_TIMEOUT_SECONDS}
+        return len(entries)
+
+    def _poll_events(self):
+        events = self.db.session.execute(
+            select(ChatEvent).where(ChatEvent.id > self.event_cursor)
+            .order_by(ChatEvent.id).limit(self.batch_size)
+        ).scalars().all()
+
+        for event in events:
+            self.event_cursor = event.id
+            self.hub.publish(event.room, event.event, json.loads(event.payload))
+        return len(events)
+
+    def _prune(self):
+        now = time.monotonic()
+        if now - self.last_prune < EVENT_RETENTION_SECONDS / 10:
+            return
+        self.last_prune = now
+        cutoff = utcnow() - timedelta(seconds=EVENT_RETENTION_SECONDS)
+        self.db.session.execute(delete(ChatEvent).where(ChatEvent.created_at < cutoff))
+        self.db.session.commit()
+
+
+class RedisBackplane(Backplane):
+    def __init__(self, hub, url=None, channel=REDIS_CHANNEL, client=None):
+        super().__init__(hub)
+        if client is None:
+            import redis  # optional dependency, only needed for this backplane
+            client = redis.Redis.from_url(url or os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        self.client = client
+        self.channel = channel
+        self._pubsub = None
+        self._thread = None
+        self._closed = False
+
+    def publish(self, room, event, data):
+        # Local subscribers never wait for the round trip through Redis
+        self.hub.publish(room, event, data)
+        try:
+            self.client.publish(self.channel, json.dumps({
+                "origin": self.node_id, "room": room, "event": event, "data": data
+            }))
+        except Exception:
+            log.exception("Failed to relay %s event for room %s to Redis", event, room)
+
+    def start(self, app):
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self.channel)
+        self._thread = threading.Thread(target=self._run, name='chat-backplane', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._closed = True
+        if self._pubsub is not None:
+            self._pubsub.close()
+
+    def _run(self):
+        while not self._closed:
+            try:
+                for message in self._pubsub.listen():
+                    self.receive(message.get('data'))
+            except Exception:
+                if self._closed:
+                    return
+                log.exception("Redis backplane subscription failed, retrying")
+                time.sleep(1)
+
+    def receive(self, raw):
+        """Deliver an event relayed by another replica"""
+        envelope = json.loads(raw)
+        if envelope.get('origin') == self.node_id:
+            return False
+        self.hub.publish(envelope['room'], envelope['event'], envelope['data'])
+        return True
+
+
+def create_backplane(hub, kind=None, database=db):
+    """Build the backplane selected by `kind` (default: CHAT_BACKPLANE env var)"""
+    kind = (kind or os.getenv('CHAT_BACKPLANE', 'local')).lower()
+    if kind == 'local':
+        return LocalBackplane(hub)
+    if kind == 'database':
+        return DatabaseBackplane(hub, database)
+    if kind == 'redis':
+        return RedisBackplane(hub)
+    raise ValueError(f"Unknown CHAT_BACKPLANE {kind!r}; expected local, database or redis")
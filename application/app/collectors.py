@@ -0,0 +1,111 @@
+"""Prometheus collectors evaluated at scrape time.
+
+`ChatGaugeCollector` replaces the gauges that used to be refreshed by
+`update_gauges()` on every write. The three aggregate queries now run when
+Prometheus scrapes, at most once per `GAUGE_REFRESH_SECONDS`; scrapes in
+between are answered from the cached values.
+
+`MultiprocessChatMetrics` serves /metrics when running under gunicorn with
+PROMETHEUS_MULTIPROC_DIR set, aggregating every worker's samples.
+"""
+import logging
+import os
+import threading
+import time
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+from prometheus_flask_exporter import choose_encoder
+from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+from sqlalchemy import distinct, func, select
+from models import Chat, RoomMember, db, not_cleared, start_of_day, utcnow
+
+log = logging.getLogger(__name__)
+
+GAUGE_REFRESH_SECONDS = float(os.getenv('GAUGE_REFRESH_SECONDS', '15'))
+
+GAUGES = (
+    ('chatapp_active_rooms', 'Number of active rooms'),
+    ('chatapp_total_users', 'Total number of users'),
+    ('chatapp_messages_today', 'Messages sent today'),
+)
+
+
+class ChatGaugeCollector:
+    def __init__(self, app, database=db, interval=GAUGE_REFRESH_SECONDS):
+        self.app = app
+        self.db = database
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._values = None
+        self._refreshed = 0.0
+
+    def describe(self):
+        # Lets the registry check names without running queries at registration
+        return [GaugeMetricFamily(name, documentation) for name, documentation in GAUGES]
+
+    def collect(self):
+        values = self.values()
+        if values is None:
+            return
+        for (name, documentation), value in zip(GAUGES, values):
+            yield GaugeMetricFamily(name, documentation, value=value)
+
+    def values(self):
+        """Return (rooms, users, messages today), refreshing if the cache expired"""
+        with self._lock:
+            now = time.monotonic()
+            if self._values is None or now - self._refreshed >= self.interval:
+                try:
+                    self._values = self._query()
+                    self._set_connected(1)
+                except Exception:
+                    log.exception("Failed to refresh chat gauges")
+                    self._set_connected(0)
+                # Failures are retried on the next interval, not on every scrape
+                self._refreshed = now
+            return self._values
+
+    def _query(self):
+        with self.app.app_context():
+            session = self.db.session
+            visible = not_cleared()
+            room_count = session.execute(
+                select(func.count(distinct(Chat.room))).where(visible)
+            ).scalar()
+            user_count = session.execute(
+                select(func.count(distinct(RoomMember.username))).select_from(Chat).join(Chat.member)
+                .where(visible)
+            ).scalar()
+            today_count = session.execute(
+                select(func.count(Chat.id)).where(Chat.created_at >= start_of_day(utcnow()), visible)
+            ).scalar()
+        return room_count, user_count, today_count
+
+    def _set_connected(self, value):
+        metrics = getattr(self.app, 'metrics', {})
+        if 'database_connection' in metrics:
+            metrics['database_connection'].set(value)
+
+
+class MultiprocessChatMetrics(GunicornInternalPrometheusMetrics):
+    """Metrics aggregated across gunicorn workers, plus scrape-time collectors
+
+    In multiprocess mode the exporter builds a fresh registry per scrape from
+    the workers' files, which would drop collectors registered in-process.
+    """
+
+    def __init__(self, app=None, collectors=(), **kwargs):
+        self.collectors = list(collectors)
+        super().__init__(app=app, **kwargs)
+
+    def generate_metrics(self, accept_header=None, names=None):
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+        for collector in self.collectors:
+            registry.register(collector)
+        if names:
+            registry = registry.restricted_registry(names)
+
+        generate_latest, content_type = choose_encoder(accept_header)
+        return generate_latest(registry).decode('utf-8'), content_type
@@ -0,0 +1,108 @@
+import click
+from flask import current_app
+from hub import ALL_ROOMS
+from migrations import backfill_created_at, backfill_members
+from purge import ROOM_PURGE_BATCH_SIZE, RoomPurger
+from partitions import ensure_partitions, partition_names
+from retention import RETENTION_BATCH_SIZE, Archive, RetentionPolicy, apply_retention
+from synthetic import generate_messages
+
+
+def register_commands(app, db):
+
+    @app.cli.command('backfill-created-at')
+    @click.option('--batch-size', default=10000, show_default=True,
+                  help='Rows converted per transaction')
+    def backfill_created_at_command(batch_size):
+        """Convert legacy date/time strings into created_at timestamps"""
+        with db.engine.connect() as conn:
+            updated = backfill_created_at(conn, batch_size=batch_size,
+                                          logger=current_app.logger)
+        click.echo(f"Backfilled created_at for {updated} messages")
+
+    @app.cli.command('backfill-members')
+    @click.option('--batch-size', default=10000, show_default=True,
+                  help='Rows linked per transaction')
+    def backfill_members_command(batch_size):
+        """Link messages written by older releases to their room members"""
+        with db.engine.connect() as conn:
+            updated = backfill_members(conn, batch_size=batch_size,
+                                       logger=current_app.logger)
+        click.echo(f"Linked {updated} messages to room members")
+
+    @app.cli.command('purge-cleared-rooms')
+    @click.option('--batch-size', default=ROOM_PURGE_BATCH_SIZE, show_default=True,
+                  help='Messages deleted per transaction')
+    def purge_cleared_rooms_command(batch_size):
+        """Delete the hidden messages of cleared rooms now instead of in the background"""
+        deleted = RoomPurger(db, batch_size=batch_size).purge_all()
+        click.echo(f"Purged {deleted} messages from cleared rooms")
+
+    @app.cli.command('retention')
+    @click.option('--room', 'rooms', multiple=True,
+                  help='Only these rooms (default: every room with a limit)')
+    @click.option('--batch-size', default=RETENTION_BATCH_SIZE, show_default=True,
+                  help='Messages archived and deleted per transaction')
+    @click.option('--dry-run', is_flag=True, help='Only report what would be removed')
+    def retention_command(rooms, batch_size, dry_run):
+        """Archive and delete messages beyond the RETENTION_* limits"""
+        removed = apply_retention(RetentionPolicy.from_env(), None if dry_run else Archive(), db,
+                                  batch_size=batch_size, rooms=list(rooms) or None,
+                                  dry_run=dry_run)
+        verb = "Would remove" if dry_run else "Archived and removed"
+        for room, count in sorted(removed.items()):
+            if count and not dry_run:
+                # App pods drop the room from their caches and recount stats
+                current_app.backplane.publish(room, 'bulk', {"removed": count})
+            click.echo(f"{verb} {count} messages from {room}")
+        click.echo(f"{verb} {sum(removed.values())} messages in total")
+
+    @app.cli.group('partitions')
+    def partitions_group():
+        """Monthly partitions of the chat table (MySQL only)"""
+
+    @partitions_group.command('enable')
+    def partitions_enable_command():
+        """Partition the chat table by month (rebuilds the table)"""
+        added, _ = ensure_partitions(db, convert=True)
+        click.echo(f"Chat table partitioned; added {len(added)} upcoming months")
+
+    @partitions_group.command('maintain')
+    @click.option('--drop-expired/--keep-expired', default=True, show_default=True,
+                  help='Drop months older than PARTITION_RETENTION_MONTHS')
+    def partitions_maintain_command(drop_expired):
+        """Pre-create upcoming months and drop expired ones"""
+        added, dropped = ensure_partitions(db, convert=False, drop_expired=drop_expired)
+        if dropped:
+            current_app.backplane.publish(ALL_ROOMS, 'bulk', {"dropped_partitions": dropped})
+        click.echo(f"Added partitions: {', '.join(added) or 'none'}")
+        click.echo(f"Dropped partitions: {', '.join(dropped) or 'none'}")
+
+    @partitions_group.command('list')
+    def partitions_list_command():
+        """Show the partitions of the chat table"""
+        with db.engine.connect() as conn:
+            names = partition_names(conn) if conn.dialect.name == 'mysql' else []
+        click.echo('\n'.join(names) or "The chat table is not partitioned")
+
+    @app.cli.command('generate-messages')
+    @click.option('--count', default=1000000, show_default=True, help='Messages to insert')
+    @click.option('--rooms', default=100, show_default=True, help='Distinct rooms')
+    @click.option('--users', default=1000, show_default=True, help='Distinct usernames')
+    @click.option('--months', default=6, show_default=True,
+                  help='Months of history the messages are spread over')
+    @click.option('--room-exponent', default=1.1, show_default=True,
+                  help='Zipf exponent of room activity (higher is more skewed)')
+    @click.option('--user-exponent', default=1.1, show_default=True,
+                  help='Zipf exponent of user activity (higher is more skewed)')
+    @click.option('--batch-size', default=10000, show_default=True,
+                  help='Rows inserted per transaction')
+    @click.option('--seed', default=1, show_default=True, help='Random seed')
+    def generate_messages_command(count, rooms, users, months, room_exponent,
+                                  user_exponent, batch_size, seed):
+        """Bulk-load synthetic messages for load tests and query plans"""
+        inserted = generate_messages(count, db, rooms=rooms, users=users, months=months,
+                                     room_exponent=room_exponent,
+                                     user_exponent=user_exponent,
+                                     batch_size=batch_size, seed=seed)
+        click.echo(f"Generated {inserted} messages in {rooms} rooms")
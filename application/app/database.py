@@ -0,0 +1,156 @@
+"""Engine and connection pool configuration.
+
+`engine_options_from_env()` builds `SQLALCHEMY_ENGINE_OPTIONS` from DB_POOL_*
+variables. Connections are pinged before use and recycled well inside MySQL's
+`wait_timeout`, so a request never picks up a connection the server already
+closed.
+
+The pool is an `InstrumentedQueuePool`, which exports to Prometheus:
+
+- `chatapp_db_pool_checked_out` / `chatapp_db_pool_overflow`: connections in
+  use and connections opened beyond `pool_size`
+- `chatapp_db_pool_wait_seconds`: time to check out a connection, including
+  opening a new one
+- `chatapp_db_pool_timeouts_total`: checkouts that gave up after `pool_timeout`
+
+When MYSQL_READ_URI is set it becomes the `replica` bind, and read-only
+queries go through `execute_read()`. A client that just wrote gets a short
+lived cookie that pins its reads to the primary, so it always sees its own
+writes despite replication lag. Reads fall back to the primary if the replica
+cannot be reached.
+"""
+import logging
+import math
+import os
+import time
+from flask import current_app, g, request
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+from models import db
+
+log = logging.getLogger(__name__)
+
+READ_BIND = 'replica'
+PRIMARY_COOKIE = 'chat_primary_until'
+READ_YOUR_WRITES_SECONDS = float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', '5'))
+
+POOL_CHECKED_OUT = Gauge('chatapp_db_pool_checked_out', 'Database connections currently checked out',
+                         ['bind'], multiprocess_mode='livesum')
+POOL_OVERFLOW = Gauge('chatapp_db_pool_overflow', 'Database connections open beyond pool_size',
+                      ['bind'], multiprocess_mode='livesum')
+POOL_SIZE = Gauge('chatapp_db_pool_size', 'Configured database pool size',
+                  ['bind'], multiprocess_mode='livesum')
+POOL_WAIT = Histogram('chatapp_db_pool_wait_seconds', 'Time to check a connection out of the pool',
+                      ['bind'], buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10])
+POOL_TIMEOUTS = Counter('chatapp_db_pool_timeouts_total', 'Checkouts that timed out waiting for a connection',
+                        ['bind'])
+READS = Counter('chatapp_db_reads_total', 'Read queries by the bind that served them', ['bind'])
+READ_FALLBACKS = Counter('chatapp_db_read_fallbacks_total', 'Replica reads retried on the primary')
+
+
+def env_flag(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that reports checkouts, overflow and wait time"""
+    bind_name = 'primary'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        POOL_SIZE.labels(bind=self.bind_name).set(self.size())
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.labels(bind=self.bind_name).inc()
+            raise
+        finally:
+            POOL_WAIT.labels(bind=self.bind_name).observe(time.perf_counter() - start)
+            self._report()
+
+    def _do_return_conn(self, record):
+        try:
+            super()._do_return_conn(record)
+        finally:
+            self._report()
+
+    def _report(self):
+        POOL_CHECKED_OUT.labels(bind=self.bind_name).set(self.checkedout())
+        POOL_OVERFLOW.labels(bind=self.bind_name).set(max(self.overflow(), 0))
+
+
+def pool_class(bind_name):
+    """An InstrumentedQueuePool subclass labelling its metrics with `bind_name`"""
+    if bind_name == InstrumentedQueuePool.bind_name:
+        return InstrumentedQueuePool
+    # A subclass rather than an attribute, because the engine rebuilds its
+    # pool from the class when it is disposed or recreated
+    return type(f'InstrumentedQueuePool_{bind_name}', (InstrumentedQueuePool,),
+                {'bind_name': bind_name})
+
+
+def engine_options_from_env(bind_name='primary', environ=os.environ):
+    """SQLAlchemy engine options for a MySQL bind, read from DB_POOL_* variables"""
+    return {
+        'poolclass': pool_class(bind_name),
+        'pool_size': int(environ.get('DB_POOL_SIZE', '10')),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', '20')),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', '10')),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': env_flag(environ.get('DB_POOL_PRE_PING', 'true')),
+    }
+
+
+def replica_binds(read_uri, environ=os.environ):
+    """SQLALCHEMY_BINDS entry for the read replica at `read_uri`"""
+    return {READ_BIND: {'url': read_uri, **engine_options_from_env(READ_BIND, environ)}}
+
+
+def has_replica():
+    return READ_BIND in (current_app.config.get('SQLALCHEMY_BINDS') or {})
+
+
+def mark_write():
+    """Record that this request wrote, so this client's next reads use the primary"""
+    g.db_wrote = True
+
+
+def reads_pinned_to_primary():
+    if g.get('db_wrote'):
+        return True
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def pin_reads_after_write(response):
+    """after_request hook: set the read-your-writes cookie after a write"""
+    if g.get('db_wrote') and has_replica():
+        until = time.time() + READ_YOUR_WRITES_SECONDS
+        response.set_cookie(PRIMARY_COOKIE, f'{until:.3f}',
+                            max_age=math.ceil(READ_YOUR_WRITES_SECONDS),
+                            httponly=True, samesite='Lax')
+    return response
+
+
+def execute_read(statement, database=db):
+    """Execute a read-only statement on the replica when it is safe to do so"""
+    if has_replica() and not reads_pinned_to_primary():
+        try:
+            result = database.session.execute(
+                statement, bind_arguments={'bind': database.engines[READ_BIND]})
+            READS.labels(bind=READ_BIND).inc()
+            return result
+        except exc.OperationalError:
+            log.warning("Replica read failed, retrying on the primary", exc_info=True)
+            READ_FALLBACKS.inc()
+            database.session.rollback()
+
+    result = database.session.execute(statement)
+    READS.labels(bind='primary').inc()
+    return result
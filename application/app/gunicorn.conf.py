@@ -0,0 +1,113 @@
+"""Gunicorn configuration for production serving.
+
+    gunicorn --config gunicorn.conf.py run:flask_app
+
+Every setting can be overridden from the environment. The default worker
+count follows the container's CPU limit, not the host's cores; each worker
+has its own connection pool, room cache and background threads, so set
+GUNICORN_WORKERS explicitly where memory or MySQL connections are tight. With
+more than one worker the room events must cross processes: the database
+backplane is used unless CHAT_BACKPLANE says otherwise, and
+CHAT_BACKPLANE=local refuses to start.
+
+Workers use threads (`gthread`) and each open /stream connection holds one for
+its whole lifetime, so a pod carries at most workers x threads requests and
+streams together. Streams are capped at CHAT_STREAM_MAX_PER_WORKER per worker
+(half of GUNICORN_THREADS by default) and the rest of the threads serve posts,
+polls and health probes; a cap that leaves fewer than MIN_REQUEST_THREADS
+refuses to start. Raise GUNICORN_THREADS and the cap together for more open
+streams per pod.
+
+When PROMETHEUS_MULTIPROC_DIR is set the app exposes metrics aggregated across
+all workers (see create_app), and the hooks below keep that directory clean.
+"""
+import math
+import os
+import shutil
+
+MAX_DEFAULT_WORKERS = 4
+# Threads per worker that streams may never take
+MIN_REQUEST_THREADS = 4
+
+
+def cpu_limit():
+    """CPUs this container may use: the cgroup CPU quota, else the usable cores.
+
+    os.cpu_count() reports the host's cores however small the pod's limit is.
+    """
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:  # cgroup v2
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        try:  # cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                quota = f.read().strip()
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = f.read().strip()
+        except OSError:
+            quota, period = 'max', '1'
+    if quota not in ('max', '-1'):
+        return max(1, math.ceil(int(quota) / int(period)))
+    return len(os.sched_getaffinity(0))
+
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', str(min(cpu_limit() * 2 + 1, MAX_DEFAULT_WORKERS))))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '32'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+
+# Recycle workers periodically; jitter keeps them from restarting together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '1000'))
+
+# Each worker builds its own app: background threads (backplane poller, stats
+# reconciliation) do not survive a fork from a preloaded master
+preload_app = False
+
+# Requests are already logged by the application as structured JSON
+accesslog = None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+
+def on_starting(server):
+    # Workers inherit the environment: tell the app how many siblings and
+    # threads it has (the stream cap defaults to half of the threads)
+    os.environ['GUNICORN_WORKERS'] = str(server.cfg.workers)
+    os.environ['GUNICORN_THREADS'] = str(server.cfg.threads)
+
+    streams = int(os.getenv('CHAT_STREAM_MAX_PER_WORKER', str(server.cfg.threads // 2)))
+    if server.cfg.threads - streams < MIN_REQUEST_THREADS:
+        raise RuntimeError(
+            f"CHAT_STREAM_MAX_PER_WORKER={streams} leaves fewer than {MIN_REQUEST_THREADS} "
+            f"of {server.cfg.threads} threads for requests: raise GUNICORN_THREADS")
+    server.log.info("Serving up to %d streams on %d workers x %d threads",
+                    streams * server.cfg.workers, server.cfg.workers, server.cfg.threads)
+
+    # With the local backplane a worker's streams, stats and room cache never
+    # see events handled by its siblings
+    if server.cfg.workers > 1:
+        backplane = os.getenv('CHAT_BACKPLANE', '').lower()
+        if backplane == 'local':
+            raise RuntimeError(
+                f"CHAT_BACKPLANE=local cannot serve {server.cfg.workers} workers: "
+                "use the database or redis backplane, or GUNICORN_WORKERS=1")
+        if not backplane:
+            os.environ['CHAT_BACKPLANE'] = 'database'
+            server.log.info("Using the database backplane for %d workers", server.cfg.workers)
+
+    # Files left by a previous run would be aggregated into the new metrics
+    if PROMETHEUS_MULTIPROC_DIR:
+        shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+        GunicornInternalPrometheusMetrics.mark_process_dead_on_child_exit(worker.pid)
@@ -0,0 +1,92 @@
+"""In-process fan-out of chat events to streaming subscribers.
+
+Routes publish an event once per database change and the hub copies it into
+the queue of every subscriber of that room, so an idle room costs nothing but
+a blocked thread per open stream. Listeners registered with `add_listener()`
+receive every event regardless of room.
+"""
+import logging
+import queue
+import threading
+
+DEFAULT_MAX_QUEUED = 1000
+
+# Room of events that concern every room, such as dropped partitions
+ALL_ROOMS = '*'
+
+log = logging.getLogger(__name__)
+
+
+class Subscription:
+    """A single stream's view of one room"""
+
+    def __init__(self, room, max_queued=DEFAULT_MAX_QUEUED):
+        self.room = room
+        self.queue = queue.Queue(maxsize=max_queued)
+        # Set when the subscriber fell behind and events were dropped; the
+        # stream should end so the client reconnects and backfills from the DB
+        self.overflowed = False
+
+    def get(self, timeout=None):
+        """Return the next (event, data) pair, or None after `timeout` seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class MessageHub:
+    def __init__(self, max_queued=DEFAULT_MAX_QUEUED):
+        self.max_queued = max_queued
+        self._lock = threading.Lock()
+        self._rooms = {}
+        self._listeners = []
+
+    def subscribe(self, room, limit=None):
+        """Subscribe to a room; None if `limit` subscriptions are already open"""
+        subscription = Subscription(room, self.max_queued)
+        with self._lock:
+            if limit is not None and sum(map(len, self._rooms.values())) >= limit:
+                return None
+            self._rooms.setdefault(room, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._rooms.get(subscription.room)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._rooms[subscription.room]
+
+    def add_listener(self, callback):
+        """Call `callback(room, event, data)` for every published event"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def publish(self, room, event, data):
+        """Deliver an event to all local subscribers of `room`"""
+        with self._lock:
+            subscribers = list(self._rooms.get(room, ()))
+            listeners = list(self._listeners)
+
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait((event, data))
+            except queue.Full:
+                subscription.overflowed = True
+
+        for callback in listeners:
+            try:
+                callback(room, event, data)
+            except Exception:
+                # A broken listener must not fail the write that published
+                log.exception("Hub listener failed for %s event in room %s", event, room)
+
+        return len(subscribers)
+
+    def subscriber_count(self, room=None):
+        with self._lock:
+            if room is not None:
+                return len(self._rooms.get(room, ()))
+            return sum(len(subscribers) for subscribers in self._rooms.values())
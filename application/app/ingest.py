@@ -0,0 +1,86 @@
+"""Parsing and validation for bulk message ingestion (POST /api/messages/batch).
+
+A batch is a JSON array, or NDJSON (one JSON object per line) when sent as
+`application/x-ndjson`. Each item needs `room`, `username` and `msg` (or
+`message`), and may carry an ISO 8601 `created_at` for imported history.
+Items are validated one by one so a bad item is reported, not fatal.
+"""
+import json
+from datetime import datetime, timezone
+from models import utcnow
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl', 'application/ndjson')
+
+# Column sizes of the chat table
+MAX_NAME_LENGTH = 50
+MAX_MESSAGE_BYTES = 65535
+
+
+class BatchError(ValueError):
+    """The request body as a whole is not a batch"""
+
+
+def parse_batch(body, mimetype):
+    """Split a request body into items: (parsed object or None, parse error or None)"""
+    if mimetype in NDJSON_MIMETYPES:
+        try:
+            lines = body.decode('utf-8').splitlines()
+        except UnicodeDecodeError:
+            raise BatchError("body must be UTF-8") from None
+        items = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                items.append((json.loads(line), None))
+            except ValueError as e:
+                items.append((None, f"invalid JSON: {e.msg}"))
+        return items
+
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise BatchError(f"invalid JSON: {e}") from None
+    if not isinstance(payload, list):
+        raise BatchError("expected a JSON array of messages")
+    return [(item, None) for item in payload]
+
+
+def parse_created_at(value):
+    """ISO 8601 timestamp as naive UTC; naive input is taken to be UTC"""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def validate_item(item):
+    """Return (row for the chat table, None) or (None, error message)"""
+    if not isinstance(item, dict):
+        return None, "expected an object"
+
+    room = item.get('room')
+    username = item.get('username')
+    message = item.get('msg', item.get('message'))
+
+    for field, value in (('room', room), ('username', username)):
+        if not isinstance(value, str) or not value:
+            return None, f"{field} is required"
+        if len(value) > MAX_NAME_LENGTH:
+            return None, f"{field} must be at most {MAX_NAME_LENGTH} characters"
+    if not isinstance(message, str) or not message:
+        return None, "msg is required"
+    if len(message.encode('utf-8')) > MAX_MESSAGE_BYTES:
+        return None, f"msg must be at most {MAX_MESSAGE_BYTES} bytes"
+
+    created_at = item.get('created_at')
+    if created_at is None:
+        created_at = utcnow()
+    else:
+        try:
+            created_at = parse_created_at(created_at)
+        except (TypeError, ValueError):
+            return None, "created_at must be an ISO 8601 timestamp"
+
+    return {"room": room, "username": username, "message": message,
+            "created_at": created_at}, None
@@ -0,0 +1,98 @@
+"""Where request time goes, per endpoint and method.
+
+- `@instrumented` on a view records total handler time in
+  `chatapp_handler_seconds`.
+- `with timed('serialize'):` records one phase of a handler in
+  `chatapp_phase_seconds{phase=...}`.
+- SQLAlchemy cursor hooks add up every statement a request runs: the total is
+  recorded as the `db` phase and the count in `chatapp_db_queries_per_request`.
+
+Labels come from the current request; work outside a request (background
+threads) is not recorded.
+"""
+import functools
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from prometheus_client import Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+HANDLER_SECONDS = Histogram('chatapp_handler_seconds', 'Total time spent in a request handler',
+                            ['endpoint', 'method'])
+PHASE_SECONDS = Histogram('chatapp_phase_seconds', 'Time spent in one phase of a request handler',
+                          ['endpoint', 'method', 'phase'])
+QUERIES_PER_REQUEST = Histogram('chatapp_db_queries_per_request', 'SQL statements executed per request',
+                                ['endpoint', 'method'], buckets=[0, 1, 2, 3, 5, 10, 20, 50, 100])
+
+
+def request_labels():
+    return {"endpoint": request.endpoint or 'unknown', "method": request.method}
+
+
+def observe_phase(phase, seconds):
+    if has_request_context():
+        PHASE_SECONDS.labels(phase=phase, **request_labels()).observe(seconds)
+
+
+@contextmanager
+def timed(phase):
+    """Record the duration of the enclosed block as `phase` of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(phase, time.perf_counter() - start)
+
+
+def instrumented(view):
+    """Record the total time spent in `view`"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            HANDLER_SECONDS.labels(**request_labels()).observe(time.perf_counter() - start)
+    return wrapper
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    # Failed statements never reach after_cursor_execute
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+
+def init_instrumentation(app):
+    """Count queries and database time for every request of `app`"""
+    @app.before_request
+    def start_query_count():
+        g.db_queries = 0
+        g.db_seconds = 0.0
+
+    @app.teardown_request
+    def record_query_count(exc):
+        if 'db_queries' not in g:
+            return
+        labels = request_labels()
+        QUERIES_PER_REQUEST.labels(**labels).observe(g.db_queries)
+        PHASE_SECONDS.labels(phase='db', **labels).observe(g.db_seconds)
+        g.pop('db_queries')
+        g.pop('db_seconds')
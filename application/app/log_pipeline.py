@@ -0,0 +1,141 @@
+"""Non-blocking output for structured logs.
+
+Request threads only put records on a bounded in-memory queue; a single
+listener thread serializes them to JSON and writes them to stderr. When the
+queue is full (output blocked or a log storm), records are dropped instead of
+stalling requests, and counted in `chatapp_log_records_dropped_total`.
+
+    LOG_QUEUE_SIZE            records buffered before the policy applies (10000)
+    LOG_QUEUE_POLICY          drop: discard new records when full (default)
+                              block: wait up to LOG_QUEUE_BLOCK_SECONDS, then drop
+    LOG_QUEUE_BLOCK_SECONDS   see above (0.05)
+
+JSON is encoded with `orjson` when it is installed, else the standard library.
+
+`AccessLogPolicy` decides which requests get an access-log line:
+
+    LOG_ACCESS_EXCLUDE        paths never logged, comma separated (/health,/metrics)
+    LOG_ACCESS_SAMPLE_RATE    fraction of other requests logged (1.0)
+    LOG_ACCESS_SAMPLE_RATES   per-prefix overrides, e.g. "/static=0.1,/api/chat=0.5";
+                              the longest matching prefix wins
+
+Server errors (5xx) are always logged.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from prometheus_client import Counter
+
+try:
+    import orjson  # optional, several times faster than json.dumps
+except ImportError:
+    orjson = None
+
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_QUEUE_POLICY = os.getenv('LOG_QUEUE_POLICY', 'drop').lower()
+LOG_QUEUE_BLOCK_SECONDS = float(os.getenv('LOG_QUEUE_BLOCK_SECONDS', '0.05'))
+
+LOG_ACCESS_EXCLUDE = os.getenv('LOG_ACCESS_EXCLUDE', '/health,/metrics')
+LOG_ACCESS_SAMPLE_RATE = float(os.getenv('LOG_ACCESS_SAMPLE_RATE', '1.0'))
+LOG_ACCESS_SAMPLE_RATES = os.getenv('LOG_ACCESS_SAMPLE_RATES', '')
+
+RECORDS_DROPPED = Counter('chatapp_log_records_dropped_total',
+                          'Log records dropped because the log queue was full', ['level'])
+
+
+def dumps(entry):
+    """Serialize a log entry to a JSON string; unknown types are stringified"""
+    if orjson is not None:
+        return orjson.dumps(entry, default=str).decode()
+    return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records carrying a `structured` dict; plain records pass through"""
+
+    def format(self, record):
+        entry = getattr(record, 'structured', None)
+        if entry is None:
+            return super().format(record)
+        if record.exc_info:
+            entry = {**entry, "exception": self.formatException(record.exc_info)}
+        return dumps(entry)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler that never blocks the caller for long and counts drops"""
+
+    def __init__(self, log_queue, policy=LOG_QUEUE_POLICY, block_seconds=LOG_QUEUE_BLOCK_SECONDS):
+        super().__init__(log_queue)
+        if policy not in ('drop', 'block'):
+            raise ValueError(f"Unknown LOG_QUEUE_POLICY {policy!r}; expected drop or block")
+        self.policy = policy
+        self.block_seconds = block_seconds
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread, not the request thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.policy == 'block':
+                self.queue.put(record, timeout=self.block_seconds)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            RECORDS_DROPPED.labels(level=record.levelname).inc()
+
+
+def start_log_pipeline(logger, stream=None, maxsize=LOG_QUEUE_SIZE, policy=LOG_QUEUE_POLICY):
+    """Route `logger` through a bounded queue to `stream`. Returns the running listener."""
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter('%(message)s'))
+
+    log_queue = queue.Queue(maxsize=maxsize)
+    logger.addHandler(BoundedQueueHandler(log_queue, policy))
+    # Records already went through the logger's own level check
+    listener = QueueListener(log_queue, output)
+    listener.start()
+    return listener
+
+
+class AccessLogPolicy:
+    """Per-path exclusion and sampling of access-log lines"""
+
+    def __init__(self, exclude=(), rates=None, default_rate=1.0):
+        self.exclude = frozenset(exclude)
+        # Longest prefix first, so the most specific rule wins
+        self.rates = sorted((rates or {}).items(), key=lambda rule: len(rule[0]), reverse=True)
+        self.default_rate = default_rate
+
+    @classmethod
+    def from_env(cls, exclude=LOG_ACCESS_EXCLUDE, rates=LOG_ACCESS_SAMPLE_RATES,
+                 default_rate=LOG_ACCESS_SAMPLE_RATE):
+        """Build a policy from the comma separated LOG_ACCESS_* settings"""
+        parsed = {}
+        for rule in filter(None, (part.strip() for part in rates.split(','))):
+            prefix, _, rate = rule.partition('=')
+            parsed[prefix.strip()] = float(rate)
+        return cls([path.strip() for path in exclude.split(',') if path.strip()],
+                   parsed, default_rate)
+
+    def rate_for(self, path):
+        if path in self.exclude:
+            return 0.0
+        for prefix, rate in self.rates:
+            if path.startswith(prefix):
+                return rate
+        return self.default_rate
+
+    def sample(self, path, status_code):
+        """Return the sampling rate if this request should be logged, else None"""
+        if status_code >= 500:
+            return 1.0
+        rate = self.rate_for(path)
+        if rate >= 1.0 or (rate > 0 and random.random() < rate):
+            return rate
+        return None
@@ -0,0 +1,377 @@
+"""Versioned schema migrations for the chat database.
+
+Migrations are plain functions registered with the `@migration` decorator and
+applied in version order by `run_migrations()` at startup. Applied versions are
+recorded in the `schema_version` table. On MySQL an advisory lock makes sure
+only one replica migrates at a time while the others wait.
+
+Every migration must be idempotent and additive so that old and new pods can
+run side by side during a rolling update: create what is missing, never drop
+or rename a column or table the previous release still reads. Index changes use
+MySQL online DDL (ALGORITHM=INPLACE, LOCK=NONE) so writes are not blocked.
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from sqlalchemy import (Column, DateTime, Integer, MetaData, String, Table,
+                        inspect, insert, select, text)
+from models import LEGACY_FIELDS, db, ChatEvent, RoomMember, RoomState, legacy_columns
+
+log = logging.getLogger(__name__)
+
+LOCK_NAME = 'chatapp_schema_migrations'
+LOCK_TIMEOUT_SECONDS = 300
+
+BACKFILL_ENABLED = os.getenv('BACKFILL_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on')
+BACKFILL_BATCH_SIZE = int(os.getenv('BACKFILL_BATCH_SIZE', '10000'))
+BACKFILL_POLL_SECONDS = float(os.getenv('BACKFILL_POLL_SECONDS', '60'))
+BACKFILL_LOCK_NAME = 'chatapp_legacy_backfill'
+
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a migration function under a unique version number"""
+    def decorator(func):
+        if any(existing == version for existing, _, _ in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+
+class MigrationLockTimeout(RuntimeError):
+    """Another pod held the schema lock for longer than LOCK_TIMEOUT_SECONDS"""
+
+
+@contextmanager
+def schema_lock(conn):
+    """Hold a MySQL advisory lock for the duration of the migration run"""
+    if conn.dialect.name != 'mysql':
+        yield
+        return
+
+    acquired = conn.execute(
+        text("SELECT GET_LOCK(:name, :timeout)"),
+        {"name": LOCK_NAME, "timeout": LOCK_TIMEOUT_SECONDS}
+    ).scalar()
+    if acquired != 1:
+        raise MigrationLockTimeout(f"Timed out waiting for migration lock {LOCK_NAME}")
+    try:
+        yield
+    finally:
+        conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+
+
+def index_names(conn, table):
+    return {index['name'] for index in inspect(conn).get_indexes(table)}
+
+
+def column_names(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+
+def create_index(conn, table, name, columns):
+    """Create an index unless it already exists. Returns True if created.
+
+    Indexes on columns the table does not have (e.g. legacy columns on a
+    freshly created schema) are skipped.
+    """
+    if name in index_names(conn, table):
+        return False
+    if not set(columns) <= column_names(conn, table):
+        return False
+
+    column_list = ', '.join(columns)
+    if conn.dialect.name == 'mysql':
+        conn.execute(text(
+            f"ALTER TABLE {table} ADD INDEX {name} ({column_list}), "
+            f"ALGORITHM=INPLACE, LOCK=NONE"
+        ))
+    else:
+        conn.execute(text(f"CREATE INDEX {name} ON {table} ({column_list})"))
+    return True
+
+
+def drop_index(conn, table, name):
+    """Drop an index if it exists. Returns True if dropped."""
+    if name not in index_names(conn, table):
+        return False
+
+    if conn.dialect.name == 'mysql':
+        conn.execute(text(
+            f"ALTER TABLE {table} DROP INDEX {name}, ALGORITHM=INPLACE, LOCK=NONE"
+        ))
+    else:
+        conn.execute(text(f"DROP INDEX {name}"))
+    return True
+
+
+def add_column(conn, table, name, ddl_type):
+    """Add a nullable column unless it already exists. Returns True if added."""
+    if name in column_names(conn, table):
+        return False
+
+    if conn.dialect.name == 'mysql':
+        conn.execute(text(
+            f"ALTER TABLE {table} ADD COLUMN {name} {ddl_type} NULL, "
+            f"ALGORITHM=INPLACE, LOCK=NONE"
+        ))
+    else:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl_type}"))
+    return True
+
+
+def backfill_created_at(conn, batch_size=10000, logger=None):
+    """Fill `chat.created_at` from the legacy `date`/`time` string columns.
+
+    Rows are converted server-side in id ranges of `batch_size`, committing
+    after every batch so locks stay short. Returns the number of rows updated.
+    Safe to run repeatedly, e.g. after old pods wrote rows during a rollout.
+    """
+    if not {'date', 'time', 'created_at'} <= column_names(conn, 'chat'):
+        return 0
+
+    if conn.dialect.name == 'mysql':
+        converted = "STR_TO_DATE(CONCAT(`date`, ' ', `time`), '%Y-%m-%d %H:%i:%s')"
+    elif conn.dialect.name == 'sqlite':
+        converted = "datetime(date || ' ' || time)"
+    else:
+        converted = "CAST(date || ' ' || time AS TIMESTAMP)"
+
+    low, high = conn.execute(text(
+        "SELECT MIN(id), MAX(id) FROM chat WHERE created_at IS NULL"
+    )).one()
+    conn.commit()
+    if low is None:
+        return 0
+
+    updated = 0
+    for start in range(low, high + 1, batch_size):
+        updated += conn.execute(text(
+            f"UPDATE chat SET created_at = {converted} "
+            f"WHERE id >= :start AND id < :end AND created_at IS NULL"
+        ), {"start": start, "end": start + batch_size}).rowcount
+        conn.commit()
+        if logger:
+            logger.info("Backfilled created_at batch",
+                        up_to_id=min(start + batch_size - 1, high), rows_updated=updated)
+    return updated
+
+
+def backfill_members(conn, batch_size=10000, logger=None):
+    """Point `chat.member_id` at room members built from the legacy `username` column.
+
+    Works through id ranges of `batch_size`: creates the members a range needs,
+    then links its rows, committing after every batch. Returns the number of
+    rows linked. Safe to run repeatedly, e.g. after old pods wrote rows during
+    a rollout.
+    """
+    if not {'username', 'member_id'} <= column_names(conn, 'chat'):
+        return 0
+
+    if conn.dialect.name == 'mysql':
+        # Legacy names keep their case and accents, like room_member.username
+        ignore, binary = 'INSERT IGNORE', 'BINARY '
+    else:
+        ignore, binary = 'INSERT OR IGNORE', ''
+
+    low, high = conn.execute(text(
+        "SELECT MIN(id), MAX(id) FROM chat WHERE member_id IS NULL"
+    )).one()
+    conn.commit()
+    if low is None:
+        return 0
+
+    updated = 0
+    for start in range(low, high + 1, batch_size):
+        bounds = {"start": start, "end": start + batch_size}
+        conn.execute(text(
+            f"{ignore} INTO room_member (room, username) "
+            f"SELECT DISTINCT room, {binary}username FROM chat "
+            f"WHERE id >= :start AND id < :end AND member_id IS NULL"
+        ), bounds)
+        updated += conn.execute(text(
+            f"UPDATE chat SET member_id = ("
+            f"SELECT m.id FROM room_member m "
+            f"WHERE m.room = chat.room AND m.username = {binary}chat.username) "
+            f"WHERE id >= :start AND id < :end AND member_id IS NULL"
+        ), bounds).rowcount
+        conn.commit()
+        if logger:
+            logger.info("Backfilled member_id batch",
+                        up_to_id=min(start + batch_size - 1, high), rows_updated=updated)
+    return updated
+
+
+def applied_versions(conn):
+    return set(conn.execute(select(schema_version.c.version)).scalars())
+
+
+def pending_migrations(conn):
+    applied = applied_versions(conn)
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m[0]) if m[0] not in applied]
+
+
+def run_migrations(database=db, logger=None):
+    """Apply all pending migrations and return the list of applied versions"""
+    applied = []
+    with database.engine.connect() as conn:
+        with schema_lock(conn):
+            schema_version.create(conn, checkfirst=True)
+            conn.commit()
+
+            for version, description, upgrade in pending_migrations(conn):
+                if logger:
+                    logger.info("Applying schema migration",
+                                version=version, description=description)
+                upgrade(conn)
+                conn.execute(insert(schema_version).values(
+                    version=version,
+                    description=description,
+                    applied_at=datetime.now(timezone.utc).replace(tzinfo=None),
+                ))
+                conn.commit()
+                applied.append(version)
+
+        # Read paths fall back to these for rows not backfilled yet
+        legacy_columns.clear()
+        legacy_columns.update(set(LEGACY_FIELDS) & column_names(conn, 'chat'))
+    return applied
+
+
+class LegacyBackfill:
+    """Background conversion of rows that only have the legacy columns.
+
+    Runs the batches of `flask backfill-created-at` and `flask backfill-members`
+    every BACKFILL_POLL_SECONDS, so existing rows are converted after an
+    upgrade without holding up startup, and rows old pods write during a
+    rolling update are converted soon after the last of them is gone. On MySQL
+    an advisory lock makes one pod do the work; finding nothing to do costs
+    two index lookups.
+    """
+
+    def __init__(self, database=db, batch_size=BACKFILL_BATCH_SIZE,
+                 poll_seconds=BACKFILL_POLL_SECONDS):
+        self.db = database
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, app):
+        self._thread = threading.Thread(target=self._run, args=(app,),
+                                        name='chat-legacy-backfill', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_seconds)
+
+    def _run(self, app):
+        while not self._stop.is_set():
+            try:
+                with app.app_context():
+                    self.run_once(app.logger)
+            except Exception:
+                log.exception("Legacy backfill failed")
+            self._stop.wait(self.poll_seconds)
+
+    def run_once(self, logger=None):
+        """Convert every pending row. Returns (created_at rows, member rows),
+        or None when another pod is backfilling."""
+        with self.db.engine.connect() as conn:
+            mysql = conn.dialect.name == 'mysql'
+            if mysql and conn.execute(text("SELECT GET_LOCK(:name, 0)"),
+                                      {"name": BACKFILL_LOCK_NAME}).scalar() != 1:
+                return None
+            try:
+                return (backfill_created_at(conn, self.batch_size, logger),
+                        backfill_members(conn, self.batch_size, logger))
+            finally:
+                if mysql:
+                    conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": BACKFILL_LOCK_NAME})
+
+
+@migration(1, "Create base tables")
+def create_base_tables(conn):
+    # Fresh databases get the current schema; existing tables are left alone
+    db.metadata.create_all(conn)
+
+
+@migration(2, "Add chat indexes on (room, id), (room, username) and (date)")
+def add_chat_indexes(conn):
+    create_index(conn, 'chat', 'ix_chat_room_id', ['room', 'id'])
+    create_index(conn, 'chat', 'ix_chat_room_username', ['room', 'username'])
+    create_index(conn, 'chat', 'ix_chat_date', ['date'])
+
+
+@migration(3, "Add indexed created_at timestamp replacing date/time strings")
+def add_created_at(conn):
+    ddl_type = 'DATETIME(6)' if conn.dialect.name == 'mysql' else 'DATETIME'
+    add_column(conn, 'chat', 'created_at', ddl_type)
+
+    legacy = {'date', 'time'} & column_names(conn, 'chat')
+    if legacy and conn.dialect.name == 'mysql':
+        # New releases stop writing the legacy columns, so they must accept NULL
+        conn.execute(text(
+            "ALTER TABLE chat MODIFY `date` VARCHAR(50) NULL, "
+            "MODIFY `time` VARCHAR(50) NULL, ALGORITHM=INPLACE, LOCK=NONE"
+        ))
+
+    # Existing rows are converted by LegacyBackfill after startup: converting
+    # a large table here would hold the schema lock and stall every other pod
+    create_index(conn, 'chat', 'ix_chat_created_at', ['created_at'])
+    drop_index(conn, 'chat', 'ix_chat_date')
+
+
+@migration(4, "Add chat_event table for cross-replica notifications")
+def add_chat_event(conn):
+    ChatEvent.__table__.create(conn, checkfirst=True)
+
+
+@migration(5, "Add room_member table referenced by chat.member_id")
+def add_room_members(conn):
+    RoomMember.__table__.create(conn, checkfirst=True)
+    add_column(conn, 'chat', 'member_id', 'INTEGER')
+
+    if 'username' in column_names(conn, 'chat') and conn.dialect.name == 'mysql':
+        # New releases stop writing the legacy column, so it must accept NULL
+        conn.execute(text(
+            "ALTER TABLE chat MODIFY username VARCHAR(50) NULL, "
+            "ALGORITHM=INPLACE, LOCK=NONE"
+        ))
+
+    # Existing rows are linked by LegacyBackfill after startup, like created_at
+    create_index(conn, 'chat', 'ix_chat_member_id', ['member_id'])
+
+
+@migration(6, "Add room_state table for non-locking room clears")
+def add_room_state(conn):
+    RoomState.__table__.create(conn, checkfirst=True)
+
+
+@migration(7, "Add room_state.generation for conditional history requests")
+def add_room_generation(conn):
+    add_column(conn, 'room_state', 'generation', 'INTEGER')
+
+
+@migration(8, "Compare room_member usernames byte for byte (utf8mb4_bin)")
+def binary_usernames(conn):
+    # Tables created by migration 5 before the model declared the collation.
+    # room_member holds one row per user and room, so the copy is quick.
+    if conn.dialect.name == 'mysql':
+        conn.execute(text(
+            "ALTER TABLE room_member MODIFY username VARCHAR(50) "
+            "CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL"
+        ))
@@ -1,5 +1,9 @@
+from datetime import datetime, time as dt_time, timezone
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy import delete, event, exists, func, insert, literal, literal_column, select, update
+from sqlalchemy.dialects import mysql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column, relationship
 
 
 class Base(DeclarativeBase):
@@ -8,15 +12,163 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 
+# DATETIME(6) on MySQL, plain DATETIME elsewhere (SQLite in tests)
+Timestamp = db.DateTime().with_variant(mysql.DATETIME(fsp=6), 'mysql')
+
+# Usernames compare byte for byte, so 'bob' and 'Bob' (or 'Jose' and 'José')
+# are different members; MySQL's default collation would make them one
+Username = db.String(50).with_variant(
+    mysql.VARCHAR(50, charset='utf8mb4', collation='utf8mb4_bin'), 'mysql')
+
+DATE_FORMAT = '%Y-%m-%d'
+TIME_FORMAT = '%H:%M:%S'
+
+
+def utcnow():
+    """Current UTC time as a naive datetime, the way it is stored in the database"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def start_of_day(moment):
+    """Midnight of the given naive UTC datetime"""
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def format_line(created_at, username, message):
+    """One message the way room history is returned as text"""
+    return f"[{created_at.strftime(DATE_FORMAT)} {created_at.strftime(TIME_FORMAT)}] {username}: {message}"
+
+
+# Legacy `chat` columns of databases upgraded from the string schema, as found
+# by run_migrations(). Rows written by old pods during a rolling update, and
+# rows the backfills have not reached yet, have no `created_at` or `member_id`
+# and are read through these instead.
+LEGACY_FIELDS = ('date', 'time', 'username')
+legacy_columns = set()
+
+
+def legacy_fields():
+    """Extra select columns with the legacy values; none on a current schema"""
+    return [literal_column(f"chat.{name}").label(f"legacy_{name}")
+            for name in LEGACY_FIELDS if name in legacy_columns]
+
+
+def legacy_timestamp(date, time):
+    if not date or not time:
+        return None
+    return datetime.strptime(f"{date} {time}", f"{DATE_FORMAT} {TIME_FORMAT}")
+
+
+def history_fields(row):
+    """(created_at, username, message) of a row selected as
+    `Chat.created_at, RoomMember.username, Chat.message, *legacy_fields()`
+    with an outer join on the member"""
+    values = row._mapping
+    created_at = values['created_at']
+    if created_at is None:
+        created_at = legacy_timestamp(values.get('legacy_date'), values.get('legacy_time'))
+    username = values['username']
+    if username is None:
+        username = values.get('legacy_username')
+    return created_at, username, values['message']
+
+
+def history_line(row):
+    return format_line(*history_fields(row))
+
+
+def with_legacy(rows):
+    """Chat entities of a `select(Chat, *legacy_fields())` result"""
+    entries = []
+    for row in rows:
+        entry = row[0]
+        if len(row) > 1:
+            values = row._mapping
+            entry._legacy = {name: values.get(f"legacy_{name}") for name in LEGACY_FIELDS}
+        entries.append(entry)
+    return entries
+
+
+class RoomMember(db.Model):
+    """A username within one room. Messages reference their member, so a
+    rename updates this single row instead of every message."""
+    __tablename__ = 'room_member'
+    __table_args__ = (
+        db.UniqueConstraint('room', 'username', name='uq_room_member_room_username'),
+    )
+
+    id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
+    room: Mapped[str] = mapped_column(db.String(50), nullable=False)
+    username: Mapped[str] = mapped_column(Username, nullable=False)
+
 
 class Chat(db.Model):
+    __table_args__ = (
+        db.Index('ix_chat_room_id', 'room', 'id'),
+        db.Index('ix_chat_member_id', 'member_id'),
+        db.Index('ix_chat_created_at', 'created_at'),
+    )
+
     id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
     room: Mapped[str] = mapped_column(db.String(50), nullable=False)
-    date: Mapped[str] = mapped_column(db.String(50), nullable=False)
-    time: Mapped[str] = mapped_column(db.String(50), nullable=False)
-    username: Mapped[str] = mapped_column(db.String(50), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(Timestamp, nullable=False, default=utcnow)
+    member_id: Mapped[int] = mapped_column(db.ForeignKey('room_member.id'), nullable=False)
     message: Mapped[str] = mapped_column(db.Text, nullable=False)
 
+    # Outer join: rows old pods wrote during a rollout have no member yet
+    member: Mapped[RoomMember] = relationship(lazy='joined')
+
+    # Name given to a new or re-assigned message; resolved to a member on flush
+    _username = None
+    # Legacy column values of a row not backfilled yet (see `with_legacy`)
+    _legacy = None
+
+    @property
+    def username(self):
+        if self._username is not None:
+            return self._username
+        if self.member is not None:
+            return self.member.username
+        return self._legacy.get('username') if self._legacy else None
+
+    @username.setter
+    def username(self, value):
+        self._username = value
+        self.member_id = None
+
+    # `date` and `time` used to be separate string columns. They are kept as
+    # views over `created_at` so the API output and callers stay unchanged.
+    @property
+    def timestamp(self):
+        """created_at, or the legacy date and time of a row not backfilled yet"""
+        if self.created_at is None and self._legacy:
+            return legacy_timestamp(self._legacy.get('date'), self._legacy.get('time'))
+        return self.created_at
+
+    @property
+    def date(self):
+        return self.timestamp.strftime(DATE_FORMAT) if self.timestamp else None
+
+    @date.setter
+    def date(self, value):
+        day = datetime.strptime(value, DATE_FORMAT).date()
+        current = self.created_at or datetime.combine(day, dt_time())
+        self.created_at = datetime.combine(day, current.time())
+
+    @property
+    def time(self):
+        return self.timestamp.strftime(TIME_FORMAT) if self.timestamp else None
+
+    @time.setter
+    def time(self, value):
+        moment = datetime.strptime(value, TIME_FORMAT).time()
+        current = self.created_at or utcnow()
+        self.created_at = datetime.combine(current.date(), moment)
+
+    def to_line(self):
+        """Format the message the way room history is returned as text"""
+        return format_line(self.timestamp, self.username, self.message)
+
     def to_dict(self):
         return {
             "room": self.room,
@@ -25,3 +177,153 @@ class Chat(db.Model):
             "username": self.username,
             "message": self.message
         }
+
+    def to_event(self):
+        """Payload pushed to streaming clients for this message"""
+        return {"id": self.id, **self.to_dict()}
+
+
+class RoomState(db.Model):
+    """Clear watermark of a room. Messages up to `cleared_through_id` are
+    hidden as soon as the room is cleared and deleted later in batches.
+
+    `generation` counts changes to messages already posted (renames, clears,
+    retention). With the newest message id it identifies a room's history.
+    """
+    __tablename__ = 'room_state'
+
+    room: Mapped[str] = mapped_column(db.String(50), primary_key=True)
+    cleared_through_id: Mapped[int] = mapped_column(db.Integer, nullable=False, default=0)
+    purged_through_id: Mapped[int] = mapped_column(db.Integer, nullable=False, default=0)
+    cleared_at: Mapped[datetime] = mapped_column(Timestamp, nullable=True)
+    generation: Mapped[int] = mapped_column(db.Integer, nullable=True, default=0)
+
+
+def bump_generation(connection, rooms=None):
+    """Record that existing messages of `rooms` (every room when None) changed"""
+    add_states = (insert(RoomState)
+                  .prefix_with('IGNORE', dialect='mysql')
+                  .prefix_with('OR IGNORE', dialect='sqlite'))
+    bump = update(RoomState).values(generation=func.coalesce(RoomState.generation, 0) + 1)
+
+    if rooms is None:
+        connection.execute(add_states.from_select(
+            ['room', 'cleared_through_id', 'purged_through_id', 'generation'],
+            select(RoomMember.room, literal(0), literal(0), literal(0)).distinct()))
+        connection.execute(bump)
+        return
+
+    rooms = sorted(set(rooms))
+    if rooms:
+        connection.execute(add_states, [{"room": room, "cleared_through_id": 0,
+                                         "purged_through_id": 0, "generation": 0}
+                                        for room in rooms])
+        connection.execute(bump.where(RoomState.room.in_(rooms)))
+
+
+def not_cleared(room=None):
+    """Condition hiding messages of cleared rooms that are not purged yet.
+
+    With `room`, the watermark is looked up once for that room; without, it is
+    correlated per message for queries spanning rooms.
+    """
+    watermark = select(RoomState.cleared_through_id)
+    if room is None:
+        watermark = watermark.where(RoomState.room == Chat.room).correlate(Chat)
+    else:
+        watermark = watermark.where(RoomState.room == room)
+    return Chat.id > func.coalesce(watermark.scalar_subquery(), 0)
+
+
+def delete_orphan_members(connection, room):
+    """Delete members of `room` no message refers to any more. Returns how many."""
+    return connection.execute(
+        delete(RoomMember)
+        .where(RoomMember.room == room, ~exists().where(Chat.member_id == RoomMember.id))
+    ).rowcount
+
+
+def retry_member_race(session, write):
+    """Run `write()` (which commits), once more if it hit a constraint.
+
+    The purge and retention delete members no message refers to. A writer that
+    resolved such a member just before then fails the chat -> room_member
+    foreign key; its second attempt looks the member up again and recreates it.
+    """
+    try:
+        return write()
+    except IntegrityError:
+        session.rollback()
+        return write()
+
+
+def member_ids(connection, pairs):
+    """Map (room, username) pairs to room_member ids, creating missing members.
+
+    Missing members are added with INSERT IGNORE, so writers racing to create
+    the same member both end up with the one row.
+    """
+    wanted = set(pairs)
+    ids = {}
+
+    def lookup(pairs, one_by_one=False):
+        rooms = {}
+        for room, username in pairs:
+            rooms.setdefault(room, []).append(username)
+        for room, usernames in rooms.items():
+            ids.update(((room, username), member_id) for member_id, username in connection.execute(
+                select(RoomMember.id, RoomMember.username)
+                .where(RoomMember.room == room, RoomMember.username.in_(usernames))
+            ))
+        if not one_by_one:
+            return
+        # The database may match names the dict does not (utf8mb4_bin still
+        # ignores trailing spaces); look those up one by one
+        for room, username in set(pairs) - ids.keys():
+            member_id = connection.execute(
+                select(RoomMember.id).where(RoomMember.room == room,
+                                            RoomMember.username == username)
+            ).scalar()
+            if member_id is not None:
+                ids[room, username] = member_id
+
+    lookup(wanted)
+    missing = wanted - ids.keys()
+    if missing:
+        connection.execute(
+            insert(RoomMember)
+            .prefix_with('IGNORE', dialect='mysql')
+            .prefix_with('OR IGNORE', dialect='sqlite'),
+            [{"room": room, "username": username} for room, username in missing]
+        )
+        lookup(missing, one_by_one=True)
+    return ids
+
+
+@event.listens_for(Session, 'before_flush')
+def assign_members(session, flush_context, instances):
+    """Point messages given a username at that username's room member"""
+    pending = [entry for entry in list(session.new) + list(session.dirty)
+               if isinstance(entry, Chat) and entry._username and entry.room
+               and entry.member_id is None]
+    if not pending:
+        return
+
+    ids = member_ids(session.connection(),
+                     {(entry.room, entry._username) for entry in pending})
+    for entry in pending:
+        entry.member_id = ids.get((entry.room, entry._username))
+
+
+class ChatEvent(db.Model):
+    """Outbox of room events (renames, clears) relayed between replicas"""
+    __tablename__ = 'chat_event'
+
+    id: Mapped[int] = mapped_column(
+        db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    origin: Mapped[str] = mapped_column(db.String(64), nullable=False)
+    room: Mapped[str] = mapped_column(db.String(50), nullable=False)
+    event: Mapped[str] = mapped_column(db.String(20), nullable=False)
+    payload: Mapped[str] = mapped_column(db.Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(Timestamp, nullable=False,
+                                                 default=utcnow, index=True)
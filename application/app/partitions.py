@@ -0,0 +1,187 @@
+"""Monthly RANGE partitioning of the chat table (MySQL only).
+
+`flask partitions enable` converts `chat` to
+
+    PARTITION BY RANGE COLUMNS(created_at) (
+        PARTITION p202505 VALUES LESS THAN ('2025-06-01'),
+        ...
+        PARTITION pmax VALUES LESS THAN (MAXVALUE))
+
+and keeps PARTITION_MONTHS_AHEAD empty months ready. Queries bounded by
+`created_at` (today's messages, the 7-day window) then only read the months
+they need. `flask partitions maintain`, run nightly by the Helm chart, adds
+upcoming months and drops whole months older than PARTITION_RETENTION_MONTHS. Dropping a month is
+instant but skips the archive; run `flask retention` first if you need one.
+
+MySQL requires the partitioning column in every unique key and does not allow
+foreign keys on partitioned tables, so the conversion changes the primary key
+to (id, created_at) and drops the chat -> room_member foreign key. The
+conversion rebuilds the table and blocks writes while it runs, so it is never
+done at startup: with CHAT_PARTITIONING enabled startup only reports the
+partition state (`partition_status`).
+"""
+import logging
+import os
+from datetime import datetime
+from sqlalchemy import inspect, text
+from migrations import schema_lock
+from models import bump_generation, db, utcnow
+
+log = logging.getLogger(__name__)
+
+CHAT_PARTITIONING = os.getenv('CHAT_PARTITIONING', 'false').lower() in ('1', 'true', 'yes', 'on')
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', '3'))
+PARTITION_RETENTION_MONTHS = int(os.getenv('PARTITION_RETENTION_MONTHS', '0'))
+
+TABLE = 'chat'
+CATCH_ALL = 'pmax'
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"p{month:%Y%m}"
+
+
+def month_of(name):
+    """Month a partition named pYYYYMM holds, or None for other partitions"""
+    try:
+        return datetime.strptime(name[1:], '%Y%m')
+    except ValueError:
+        return None
+
+
+def partition_definitions(months):
+    """PARTITION clauses for the given months followed by the catch-all"""
+    clauses = [
+        f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d}')"
+        for month in months
+    ]
+    clauses.append(f"PARTITION {CATCH_ALL} VALUES LESS THAN (MAXVALUE)")
+    return ", ".join(clauses)
+
+
+def plan_partitions(existing, now, months_ahead=PARTITION_MONTHS_AHEAD,
+                    retention_months=PARTITION_RETENTION_MONTHS):
+    """Months to add and partitions to drop, given the existing partition names.
+
+    New months are only ever appended after the newest existing month, by
+    splitting the catch-all partition.
+    """
+    months = sorted(filter(None, (month_of(name) for name in existing)))
+    current = month_start(now)
+    newest = months[-1] if months else add_months(current, -1)
+
+    to_add = []
+    month = add_months(newest, 1)
+    while month <= add_months(current, months_ahead):
+        to_add.append(month)
+        month = add_months(month, 1)
+
+    to_drop = []
+    if retention_months:
+        oldest_kept = add_months(current, -retention_months)
+        to_drop = [partition_name(month) for month in months if month < oldest_kept]
+    return to_add, to_drop
+
+
+def partition_names(conn):
+    """Partitions of the chat table in order, empty if it is not partitioned"""
+    return list(conn.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table "
+        "AND PARTITION_NAME IS NOT NULL ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {"table": TABLE}).scalars())
+
+
+def enable_partitioning(conn, now=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Convert the chat table to monthly partitions. Returns False if it already is."""
+    if partition_names(conn):
+        return False
+
+    now = now or utcnow()
+    missing = conn.execute(text(
+        f"SELECT COUNT(*) FROM {TABLE} WHERE created_at IS NULL")).scalar()
+    if missing:
+        raise RuntimeError(f"{missing} messages have no created_at; "
+                           f"run `flask backfill-created-at` first")
+
+    oldest = conn.execute(text(f"SELECT MIN(created_at) FROM {TABLE}")).scalar()
+    first = month_start(oldest or now)
+    months = [first]
+    while months[-1] < add_months(month_start(now), months_ahead):
+        months.append(add_months(months[-1], 1))
+
+    for foreign_key in inspect(conn).get_foreign_keys(TABLE):
+        conn.execute(text(f"ALTER TABLE {TABLE} DROP FOREIGN KEY {foreign_key['name']}"))
+    conn.execute(text(
+        f"ALTER TABLE {TABLE} MODIFY created_at DATETIME(6) NOT NULL, "
+        f"DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at)"
+    ))
+    conn.execute(text(
+        f"ALTER TABLE {TABLE} PARTITION BY RANGE COLUMNS(created_at) "
+        f"({partition_definitions(months)})"
+    ))
+    conn.commit()
+    log.info("Partitioned %s into %d months from %s", TABLE, len(months), partition_name(first))
+    return True
+
+
+def maintain_partitions(conn, now=None, months_ahead=PARTITION_MONTHS_AHEAD,
+                        retention_months=PARTITION_RETENTION_MONTHS):
+    """Pre-create upcoming months and drop expired ones. Returns (added, dropped) names."""
+    existing = partition_names(conn)
+    if not existing:
+        return [], []
+
+    to_add, to_drop = plan_partitions(existing, now or utcnow(), months_ahead, retention_months)
+    if to_add:
+        conn.execute(text(
+            f"ALTER TABLE {TABLE} REORGANIZE PARTITION {CATCH_ALL} "
+            f"INTO ({partition_definitions(to_add)})"
+        ))
+    if to_drop:
+        conn.execute(text(f"ALTER TABLE {TABLE} DROP PARTITION {', '.join(to_drop)}"))
+        # Any room may have lost messages; cached histories must be refetched
+        bump_generation(conn)
+    conn.commit()
+
+    added = [partition_name(month) for month in to_add]
+    if added or to_drop:
+        log.info("Maintained %s partitions: added %s, dropped %s", TABLE, added, to_drop)
+    return added, to_drop
+
+
+def ensure_partitions(database=db, convert=True, drop_expired=False):
+    """Make sure upcoming months exist, partitioning the table first if `convert`.
+
+    Startup only adds months; dropping expired ones is left to the scheduled
+    `flask partitions maintain`. Returns (added, dropped) partition names.
+    """
+    with database.engine.connect() as conn:
+        if conn.dialect.name != 'mysql':
+            raise RuntimeError("Partitioning the chat table requires MySQL")
+        with schema_lock(conn):
+            if convert:
+                enable_partitioning(conn)
+            return maintain_partitions(
+                conn, retention_months=PARTITION_RETENTION_MONTHS if drop_expired else 0)
+
+
+def partition_status(database=db, now=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Existing partitions and the upcoming months still missing, without DDL or locks"""
+    with database.engine.connect() as conn:
+        if conn.dialect.name != 'mysql':
+            raise RuntimeError("Partitioning the chat table requires MySQL")
+        existing = partition_names(conn)
+    if not existing:
+        return [], []
+    to_add, _ = plan_partitions(existing, now or utcnow(), months_ahead, retention_months=0)
+    return existing, [partition_name(month) for month in to_add]
@@ -0,0 +1,190 @@
+"""Non-locking room clears.
+
+Clearing a room only moves its watermark in `room_state` to the newest message
+id, a single-row write. Reads filter on the watermark (`models.not_cleared`),
+so the messages disappear at once. `RoomPurger` then deletes them in small id
+batches with a pause in between, which keeps row locks short and the
+replication stream smooth, however big the room was.
+
+On MySQL an advisory lock makes one pod purge at a time; the others skip.
+"""
+import logging
+import os
+import threading
+from prometheus_client import Counter
+from sqlalchemy import delete, func, insert, select, text, update
+from models import Chat, RoomState, db, delete_orphan_members, utcnow
+
+log = logging.getLogger(__name__)
+
+ROOM_PURGE_ENABLED = os.getenv('ROOM_PURGE_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on')
+ROOM_PURGE_BATCH_SIZE = int(os.getenv('ROOM_PURGE_BATCH_SIZE', '1000'))
+ROOM_PURGE_PAUSE_SECONDS = float(os.getenv('ROOM_PURGE_PAUSE_SECONDS', '0.1'))
+ROOM_PURGE_POLL_SECONDS = float(os.getenv('ROOM_PURGE_POLL_SECONDS', '5'))
+
+LOCK_NAME = 'chatapp_room_purge'
+
+PURGED_MESSAGES = Counter('chatapp_purged_messages_total',
+                          'Messages of cleared rooms deleted by the background purge')
+
+
+def clear_room(room, database=db):
+    """Hide every message currently in `room`. Returns the number hidden."""
+    session = database.session
+    through = session.execute(
+        select(func.max(Chat.id)).where(Chat.room == room)
+    ).scalar() or 0
+
+    # Create the room's row if needed, then lock it so concurrent clears queue up
+    session.execute(
+        insert(RoomState)
+        .prefix_with('IGNORE', dialect='mysql')
+        .prefix_with('OR IGNORE', dialect='sqlite'),
+        {"room": room, "cleared_through_id": 0, "purged_through_id": 0}
+    )
+    state = session.execute(
+        select(RoomState).where(RoomState.room == room).with_for_update()
+    ).scalar_one()
+
+    hidden = 0
+    if through > state.cleared_through_id:
+        hidden = session.execute(
+            select(func.count(Chat.id)).where(
+                Chat.room == room,
+                Chat.id > state.cleared_through_id,
+                Chat.id <= through)
+        ).scalar()
+        state.cleared_through_id = through
+        state.cleared_at = utcnow()
+        state.generation = (state.generation or 0) + 1
+    session.commit()
+    return hidden
+
+
+def clear_progress(room, database=db):
+    """Watermarks of `room` and how many hidden messages are still stored"""
+    session = database.session
+    state = session.get(RoomState, room)
+    if state is None:
+        return {"room": room, "cleared_through_id": 0, "purged_through_id": 0,
+                "cleared_at": None, "pending_messages": 0, "status": "idle"}
+
+    pending = 0
+    if state.purged_through_id < state.cleared_through_id:
+        pending = session.execute(
+            select(func.count(Chat.id)).where(
+                Chat.room == room, Chat.id <= state.cleared_through_id)
+        ).scalar()
+    return {
+        "room": room,
+        "cleared_through_id": state.cleared_through_id,
+        "purged_through_id": state.purged_through_id,
+        "cleared_at": state.cleared_at.isoformat() if state.cleared_at else None,
+        "pending_messages": pending,
+        "status": "purging" if state.purged_through_id < state.cleared_through_id else "idle",
+    }
+
+
+class RoomPurger:
+    """Background deletion of messages hidden by room clears"""
+
+    def __init__(self, database=db, batch_size=ROOM_PURGE_BATCH_SIZE,
+                 pause_seconds=ROOM_PURGE_PAUSE_SECONDS, poll_seconds=ROOM_PURGE_POLL_SECONDS):
+        self.db = database
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, app):
+        self._thread = threading.Thread(target=self._run, args=(app,),
+                                        name='chat-room-purge', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_seconds)
+
+    def _run(self, app):
+        while not self._stop.is_set():
+            deleted = None
+            try:
+                with app.app_context():
+                    deleted = self.purge_once()
+            except Exception:
+                log.exception("Room purge failed")
+            self._stop.wait(self.poll_seconds if deleted is None else self.pause_seconds)
+
+    def purge_once(self):
+        """Delete one batch of hidden messages. Returns the number deleted, or
+        None when no cleared room has messages left (or another pod is purging)."""
+        session = self.db.session
+        try:
+            # The lock lives on its own connection: the session returns its
+            # connection to the pool on every commit, and RELEASE_LOCK must run
+            # on the connection that took the lock
+            with self.db.engine.connect() as lock_conn:
+                if not self._acquire(lock_conn):
+                    return None
+                try:
+                    return self._purge_batch()
+                finally:
+                    self._release(lock_conn)
+        finally:
+            session.remove()
+
+    def purge_all(self):
+        """Purge until every cleared room is empty. Returns the number of messages deleted."""
+        total = 0
+        while (deleted := self.purge_once()) is not None:
+            total += deleted
+        return total
+
+    def _purge_batch(self):
+        session = self.db.session
+        state = session.execute(
+            select(RoomState)
+            .where(RoomState.purged_through_id < RoomState.cleared_through_id)
+            .order_by(RoomState.room)
+            .limit(1)
+        ).scalar()
+        if state is None:
+            return None
+
+        room, through = state.room, state.cleared_through_id
+        ids = session.execute(
+            select(Chat.id)
+            .where(Chat.room == room, Chat.id <= through)
+            .order_by(Chat.id)
+            .limit(self.batch_size)
+        ).scalars().all()
+
+        if ids:
+            deleted = session.execute(delete(Chat).where(Chat.id.in_(ids))).rowcount
+            session.commit()
+            PURGED_MESSAGES.inc(deleted)
+            log.debug("Purged %d messages from cleared room %s", deleted, room)
+            return deleted
+
+        session.execute(
+            update(RoomState)
+            .where(RoomState.room == room)
+            .values(purged_through_id=through)
+        )
+        # Frees the names of members whose messages were all purged
+        delete_orphan_members(session.connection(), room)
+        session.commit()
+        log.info("Finished purging cleared room %s through id %d", room, through)
+        return 0
+
+    def _acquire(self, conn):
+        if conn.dialect.name != 'mysql':
+            return True
+        return conn.execute(
+            text("SELECT GET_LOCK(:name, 0)"), {"name": LOCK_NAME}).scalar() == 1
+
+    def _release(self, conn):
+        if conn.dialect.name == 'mysql':
+            conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
@@ -0,0 +1,195 @@
+"""Message retention: archive old messages, then delete them from `chat`.
+
+Limits are set per room, with a default for every other room:
+
+- RETENTION_MAX_AGE_DAYS: messages older than this many days are removed
+- RETENTION_MAX_MESSAGES: only the newest N messages of each room are kept
+- RETENTION_ROOM_POLICIES: per-room overrides, e.g. `general=30d,bots=7d/1000`
+  (`Nd` is an age limit in days, a plain number a message count limit, `0`
+  disables a limit)
+
+`flask retention` (or the Helm CronJob) walks every room in batches of
+RETENTION_BATCH_SIZE. Each batch is written to its own gzip NDJSON file under
+RETENTION_ARCHIVE_DIR, and uploaded to RETENTION_ARCHIVE_S3_URI when set
+(requires the optional `boto3` package), before its rows are deleted. A batch
+that is archived but not deleted is archived again on the next run under the
+same file name, so nothing is lost. The archive lines use the batch ingestion
+format, so a room can be restored with POST /api/messages/batch.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import timedelta
+from sqlalchemy import delete, distinct, func, or_, select
+from models import (Chat, RoomMember, bump_generation, db, delete_orphan_members, history_fields,
+                    legacy_fields, not_cleared, utcnow)
+
+log = logging.getLogger(__name__)
+
+RETENTION_MAX_AGE_DAYS = os.getenv('RETENTION_MAX_AGE_DAYS', '0')
+RETENTION_MAX_MESSAGES = os.getenv('RETENTION_MAX_MESSAGES', '0')
+RETENTION_ROOM_POLICIES = os.getenv('RETENTION_ROOM_POLICIES', '')
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '5000'))
+RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR', 'archive')
+RETENTION_ARCHIVE_S3_URI = os.getenv('RETENTION_ARCHIVE_S3_URI', '')
+
+
+def parse_limits(value):
+    """Parse `30d`, `1000` or `30d/1000` into (max_age_days, max_messages); 0 means no limit"""
+    max_age_days, max_messages = None, None
+    for token in filter(None, (part.strip() for part in str(value).split('/'))):
+        if token.endswith('d'):
+            max_age_days = float(token[:-1]) or None
+        else:
+            max_messages = int(token) or None
+    return max_age_days, max_messages
+
+
+class RetentionPolicy:
+    """Age and count limits per room"""
+
+    def __init__(self, max_age_days=None, max_messages=None, rooms=None):
+        self.default = (max_age_days, max_messages)
+        self.rooms = dict(rooms or {})
+
+    @classmethod
+    def from_env(cls, max_age_days=RETENTION_MAX_AGE_DAYS, max_messages=RETENTION_MAX_MESSAGES,
+                 rooms=RETENTION_ROOM_POLICIES):
+        """Build a policy from the RETENTION_* settings"""
+        parsed = {}
+        for rule in filter(None, (part.strip() for part in rooms.split(','))):
+            room, _, limits = rule.partition('=')
+            parsed[room.strip()] = parse_limits(limits)
+        return cls(float(max_age_days) or None, int(max_messages) or None, parsed)
+
+    def limits_for(self, room):
+        return self.rooms.get(room, self.default)
+
+    def applies_to_all_rooms(self):
+        return self.default != (None, None)
+
+
+def archive_name(room):
+    """File-system safe directory name for a room"""
+    return re.sub(r'[^A-Za-z0-9_-]', '_', room) or '_'
+
+
+class Archive:
+    """Writes archived batches to disk and, optionally, to S3"""
+
+    def __init__(self, directory=RETENTION_ARCHIVE_DIR, s3_uri=RETENTION_ARCHIVE_S3_URI,
+                 s3_client=None):
+        self.directory = directory
+        self.bucket, self.prefix = None, ''
+        if s3_uri:
+            match = re.match(r's3://([^/]+)/?(.*)', s3_uri)
+            if not match:
+                raise ValueError(f"RETENTION_ARCHIVE_S3_URI must look like s3://bucket/prefix, got {s3_uri!r}")
+            self.bucket, self.prefix = match.group(1), match.group(2).strip('/')
+            if s3_client is None:
+                import boto3  # optional dependency, only needed for S3 archives
+                s3_client = boto3.client('s3')
+        self.s3 = s3_client
+
+    def write(self, room, rows):
+        """Store one batch; returns where it was stored once it is safely written"""
+        first, last = rows[0]['id'], rows[-1]['id']
+        relative = os.path.join(archive_name(room), f"chat-{first}-{last}.ndjson.gz")
+        path = os.path.join(self.directory, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+                for row in rows:
+                    archive.write(json.dumps(row, ensure_ascii=False).encode('utf-8') + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+
+        if self.bucket:
+            key = '/'.join(filter(None, (self.prefix, relative.replace(os.sep, '/'))))
+            self.s3.upload_file(path, self.bucket, key)
+            os.remove(path)
+            return f"s3://{self.bucket}/{key}"
+        return path
+
+
+def expired(room, max_age_days, max_messages, session, now):
+    """Condition selecting the messages of `room` that exceed its limits, or None"""
+    conditions = []
+    if max_age_days:
+        conditions.append(Chat.created_at < now - timedelta(days=max_age_days))
+    if max_messages:
+        # Everything up to the newest message that no longer fits
+        newest_dropped = session.execute(
+            select(Chat.id)
+            .where(Chat.room == room, not_cleared(room))
+            .order_by(Chat.id.desc())
+            .offset(max_messages)
+            .limit(1)
+        ).scalar()
+        if newest_dropped is not None:
+            conditions.append(Chat.id <= newest_dropped)
+    return or_(*conditions) if conditions else None
+
+
+def apply_retention(policy, archive, database=db, batch_size=RETENTION_BATCH_SIZE,
+                    rooms=None, dry_run=False, now=None):
+    """Archive and delete expired messages. Returns {room: messages removed}."""
+    session = database.session
+    now = now or utcnow()
+    if rooms is None:
+        if policy.applies_to_all_rooms():
+            rooms = session.execute(select(distinct(Chat.room)).order_by(Chat.room)).scalars().all()
+        else:
+            rooms = sorted(policy.rooms)
+
+    removed = {}
+    for room in rooms:
+        condition = expired(room, *policy.limits_for(room), session, now)
+        if condition is None:
+            continue
+
+        # Messages hidden by a room clear are left to the purge, not archived
+        selected = (Chat.room == room, not_cleared(room), condition)
+        if dry_run:
+            removed[room] = session.execute(
+                select(func.count(Chat.id)).where(*selected)).scalar()
+            continue
+
+        count = 0
+        while True:
+            rows = session.execute(
+                select(Chat.id, Chat.room, Chat.created_at, RoomMember.username, Chat.message,
+                       *legacy_fields())
+                .outerjoin(Chat.member)
+                .where(*selected)
+                .order_by(Chat.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+
+            archived = []
+            for row in rows:
+                created_at, username, message = history_fields(row)
+                archived.append({
+                    "id": row.id,
+                    "room": row.room,
+                    "created_at": created_at.isoformat(),
+                    "username": username,
+                    "message": message,
+                })
+            location = archive.write(room, archived)
+            session.execute(delete(Chat).where(Chat.id.in_([row.id for row in rows])))
+            bump_generation(session.connection(), [room])
+            session.commit()
+            count += len(rows)
+            log.info("Archived %d messages of room %s to %s", len(rows), room, location)
+
+        if count:
+            delete_orphan_members(session.connection(), room)
+            session.commit()
+            removed[room] = count
+    return removed
@@ -0,0 +1,232 @@
+"""In-process cache of the newest messages of busy rooms.
+
+Each cached room keeps its last ROOM_CACHE_MESSAGES messages as formatted
+history lines together with the room's version (newest id and generation),
+so polls, tail reads and the history ETag of a hot room are answered from
+memory without a database round trip. Rooms are loaded on their first read
+and kept in least-recently-read order; when the lines of all rooms exceed
+ROOM_CACHE_MAX_BYTES the least recently read rooms are evicted.
+
+The cache is fed by room events: new messages are appended, renames, clears
+and bulk changes (batches, retention) drop the room so its next read reloads
+it; dropped partitions clear the whole cache. Writes on this replica reach the
+cache before the response is sent (see `publish_event` in routes); writes on
+other replicas and the retention and partition jobs arrive through the
+backplane. Entries older than ROOM_CACHE_TTL_SECONDS are reloaded, which
+bounds staleness from lost events (Redis backplane).
+"""
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from prometheus_client import Counter, Gauge
+from hub import ALL_ROOMS
+
+log = logging.getLogger(__name__)
+
+ROOM_CACHE_ENABLED = os.getenv('ROOM_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on')
+ROOM_CACHE_MESSAGES = int(os.getenv('ROOM_CACHE_MESSAGES', '500'))
+ROOM_CACHE_MAX_BYTES = int(os.getenv('ROOM_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+ROOM_CACHE_TTL_SECONDS = float(os.getenv('ROOM_CACHE_TTL_SECONDS', '30'))
+
+# Per-message bookkeeping on top of the line itself: the id and list slots
+ENTRY_OVERHEAD = 64
+
+CACHE_HITS = Counter('chatapp_room_cache_hits_total', 'History reads served from the room cache')
+CACHE_MISSES = Counter('chatapp_room_cache_misses_total', 'History reads that went to the database')
+CACHE_EVICTIONS = Counter('chatapp_room_cache_evictions_total',
+                          'Rooms evicted from the room cache to stay within its memory bound')
+CACHE_BYTES = Gauge('chatapp_room_cache_bytes', 'Estimated memory held by the room cache',
+                    multiprocess_mode='livesum')
+CACHE_ROOMS = Gauge('chatapp_room_cache_rooms', 'Rooms held in the room cache',
+                    multiprocess_mode='livesum')
+
+# lines: history lines, oldest first. last_id: newest line id for incremental
+# reads, the room's newest id for whole-room reads.
+CachedPage = namedtuple('CachedPage', 'lines last_id generation has_more')
+
+
+def message_size(line):
+    return sys.getsizeof(line) + ENTRY_OVERHEAD
+
+
+class RoomEntry:
+    """The cached tail of one room.
+
+    Every visible message with an id above `floor` is in `ids`/`lines`; a
+    floor of 0 means the entry holds the whole room.
+    """
+    __slots__ = ('ids', 'lines', 'floor', 'last_id', 'generation', 'size', 'loaded_at')
+
+    def __init__(self, messages, floor, last_id, generation):
+        self.ids = [message_id for message_id, _ in messages]
+        self.lines = [line for _, line in messages]
+        self.floor = floor
+        self.last_id = max(last_id, self.ids[-1] if self.ids else 0)
+        self.generation = generation
+        self.size = sum(message_size(line) for line in self.lines)
+        self.loaded_at = time.monotonic()
+
+    def add(self, message_id, line, capacity):
+        """Insert a message in id order; returns the change in size"""
+        self.last_id = max(self.last_id, message_id)
+        position = bisect.bisect_left(self.ids, message_id)
+        if message_id <= self.floor or (position < len(self.ids) and self.ids[position] == message_id):
+            # Outside the cached range, or already delivered
+            return 0
+        self.ids.insert(position, message_id)
+        self.lines.insert(position, line)
+        delta = message_size(line)
+        while len(self.ids) > capacity:
+            self.floor = self.ids.pop(0)
+            delta -= message_size(self.lines.pop(0))
+        self.size += delta
+        return delta
+
+    def page(self, after_id, limit, page_size):
+        """The requested page, or None when it reaches below the cached range"""
+        if after_id is not None:
+            if after_id < self.floor:
+                return None
+            start = bisect.bisect_right(self.ids, after_id)
+            lines = self.lines[start:start + page_size]
+            last_id = self.ids[start + len(lines) - 1] if lines else after_id
+            return CachedPage(lines, last_id, self.generation,
+                              len(self.ids) - start > page_size)
+        if limit is not None:
+            if limit > len(self.lines) and self.floor:
+                return None
+            return CachedPage(self.lines[-limit:], self.last_id, self.generation, False)
+        if self.floor:
+            return None
+        return CachedPage(list(self.lines), self.last_id, self.generation, False)
+
+
+class RoomCache:
+    def __init__(self, max_bytes=ROOM_CACHE_MAX_BYTES, room_messages=ROOM_CACHE_MESSAGES,
+                 ttl_seconds=ROOM_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.room_messages = room_messages
+        self.ttl_seconds = ttl_seconds
+        self.size = 0
+        self._lock = threading.Lock()
+        self._rooms = OrderedDict()
+        # room -> [loads in flight, invalidations and messages since the first of them]
+        self._loading = {}
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def page(self, room, load, after_id=None, limit=None, page_size=None):
+        """Serve a history read from memory, loading the room on a miss.
+
+        `load()` returns `(last_id, generation, messages)` with `messages` the
+        newest `room_messages + 1` visible `(id, line)` pairs, oldest first.
+        Returns a CachedPage, or None when the caller must query the database.
+        """
+        page_size = page_size or self.room_messages
+        with self._lock:
+            entry = self._rooms.get(room)
+            if entry is not None and time.monotonic() - entry.loaded_at > self.ttl_seconds:
+                self._drop(room)
+                entry = None
+            if entry is not None:
+                self._rooms.move_to_end(room)
+                page = entry.page(after_id, limit, page_size)
+                if page is not None:
+                    CACHE_HITS.inc()
+                else:
+                    # Reaches past the cached tail; reloading would not help
+                    CACHE_MISSES.inc()
+                return page
+            CACHE_MISSES.inc()
+            pending = self._loading.setdefault(room, [0, 0, []])
+            pending[0] += 1
+            seen = pending[1]
+            posted = len(pending[2])
+
+        try:
+            last_id, generation, messages = load()
+        finally:
+            with self._lock:
+                pending[0] -= 1
+                if not pending[0]:
+                    del self._loading[room]
+
+        if len(messages) > self.room_messages:
+            floor = messages[0][0]
+            messages = messages[1:]
+        else:
+            floor = 0
+        entry = RoomEntry(messages, floor, last_id, generation)
+
+        with self._lock:
+            # Messages posted while loading may be missing from the snapshot;
+            # ids already in it are skipped
+            for message_id, line in pending[2][posted:]:
+                entry.add(message_id, line, self.room_messages)
+            # Keep the snapshot unless history changed while loading (it may
+            # predate the change) or a concurrent load got there first; either
+            # way it is still a correct answer to this read
+            if pending[1] == seen and room not in self._rooms:
+                self._rooms[room] = entry
+                self.size += entry.size
+                self._evict()
+                self._update_gauges()
+        return entry.page(after_id, limit, page_size)
+
+    def add_message(self, room, data):
+        """Append a posted message (an event payload with its id) to a cached room"""
+        line = f"[{data['date']} {data['time']}] {data['username']}: {data['message']}"
+        with self._lock:
+            pending = self._loading.get(room)
+            if pending is not None:
+                pending[2].append((data['id'], line))
+            entry = self._rooms.get(room)
+            if entry is None:
+                return
+            self.size += entry.add(data['id'], line, self.room_messages)
+            self._evict()
+            self._update_gauges()
+
+    def invalidate(self, room):
+        """Forget a room whose existing history changed"""
+        with self._lock:
+            pending = self._loading.get(room)
+            if pending is not None:
+                pending[1] += 1
+            if room in self._rooms:
+                self._drop(room)
+                self._update_gauges()
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+            self.size = 0
+            self._update_gauges()
+
+    def on_event(self, room, event, data):
+        """Hub listener: keep cached rooms in step with room events"""
+        if event == 'message':
+            self.add_message(room, data)
+        elif room == ALL_ROOMS:
+            self.clear()
+        elif event in ('rename', 'clear', 'bulk'):
+            self.invalidate(room)
+
+    def _drop(self, room):
+        self.size -= self._rooms.pop(room).size
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._rooms:
+            room, entry = self._rooms.popitem(last=False)
+            self.size -= entry.size
+            CACHE_EVICTIONS.inc()
+            log.debug("Evicted room %s from the room cache (%d bytes)", room, entry.size)
+
+    def _update_gauges(self):
+        CACHE_BYTES.set(self.size)
+        CACHE_ROOMS.set(len(self._rooms))
@@ -1,13 +1,44 @@
-from flask import request, jsonify, render_template, current_app
-from models import Chat
-from datetime import datetime, timezone, timedelta
-from sqlalchemy import func, distinct
+from flask import request, jsonify, render_template, current_app, make_response, Response, stream_with_context
+from models import (Chat, DATE_FORMAT, RoomMember, RoomState, bump_generation, history_line,
+                    legacy_fields, member_ids, not_cleared, retry_member_race, utcnow,
+                    with_legacy)
+from hub import MessageHub
+from backplane import LocalBackplane
+from stats import ChatStats
+from database import execute_read, mark_write, pin_reads_after_write, reads_pinned_to_primary
+from instrumentation import init_instrumentation, instrumented, timed
+from ingest import BatchError, parse_batch, validate_item
+from purge import clear_progress, clear_room
+from write_buffer import WriteBufferFull
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timezone
 import csv
+import hashlib
+import json
 import os
+import time
 
 
 # Implemented by Erik
-NOW = datetime.now(timezone.utc)
+# Upper bound for a single page of room history (incremental fetches and `limit`)
+MAX_PAGE_SIZE = int(os.getenv('CHAT_MAX_PAGE_SIZE', '500'))
+
+# Server-Sent Events: keep-alive comment interval, maximum lifetime of one
+# stream (clients reconnect transparently) and client reconnect delay
+STREAM_HEARTBEAT_SECONDS = float(os.getenv('CHAT_STREAM_HEARTBEAT_SECONDS', '15'))
+STREAM_MAX_SECONDS = float(os.getenv('CHAT_STREAM_MAX_SECONDS', '300'))
+STREAM_RETRY_MS = int(os.getenv('CHAT_STREAM_RETRY_MS', '2000'))
+# Each open stream holds a worker thread; past this many per worker new
+# streams get a 503 (clients poll instead) so requests and probes keep threads
+STREAM_MAX_PER_WORKER = int(os.getenv('CHAT_STREAM_MAX_PER_WORKER',
+                                      str(int(os.getenv('GUNICORN_THREADS', '32')) // 2)))
+
+# Rows fetched per round trip when streaming a full room history
+HISTORY_CHUNK_ROWS = int(os.getenv('CHAT_HISTORY_CHUNK_ROWS', '1000'))
+
+# Bulk ingestion: items accepted per request, rows per INSERT statement
+BATCH_MAX_ITEMS = int(os.getenv('CHAT_BATCH_MAX_ITEMS', '10000'))
+BATCH_INSERT_ROWS = 1000
 
 def safe_log(level, message, **kwargs):
     """Safely log with structured data, falling back to simple logging"""
@@ -27,9 +58,167 @@ def safe_log(level, message, **kwargs):
         print(f"{level}: {message}")
 
 
+def parse_int_arg(*names):
+    """Return the first query argument found among `names` as a non-negative int.
+
+    Returns None when none of the arguments is present and raises ValueError
+    when the value is not a non-negative integer.
+    """
+    for name in names:
+        raw = request.args.get(name)
+        if raw is not None and raw != '':
+            value = int(raw)
+            if value < 0:
+                raise ValueError(f"{name} must be non-negative")
+            return value
+    return None
+
+
+def format_sse(event, data, event_id=None):
+    """Encode one Server-Sent Events frame"""
+    frame = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    if event_id is not None:
+        frame = f"id: {event_id}\n" + frame
+    return frame
+
+
+def publish_event(room, event, data):
+    """Notify subscribers on every replica; failures never fail the request"""
+    if current_app.room_cache is not None:
+        # This replica's cache must not wait for the backplane round trip
+        current_app.room_cache.on_event(room, event, data)
+    try:
+        current_app.backplane.publish(room, event, data)
+    except Exception as e:
+        safe_log("ERROR", "Failed to publish room event",
+                room=room, event=event, error=str(e))
+
+
+def room_version(db, room, read=execute_read):
+    """Newest message id and history generation of a room.
+
+    Both come from index lookups (`ix_chat_room_id` and the room_state primary
+    key) in one round trip; no message rows are read.
+    """
+    last_id, generation = read(db.select(
+        db.select(db.func.max(Chat.id)).where(Chat.room == room).scalar_subquery(),
+        db.select(RoomState.generation).where(RoomState.room == room).scalar_subquery(),
+    )).one()
+    return last_id or 0, generation or 0
+
+
+def set_version_headers(response, last_id, generation):
+    """ETag and cursor headers of a room history response"""
+    response.set_etag(f"{last_id}.{generation}")
+    # Clients may keep the body but must revalidate it before reuse
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Last-Message-Id'] = str(last_id)
+    response.headers['X-Room-Generation'] = str(generation)
+    return response
+
+
+def load_room_tail(db, room, count):
+    """Version and newest `count` + 1 visible messages of a room, for the room cache.
+
+    Read from the primary: a lagging replica could miss a message whose event
+    already went by, and the cache would then miss it until the entry expires.
+    """
+    last_id, generation = room_version(db, room, read=db.session.execute)
+    rows = db.session.execute(
+        db.select(Chat.id, Chat.created_at, RoomMember.username, Chat.message, *legacy_fields())
+        .outerjoin(Chat.member)
+        .where(Chat.room == room, Chat.id <= last_id, not_cleared(room))
+        .order_by(Chat.id.desc())
+        .limit(count + 1)
+    ).all()
+    return last_id, generation, [(row.id, history_line(row)) for row in reversed(rows)]
+
+
+def cached_history(db, room, after_id, limit):
+    """Answer a history read from the room cache, or None to query the database"""
+    cache = current_app.room_cache
+    page = cache.page(room, lambda: load_room_tail(db, room, cache.room_messages),
+                      after_id=after_id, limit=limit, page_size=limit or MAX_PAGE_SIZE)
+    if page is None:
+        return None
+
+    if after_id is not None:
+        if not page.lines:
+            response = make_response('', 204)
+        else:
+            response = make_response("\n".join(page.lines))
+            if page.has_more:
+                response.headers['X-Has-More'] = 'true'
+        response.headers['X-Last-Message-Id'] = str(page.last_id)
+        return response
+
+    if request.if_none_match.contains_weak(f"{page.last_id}.{page.generation}"):
+        return set_version_headers(make_response('', 304), page.last_id, page.generation)
+    return set_version_headers(make_response("\n".join(page.lines)),
+                               page.last_id, page.generation)
+
+
+def stream_history(db, room, last_id):
+    """Stream a room's full history without holding it in memory.
+
+    Rows are read in HISTORY_CHUNK_ROWS batches from a server-side cursor and
+    written out as they arrive, so memory stays flat however big the room is.
+    The history is bounded by `last_id`, the newest id at request time.
+    """
+    def generate():
+        if not last_id:
+            return
+        result = execute_read(
+            db.select(Chat.created_at, RoomMember.username, Chat.message, *legacy_fields())
+            .outerjoin(Chat.member)
+            .where(Chat.room == room, Chat.id <= last_id, not_cleared(room))
+            .order_by(Chat.id)
+            .execution_options(yield_per=HISTORY_CHUNK_ROWS)
+        )
+        separator = ''
+        try:
+            for rows in result.partitions():
+                yield separator + "\n".join(history_line(row) for row in rows)
+                separator = "\n"
+        except Exception as e:
+            # Headers are already sent; the client sees a truncated body
+            safe_log("ERROR", "Failed while streaming room history",
+                    room=room, error=str(e))
+            raise
+
+    return Response(stream_with_context(generate()), mimetype='text/html')
+
+
 def register_routes(app, db):
 
+    # Fan-out hub for streaming clients and the backplane that feeds it on
+    # every replica; create_app() installs the configured ones
+    if not hasattr(app, 'hub'):
+        app.hub = MessageHub()
+    if not hasattr(app, 'backplane'):
+        app.backplane = LocalBackplane(app.hub)
+
+    # Group commit for posts; create_app() starts one when WRITE_BUFFER_ENABLED
+    if not hasattr(app, 'write_buffer'):
+        app.write_buffer = None
+
+    # Newest messages of busy rooms; create_app() installs one when ROOM_CACHE_ENABLED
+    if not hasattr(app, 'room_cache'):
+        app.room_cache = None
+
+    # Counters behind /metrics/json, fed by the hub
+    if not hasattr(app, 'stats'):
+        app.stats = ChatStats(db)
+        app.hub.add_listener(app.stats.on_event)
+
+    # Clients that just wrote read from the primary until the replica catches up
+    app.after_request(pin_reads_after_write)
+
+    # Per-request query counts and database time
+    init_instrumentation(app)
+
     @app.route('/api/chat/<room>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+    @instrumented
     def chat(room):
         if request.method == 'POST':
             # Send new message
@@ -41,32 +230,43 @@ def register_routes(app, db):
                         room=room, username=username, has_message=bool(message))
                 return jsonify({"error": "Username and message are required"}), 400
 
-            chat_entry = Chat(
-                room=room,
-                date=NOW.strftime('%Y-%m-%d'),
-                time=NOW.strftime('%H:%M:%S'),
-                username=username,
-                message=message,
-            )
+            row = dict(room=room, created_at=utcnow(), username=username, message=message)
 
             try:
-                db.session.add(chat_entry)
-                db.session.commit()
+                with timed('write'):
+                    if current_app.write_buffer is not None:
+                        # Group commit: returns once the batch holding this message committed
+                        event = current_app.write_buffer.submit(**row).wait()
+                    else:
+                        def write():
+                            chat_entry = Chat(**row)
+                            db.session.add(chat_entry)
+                            db.session.commit()
+                            return chat_entry.to_event()
+                        event = retry_member_race(db.session, write)
+                mark_write()
+
+                with timed('publish'):
+                    publish_event(room, 'message', event)
 
                 # Update Prometheus metrics
                 current_app.metrics['messages_sent'].labels(room=room).inc()
                 current_app.metrics['message_length'].observe(len(message))
-                
-                # Update gauges with current totals
-                update_gauges()
 
                 safe_log("INFO", "New message posted successfully",
                         room=room, username=username, 
                         message_length=len(message),
-                        message_id=chat_entry.id)
+                        message_id=event['id'])
 
-                return jsonify(chat_entry.to_dict()), 201
-                
+                with timed('serialize'):
+                    return jsonify({key: value for key, value in event.items() if key != 'id'}), 201
+
+            except WriteBufferFull as e:
+                safe_log("WARNING", "Message post refused - write buffer full",
+                        room=room, username=username, error=str(e))
+                response = jsonify({"error": "Server busy, try again"})
+                response.headers['Retry-After'] = '1'
+                return response, 503
             except Exception as e:
                 db.session.rollback()
                 safe_log("ERROR", "Failed to save message to database",
@@ -74,19 +274,81 @@ def register_routes(app, db):
                 return jsonify({"error": "Failed to save message"}), 500
 
         elif request.method == 'GET':
-            # Get all messages in room
+            # Get messages in room. `after_id` (alias `since`) returns only
+            # messages newer than the cursor, `limit` caps the page size.
+            try:
+                after_id = parse_int_arg('after_id', 'since')
+                limit = parse_int_arg('limit')
+            except ValueError:
+                safe_log("WARNING", "Message fetch failed - invalid cursor parameters",
+                        room=room, args=dict(request.args))
+                return jsonify({"error": "after_id and limit must be non-negative integers"}), 400
+
+            if limit is not None:
+                limit = min(max(limit, 1), MAX_PAGE_SIZE)
+
             try:
-                chat_entries = db.session.execute(
-                    db.select(Chat).filter_by(room=room)).scalars().all()
+                # Clients that just wrote may have written through another
+                # worker or pod whose event has not reached this cache yet
+                if current_app.room_cache is not None and not reads_pinned_to_primary():
+                    with timed('cache'):
+                        response = cached_history(db, room, after_id, limit)
+                    if response is not None:
+                        return response
+
+                query = db.select(Chat, *legacy_fields()).filter_by(room=room).where(not_cleared(room))
+                has_more = False
+
+                if after_id is None:
+                    # Whole-room reads are conditional: an unchanged room costs
+                    # one index lookup and a header-only 304
+                    last_id, generation = room_version(db, room)
+                    etag = f"{last_id}.{generation}"
+                    if request.if_none_match.contains_weak(etag):
+                        return set_version_headers(make_response('', 304), last_id, generation)
+
+                if after_id is not None:
+                    # Incremental fetch: oldest first, one extra row to detect more pages
+                    page_size = limit or MAX_PAGE_SIZE
+                    chat_entries = with_legacy(execute_read(
+                        query.where(Chat.id > after_id)
+                        .order_by(Chat.id)
+                        .limit(page_size + 1)
+                    ))
+                    has_more = len(chat_entries) > page_size
+                    chat_entries = chat_entries[:page_size]
+                elif limit is not None:
+                    # Tail fetch: the most recent `limit` messages, oldest first
+                    chat_entries = with_legacy(execute_read(
+                        query.where(Chat.id <= last_id)
+                        .order_by(Chat.id.desc()).limit(limit)
+                    ))[::-1]
+                else:
+                    # Full history: streamed, never materialized
+                    safe_log("DEBUG", "Streaming full history for room", room=room)
+                    return set_version_headers(stream_history(db, room, last_id),
+                                               last_id, generation)
                 
-                safe_log("INFO", "Retrieved messages for room",
-                        room=room, message_count=len(chat_entries))
+                safe_log("DEBUG", "Retrieved messages for room",
+                        room=room, message_count=len(chat_entries),
+                        after_id=after_id)
+
+                if after_id is not None and not chat_entries:
+                    # Nothing new since the client's cursor
+                    response = make_response('', 204)
+                    response.headers['X-Last-Message-Id'] = str(after_id)
+                    return response
                 
-                chat_data = "\n".join(
-                    f"[{entry.date} {entry.time}] {entry.username}: {entry.message}"
-                    for entry in chat_entries
-                )
-                return chat_data
+                with timed('serialize'):
+                    chat_data = "\n".join(entry.to_line() for entry in chat_entries)
+                response = make_response(chat_data)
+                if after_id is None:
+                    set_version_headers(response, last_id, generation)
+                else:
+                    response.headers['X-Last-Message-Id'] = str(chat_entries[-1].id)
+                if has_more:
+                    response.headers['X-Has-More'] = 'true'
+                return response
                 
             except Exception as e:
                 safe_log("ERROR", "Failed to retrieve messages",
@@ -109,35 +371,69 @@ def register_routes(app, db):
                         room=room, username=old_username)
                 return jsonify({"error": "New username must be different from current username"}), 400
         
-            # Check if new username is already taken in this room
-            existing_user = db.session.execute(
-                db.select(Chat).filter_by(room=room, username=new_username)
-            ).scalar_one_or_none()
+            # A name is taken while its member has visible messages; members
+            # left with only cleared or deleted messages give their name up
+            name_taken = db.session.execute(
+                db.select(db.exists().where(RoomMember.room == room,
+                                            RoomMember.username == new_username,
+                                            Chat.member_id == RoomMember.id,
+                                            Chat.room == room,
+                                            not_cleared(room)))
+            ).scalar()
             
-            if existing_user:
+            if name_taken:
                 safe_log("WARNING", "Username update failed - username already exists",
                         room=room, old_username=old_username,
                         new_username=new_username)
                 return jsonify({"error": "Username already exists in this room"}), 400
         
-            # Update all messages from the old username to new username in this room
+            # Messages reference the member, so renaming it renames all of them
             try:
-                updated_count = db.session.execute(
-                    db.update(Chat)
-                    .where(Chat.room == room, Chat.username == old_username)
-                    .values(username=new_username)
-                ).rowcount
-                
-                db.session.commit()
-                
+                member_id = db.session.execute(
+                    db.select(RoomMember.id).filter_by(room=room, username=old_username)
+                ).scalar()
+                updated_count = 0
+                if member_id is not None:
+                    updated_count = db.session.execute(
+                        db.select(db.func.count(Chat.id))
+                        .where(Chat.member_id == member_id, not_cleared(room))
+                    ).scalar()
+
                 if updated_count == 0:
                     safe_log("WARNING", "Username update failed - no messages found",
                             room=room, old_username=old_username)
                     return jsonify({"error": "No messages found for this username in this room"}), 404
+
+                with timed('write'):
+                    stale_id = db.session.execute(
+                        db.select(RoomMember.id).filter_by(room=room, username=new_username)
+                    ).scalar()
+                    if stale_id is not None:
+                        # Merge the stale member: its remaining messages are
+                        # hidden, so moving them changes nothing visible
+                        db.session.execute(
+                            db.update(Chat)
+                            .where(Chat.member_id == stale_id)
+                            .values(member_id=member_id)
+                        )
+                        db.session.execute(db.delete(RoomMember).where(RoomMember.id == stale_id))
+                    db.session.execute(
+                        db.update(RoomMember)
+                        .where(RoomMember.id == member_id)
+                        .values(username=new_username)
+                    )
+                    bump_generation(db.session.connection(), [room])
+                    db.session.commit()
+                mark_write()
                 
+                with timed('publish'):
+                    publish_event(room, 'rename', {
+                        "old_username": old_username,
+                        "new_username": new_username
+                    })
+
                 # Update Prometheus metrics
                 current_app.metrics['username_changes'].inc()
-                update_gauges()
                 
                 safe_log("INFO", "Username updated successfully",
                         room=room, old_username=old_username,
@@ -151,6 +447,13 @@ def register_routes(app, db):
                     "messages_updated": updated_count
                 }), 200
                 
+            except IntegrityError:
+                # Another request took the name between the check and the update
+                db.session.rollback()
+                safe_log("WARNING", "Username update failed - username already exists",
+                        room=room, old_username=old_username,
+                        new_username=new_username)
+                return jsonify({"error": "Username already exists in this room"}), 400
             except Exception as e:
                 db.session.rollback()
                 current_app.metrics['database_connection'].set(0)
@@ -160,14 +463,17 @@ def register_routes(app, db):
                 return jsonify({"error": "Failed to update username"}), 500
                 
         elif request.method == 'DELETE':
-            # Clear all messages in room
+            # Clear all messages in room: hidden at once, deleted in the background
             try:
-                deleted_count = db.session.query(Chat).filter_by(room=room).delete()
-                db.session.commit()
+                with timed('write'):
+                    deleted_count = clear_room(room, db)
+                mark_write()
                 
+                with timed('publish'):
+                    publish_event(room, 'clear', {"messages_deleted": deleted_count})
+
                 # Update Prometheus metrics
                 current_app.metrics['chat_clears'].labels(room=room).inc()
-                update_gauges()
                 
                 safe_log("INFO", "Chat history cleared",
                         room=room, messages_deleted=deleted_count)
@@ -182,7 +488,175 @@ def register_routes(app, db):
                         room=room, error=str(e))
                 return jsonify({"error": "Failed to delete chat history"}), 500
 
+    @app.route('/api/chat/<room>/clear', methods=['GET'])
+    @instrumented
+    def clear_status(room):
+        """Progress of the background purge after a room was cleared"""
+        try:
+            return jsonify(clear_progress(room, db)), 200
+        except Exception as e:
+            safe_log("ERROR", "Failed to read room clear progress",
+                    room=room, error=str(e))
+            return jsonify({"error": "Failed to read clear progress"}), 500
+
+    @app.route('/api/messages/batch', methods=['POST'])
+    @instrumented
+    def post_batch():
+        """Insert many messages, for one or more rooms, in a single transaction"""
+        try:
+            items = parse_batch(request.get_data(), request.mimetype)
+        except BatchError as e:
+            safe_log("WARNING", "Batch rejected - malformed body", error=str(e))
+            return jsonify({"error": str(e)}), 400
+
+        if len(items) > BATCH_MAX_ITEMS:
+            safe_log("WARNING", "Batch rejected - too many items", items=len(items))
+            return jsonify({"error": f"At most {BATCH_MAX_ITEMS} messages per batch"}), 413
+
+        rows = []
+        results = []
+        for index, (item, error) in enumerate(items):
+            row = None
+            if error is None:
+                row, error = validate_item(item)
+            if error is None:
+                rows.append(row)
+                results.append({"index": index, "status": "created"})
+            else:
+                results.append({"index": index, "status": "invalid", "error": error})
+
+        if not rows:
+            safe_log("WARNING", "Batch rejected - no valid messages", items=len(items))
+            return jsonify({"inserted": 0, "rejected": len(results), "results": results}), 400
+
+        try:
+            def write():
+                members = member_ids(db.session.connection(),
+                                     {(row['room'], row['username']) for row in rows})
+                chat_rows = [{"room": row['room'], "message": row['message'],
+                              "created_at": row['created_at'],
+                              "member_id": members[row['room'], row['username']]}
+                             for row in rows]
+                # executemany: multi-row INSERTs, one commit for the whole batch
+                for start in range(0, len(chat_rows), BATCH_INSERT_ROWS):
+                    db.session.execute(db.insert(Chat), chat_rows[start:start + BATCH_INSERT_ROWS])
+                db.session.commit()
+
+            with timed('write'):
+                retry_member_race(db.session, write)
+            mark_write()
+        except Exception as e:
+            db.session.rollback()
+            current_app.metrics['database_connection'].set(0)
+            safe_log("ERROR", "Failed to save message batch",
+                    items=len(rows), error=str(e))
+            return jsonify({"error": "Failed to save messages"}), 500
+
+        # room -> {(username, day): messages}, so stats can count the batch
+        rooms = {}
+        for row in rows:
+            counts = rooms.setdefault(row['room'], {})
+            key = (row['username'], row['created_at'].strftime(DATE_FORMAT))
+            counts[key] = counts.get(key, 0) + 1
+            current_app.metrics['message_length'].observe(len(row['message']))
+        with timed('publish'):
+            for room, counts in rooms.items():
+                count = sum(counts.values())
+                current_app.metrics['messages_sent'].labels(room=room).inc(count)
+                publish_event(room, 'bulk', {
+                    "messages": count,
+                    "counts": [[username, day, n] for (username, day), n in counts.items()]
+                })
+
+        rejected = len(results) - len(rows)
+        safe_log("INFO", "Message batch saved",
+                messages=len(rows), rejected=rejected, rooms=len(rooms))
+
+        return jsonify({
+            "inserted": len(rows),
+            "rejected": rejected,
+            "results": results
+        }), 207 if rejected else 201
+
+    @app.route('/api/chat/<room>/stream', methods=['GET'])
+    @instrumented
+    def chat_stream(room):
+        """Push new messages, renames and clears in a room as Server-Sent Events"""
+        try:
+            last_id = request.headers.get('Last-Event-ID')
+            last_id = int(last_id) if last_id else parse_int_arg('after_id', 'since')
+            if last_id is not None and last_id < 0:
+                raise ValueError("Last-Event-ID must be non-negative")
+        except ValueError:
+            return jsonify({"error": "Last-Event-ID and after_id must be non-negative integers"}), 400
+
+        hub = current_app.hub
+        # Subscribe before reading the backlog so nothing committed in between is lost
+        subscription = hub.subscribe(room, limit=STREAM_MAX_PER_WORKER)
+        if subscription is None:
+            safe_log("WARNING", "Message stream refused - too many open streams",
+                    room=room, streams=STREAM_MAX_PER_WORKER)
+            response = jsonify({"error": "Too many open streams, poll instead"})
+            response.headers['Retry-After'] = str(int(STREAM_MAX_SECONDS))
+            return response, 503
+
+        backlog = []
+        if last_id is not None:
+            try:
+                backlog = with_legacy(db.session.execute(
+                    db.select(Chat, *legacy_fields()).filter_by(room=room)
+                    .where(Chat.id > last_id, not_cleared(room))
+                    .order_by(Chat.id)
+                    .limit(MAX_PAGE_SIZE)
+                ))
+                backlog = [entry.to_event() for entry in backlog]
+            except Exception as e:
+                hub.unsubscribe(subscription)
+                safe_log("ERROR", "Failed to open message stream",
+                        room=room, error=str(e))
+                return jsonify({"error": "Failed to open message stream"}), 500
+
+        safe_log("INFO", "Message stream opened",
+                room=room, last_event_id=last_id, backlog=len(backlog),
+                subscribers=hub.subscriber_count(room))
+
+        def generate():
+            sent_id = last_id or 0
+            deadline = time.monotonic() + STREAM_MAX_SECONDS
+            try:
+                yield f"retry: {STREAM_RETRY_MS}\n\n"
+                for data in backlog:
+                    sent_id = data['id']
+                    yield format_sse('message', data, sent_id)
+
+                while time.monotonic() < deadline and not subscription.overflowed:
+                    item = subscription.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                    if item is None:
+                        yield ": keep-alive\n\n"
+                        continue
+
+                    event, data = item
+                    if event == 'message':
+                        if data['id'] <= sent_id:
+                            # Already delivered as part of the backlog
+                            continue
+                        sent_id = data['id']
+                        yield format_sse(event, data, sent_id)
+                    else:
+                        yield format_sse(event, data)
+            finally:
+                hub.unsubscribe(subscription)
+
+        response = Response(generate(), mimetype='text/event-stream')
+        # Covers clients that disconnect before the generator starts
+        response.call_on_close(lambda: hub.unsubscribe(subscription))
+        response.headers['Cache-Control'] = 'no-cache'
+        # Tell nginx not to buffer the stream
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
     @app.route('/health', methods=['GET'])
+    @instrumented
     def health_check():
         """Simple health check endpoint for monitoring"""
         try:
@@ -190,12 +664,12 @@ def register_routes(app, db):
             db.session.execute(db.text('SELECT 1'))
             current_app.metrics['database_connection'].set(1)
             
-            safe_log("INFO", "Health check passed", status="healthy")
+            safe_log("DEBUG", "Health check passed", status="healthy")
             
             return jsonify({
                 "status": "healthy",
                 "database": "connected",
-                "timestamp": NOW.strftime('%Y-%m-%d %H:%M:%S UTC'),
+                "timestamp": datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC'),
                 "service": "chatapp"
             }), 200
             
@@ -207,134 +681,52 @@ def register_routes(app, db):
                 "status": "unhealthy",
                 "database": "disconnected",
                 "error": str(e),
-                "timestamp": NOW.strftime('%Y-%m-%d %H:%M:%S UTC'),
+                "timestamp": datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC'),
                 "service": "chatapp"
             }), 503
 
-    def update_gauges():
-        """Update Prometheus gauge metrics with current database state"""
-        try:
-            # Update room count
-            room_count = db.session.execute(
-                db.select(func.count(distinct(Chat.room)))
-            ).scalar()
-            current_app.metrics['active_rooms'].set(room_count)
-            
-            # Update user count
-            user_count = db.session.execute(
-                db.select(func.count(distinct(Chat.username)))
-            ).scalar()
-            current_app.metrics['total_users'].set(user_count)
-            
-            # Update messages today
-            today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-            today_count = db.session.execute(
-                db.select(func.count(Chat.id)).filter_by(date=today)
-            ).scalar()
-            current_app.metrics['messages_today'].set(today_count)
-            
-            # Ensure database connection is marked as good
-            current_app.metrics['database_connection'].set(1)
-            
-            safe_log("DEBUG", "Metrics updated successfully",
-                    room_count=room_count, user_count=user_count,
-                    messages_today=today_count)
-            
-        except Exception as e:
-            safe_log("ERROR", "Failed to update gauges", error=str(e))
-            current_app.metrics['database_connection'].set(0)
-
     # JSON metrics endpoint for compatibility with web viewer
     @app.route('/metrics/json', methods=['GET'])
+    @instrumented
     def metrics_json():
         """JSON metrics endpoint compatible with the web viewer"""
         try:
             now = datetime.now(timezone.utc)
-            today = now.strftime('%Y-%m-%d')
-            
-            # Basic counts
-            total_messages = db.session.execute(
-                db.select(func.count(Chat.id))
-            ).scalar()
-            
-            total_rooms = db.session.execute(
-                db.select(func.count(distinct(Chat.room)))
-            ).scalar()
-            
-            total_users = db.session.execute(
-                db.select(func.count(distinct(Chat.username)))
-            ).scalar()
-            
-            # Today's activity
-            messages_today = db.session.execute(
-                db.select(func.count(Chat.id)).filter_by(date=today)
-            ).scalar()
-            
-            active_users_today = db.session.execute(
-                db.select(func.count(distinct(Chat.username))).filter_by(date=today)
-            ).scalar()
-            
-            # Top 5 most active rooms
-            top_rooms = db.session.execute(
-                db.select(Chat.room, func.count(Chat.id).label('message_count'))
-                .group_by(Chat.room)
-                .order_by(func.count(Chat.id).desc())
-                .limit(5)
-            ).all()
-            
-            # Top 5 most active users
-            top_users = db.session.execute(
-                db.select(Chat.username, func.count(Chat.id).label('message_count'))
-                .group_by(Chat.username)
-                .order_by(func.count(Chat.id).desc())
-                .limit(5)
-            ).all()
-            
-            # Recent activity (last 7 days)
-            seven_days_ago = (now - timedelta(days=7)).strftime('%Y-%m-%d')
-            recent_messages = db.session.execute(
-                db.select(func.count(Chat.id))
-                .where(Chat.date >= seven_days_ago)
-            ).scalar()
-            
-            # Average messages per room
-            avg_messages_per_room = round(total_messages / max(total_rooms, 1), 2)
-            
-            # Average messages per user
-            avg_messages_per_user = round(total_messages / max(total_users, 1), 2)
+
+            # Served from incrementally maintained counters, not table scans
+            with timed('snapshot'):
+                stats = current_app.stats.snapshot()
+            usage_stats = stats['usage_stats']
+
+            # Weak validator over the counters; the timestamp alone changing
+            # does not make the metrics worth downloading again
+            etag = hashlib.sha1(json.dumps(stats, sort_keys=True).encode()).hexdigest()[:20]
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+                response.set_etag(etag, weak=True)
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
             
-            safe_log("INFO", "Metrics endpoint accessed",
-                    total_messages=total_messages,
-                    total_rooms=total_rooms,
-                    total_users=total_users)
+            safe_log("DEBUG", "Metrics endpoint accessed",
+                    total_messages=usage_stats['total_messages'],
+                    total_rooms=usage_stats['total_rooms'],
+                    total_users=usage_stats['total_users'])
             
             metrics_data = {
                 "timestamp": now.isoformat(),
                 "system_health": {
                     "database_status": "connected",
-                    "total_records": total_messages
-                },
-                "usage_stats": {
-                    "total_messages": total_messages,
-                    "total_rooms": total_rooms,
-                    "total_users": total_users,
-                    "messages_today": messages_today,
-                    "active_users_today": active_users_today,
-                    "recent_messages_7d": recent_messages,
-                    "avg_messages_per_room": avg_messages_per_room,
-                    "avg_messages_per_user": avg_messages_per_user
+                    "total_records": usage_stats['total_messages']
                 },
-                "top_rooms": [
-                    {"room": room, "message_count": count} 
-                    for room, count in top_rooms
-                ],
-                "top_users": [
-                    {"username": user, "message_count": count} 
-                    for user, count in top_users
-                ]
+                "usage_stats": usage_stats,
+                "top_rooms": stats['top_rooms'],
+                "top_users": stats['top_users']
             }
             
-            return jsonify(metrics_data), 200
+            response = jsonify(metrics_data)
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response, 200
             
         except Exception as e:
             safe_log("ERROR", "Metrics endpoint failed", error=str(e))
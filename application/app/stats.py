@@ -0,0 +1,318 @@
+"""Incrementally maintained chat statistics for /metrics/json.
+
+`ChatStats` keeps message counts per room member (room and username), daily
+buckets per room for the last week and today's counts per room member in
+memory; the per-room and per-user totals are maintained alongside. Room events
+arrive through the hub (on every replica when a cross-replica backplane is
+configured) and adjust the counters in place: a message is counted, a batch
+adds the counts carried in its event, a rename moves the old name's counts in
+that room to the new name and a clear subtracts the room's counts. Serving the
+metrics is O(rooms + users) in memory instead of nine aggregate queries over
+the whole table.
+
+The counters are rebuilt from the database by `reconcile()`: by the background
+thread as soon as it starts and then periodically, as a safety net against drift (events
+lost by the Redis backplane, a clear overtaking messages posted after it).
+A reconciliation records the highest message id it counted, so events for
+messages it already saw are ignored; renames, clears and batches arriving
+while it runs schedule another one instead. Only one rebuild runs at a time:
+requests never start a second one, they serve the current counters or, before
+the first load, wait up to STATS_LOAD_WAIT_SECONDS for it.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from models import Chat, DATE_FORMAT, RoomMember, db, not_cleared, start_of_day, utcnow
+
+log = logging.getLogger(__name__)
+
+CACHE_TTL_SECONDS = float(os.getenv('STATS_CACHE_TTL_SECONDS', '2'))
+RECONCILE_SECONDS = float(os.getenv('STATS_RECONCILE_SECONDS', '300'))
+LOAD_WAIT_SECONDS = float(os.getenv('STATS_LOAD_WAIT_SECONDS', '30'))
+
+# Daily buckets kept for the "recent messages" window (today + 7 days back)
+WINDOW_DAYS = 7
+TOP_N = 5
+
+
+class ChatStats:
+    def __init__(self, database=db, cache_ttl=CACHE_TTL_SECONDS,
+                 reconcile_seconds=RECONCILE_SECONDS, load_wait=LOAD_WAIT_SECONDS):
+        self.db = database
+        self.cache_ttl = cache_ttl
+        self.reconcile_seconds = reconcile_seconds
+        self.load_wait = load_wait
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._loaded = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+        self.loaded = False
+        self.dirty = False
+        self._reconciling = False
+        self._replay = []
+        self.watermark = 0
+        self.last_reconciled = 0.0
+        self.total_messages = 0
+        self.room_counts = Counter()
+        self.user_counts = Counter()
+        self.daily_counts = Counter()
+        # room -> Counter of messages by username / by day / by username today
+        self.member_counts = {}
+        self.room_days = {}
+        self.today_counts = {}
+        self.today = None
+        self._cache = None
+        self._cache_expires = 0.0
+
+    # -- write side --------------------------------------------------------
+
+    def on_event(self, room, event, data):
+        """Hub listener: keep the counters in step with room events"""
+        if event == 'message':
+            self.record_message(room, data['username'], data['date'], data.get('id'))
+        elif event == 'rename':
+            self._adjust(self._rename, room, data['old_username'], data['new_username'])
+        elif event == 'clear':
+            self._adjust(self._clear, room)
+        elif event == 'bulk':
+            if 'counts' in data:
+                self._adjust(self._add_batch, room, data['counts'])
+            else:
+                # Messages removed by retention or dropped partitions
+                self.invalidate()
+
+    def record_message(self, room, username, day, message_id=None):
+        with self._lock:
+            if self._reconciling:
+                # Re-applied on top of the rebuilt counters if not yet counted
+                self._replay.append((room, username, day, message_id))
+            if self.loaded:
+                self._apply(room, username, day, message_id)
+
+    def _adjust(self, change, *args):
+        with self._lock:
+            if self._reconciling:
+                # The rebuilt counters may or may not include this change
+                self.dirty = True
+                self._wakeup.set()
+            if self.loaded:
+                change(*args)
+                self._cache = None
+
+    def _apply(self, room, username, day, message_id, count=1):
+        if message_id is not None and message_id <= self.watermark:
+            # Already included in the last reconciliation
+            return
+
+        self.total_messages += count
+        self.room_counts[room] += count
+        self.user_counts[username] += count
+        self.daily_counts[day] += count
+        self.member_counts.setdefault(room, Counter())[username] += count
+        self.room_days.setdefault(room, Counter())[day] += count
+        if day == self._roll_day():
+            self.today_counts.setdefault(room, Counter())[username] += count
+        self._cache = None
+
+    def _add_batch(self, room, counts):
+        for username, day, count in counts:
+            self._apply(room, username, day, None, count)
+
+    def _rename(self, room, old_username, new_username):
+        moved = self.member_counts.get(room, Counter()).pop(old_username, 0)
+        if moved:
+            self.member_counts[room][new_username] += moved
+            self._subtract(self.user_counts, old_username, moved)
+            self.user_counts[new_username] += moved
+        today = self.today_counts.get(room)
+        if today and old_username in today:
+            today[new_username] += today.pop(old_username)
+
+    def _clear(self, room):
+        self.total_messages -= self.room_counts.pop(room, 0)
+        for username, count in self.member_counts.pop(room, {}).items():
+            self._subtract(self.user_counts, username, count)
+        for day, count in self.room_days.pop(room, {}).items():
+            self._subtract(self.daily_counts, day, count)
+        self.today_counts.pop(room, None)
+
+    @staticmethod
+    def _subtract(counter, key, count):
+        counter[key] -= count
+        if counter[key] <= 0:
+            del counter[key]
+
+    def invalidate(self):
+        """Schedule a rebuild from the database"""
+        with self._lock:
+            self.dirty = True
+            self._cache = None
+        self._wakeup.set()
+
+    # -- read side ---------------------------------------------------------
+
+    def snapshot(self):
+        """Return usage stats, top rooms and top users, served from memory"""
+        now = time.monotonic()
+        with self._lock:
+            if self._cache is not None and now < self._cache_expires:
+                return self._cache
+            loaded = self.loaded
+            refresh = self.dirty and self._thread is None
+
+        if not loaded:
+            # The background thread (or another request) is already loading
+            if self._thread is not None or not self.reconcile():
+                if not self._loaded.wait(self.load_wait):
+                    raise RuntimeError("Chat statistics are still loading")
+        elif refresh:
+            # No background thread to do it for us; if another request is
+            # rebuilding, the current counters are served meanwhile
+            self.reconcile()
+
+        with self._lock:
+            self._cache = self._build_snapshot()
+            self._cache_expires = now + self.cache_ttl
+            return self._cache
+
+    def _today(self):
+        return utcnow().strftime(DATE_FORMAT)
+
+    def _roll_day(self):
+        """Start a new day's active users if it changed; returns today. Call under the lock."""
+        today = self._today()
+        if today != self.today:
+            self.today = today
+            self.today_counts = {}
+        return today
+
+    def _build_snapshot(self):
+        today = self._roll_day()
+
+        window_start = (datetime.strptime(today, DATE_FORMAT)
+                        - timedelta(days=WINDOW_DAYS)).strftime(DATE_FORMAT)
+        total_rooms = sum(1 for count in self.room_counts.values() if count > 0)
+        total_users = sum(1 for count in self.user_counts.values() if count > 0)
+
+        return {
+            "usage_stats": {
+                "total_messages": self.total_messages,
+                "total_rooms": total_rooms,
+                "total_users": total_users,
+                "messages_today": self.daily_counts.get(today, 0),
+                "active_users_today": len({username for counts in self.today_counts.values()
+                                           for username, count in counts.items() if count > 0}),
+                "recent_messages_7d": sum(count for day, count in self.daily_counts.items()
+                                          if day >= window_start),
+                "avg_messages_per_room": round(self.total_messages / max(total_rooms, 1), 2),
+                "avg_messages_per_user": round(self.total_messages / max(total_users, 1), 2)
+            },
+            "top_rooms": [
+                {"room": room, "message_count": count}
+                for room, count in self.room_counts.most_common(TOP_N) if count > 0
+            ],
+            "top_users": [
+                {"username": user, "message_count": count}
+                for user, count in self.user_counts.most_common(TOP_N) if count > 0
+            ]
+        }
+
+    # -- reconciliation ----------------------------------------------------
+
+    def reconcile(self):
+        """Rebuild every counter from the database; False if a rebuild is already running"""
+        with self._lock:
+            if self._reconciling:
+                return False
+            self._reconciling = True
+            self.dirty = False
+            self._replay = []
+        try:
+            self._reconcile()
+        finally:
+            with self._lock:
+                self._reconciling = False
+                self._replay = []
+        return True
+
+    def _reconcile(self):
+        session = self.db.session
+        watermark = session.execute(select(func.max(Chat.id))).scalar() or 0
+        counted = (Chat.id <= watermark) & not_cleared()
+
+        today_start = start_of_day(utcnow())
+        window_start = today_start - timedelta(days=WINDOW_DAYS)
+        day = func.date(Chat.created_at)
+
+        rooms, users, members = Counter(), Counter(), {}
+        for room, username, count in session.execute(
+            select(Chat.room, RoomMember.username, func.count(Chat.id)).join(Chat.member)
+            .where(counted).group_by(Chat.room, RoomMember.username)
+        ).all():
+            rooms[room] += count
+            users[username] += count
+            members.setdefault(room, Counter())[username] = count
+        daily, room_days = Counter(), {}
+        for room, bucket, count in session.execute(
+            select(Chat.room, day, func.count(Chat.id))
+            .where(counted, Chat.created_at >= window_start)
+            .group_by(Chat.room, day)
+        ).all():
+            daily[str(bucket)] += count
+            room_days.setdefault(room, Counter())[str(bucket)] = count
+        today_counts = {}
+        for room, username, count in session.execute(
+            select(Chat.room, RoomMember.username, func.count(Chat.id)).join(Chat.member)
+            .where(counted, Chat.created_at >= today_start)
+            .group_by(Chat.room, RoomMember.username)
+        ).all():
+            today_counts.setdefault(room, Counter())[username] = count
+
+        with self._lock:
+            self.watermark = watermark
+            self.total_messages = sum(rooms.values())
+            self.room_counts = rooms
+            self.user_counts = users
+            self.daily_counts = daily
+            self.member_counts = members
+            self.room_days = room_days
+            self.today = today_start.strftime(DATE_FORMAT)
+            self.today_counts = today_counts
+            self.loaded = True
+            self._loaded.set()
+            self.last_reconciled = time.monotonic()
+            self._cache = None
+
+            # Messages that arrived while the queries ran
+            for item in self._replay:
+                self._apply(*item)
+
+    def start(self, app):
+        """Reconcile in the background: right away, when scheduled and every interval"""
+        self._wakeup.set()
+        self._thread = threading.Thread(target=self._run, args=(app,),
+                                        name='chat-stats', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+
+    def _run(self, app):
+        while not self._stopped:
+            self._wakeup.wait(timeout=self.reconcile_seconds)
+            self._wakeup.clear()
+            if self._stopped:
+                return
+            try:
+                with app.app_context():
+                    self.reconcile()
+                    self.db.session.remove()
+            except Exception:
+                log.exception("Stats reconciliation failed")
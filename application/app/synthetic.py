@@ -0,0 +1,96 @@
+"""Synthetic chat history for load tests and query-plan work.
+
+`flask generate-messages` bulk-loads messages shaped like real traffic:
+
+- rooms and users are picked from Zipf distributions, so `room-0` and
+  `user-0` are the busiest and most rooms and users are quiet
+- message lengths follow the `chatapp_message_length_chars` buckets, mostly
+  short with a long tail up to 1000 characters
+- timestamps are spread evenly over the last `months` months and increase
+  with the id, like messages posted live
+
+The same seed and settings always produce the same rows. Rows go in
+`batch_size` at a time through one executemany INSERT per transaction (sent
+as multi-row INSERTs by PyMySQL), with room members created through
+`member_ids` and remembered between batches. Load into an empty database:
+the generated timestamps lie in the past, so ids would no longer follow
+time if real messages were already there.
+"""
+import itertools
+import logging
+import random
+from datetime import timedelta
+from sqlalchemy import insert
+from models import Chat, db, member_ids, utcnow
+
+log = logging.getLogger(__name__)
+
+# Share of messages per `chatapp_message_length_chars` bucket: (upper bound, share)
+LENGTH_BUCKETS = [
+    (10, 0.15),
+    (50, 0.45),
+    (100, 0.20),
+    (200, 0.12),
+    (500, 0.06),
+    (1000, 0.02),
+]
+LENGTH_BOUNDS = [upper for upper, _ in LENGTH_BUCKETS]
+LENGTH_SHARES = [share for _, share in LENGTH_BUCKETS]
+
+WORDS = ("hey hi hello thanks ok sure yes no maybe lol deploy build broken fixed "
+         "merge review meeting lunch coffee today tomorrow later ticket release "
+         "staging prod rollback logs metrics alert pager on call standup sprint "
+         "the a to and of is it in for that this on with we you can just").split()
+
+
+def zipf_weights(count, exponent):
+    """Cumulative Zipf weights for ranks 1..count"""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def message_text(rng, corpus, bucket):
+    """A message with a length inside LENGTH_BUCKETS[bucket]"""
+    lower = LENGTH_BOUNDS[bucket - 1] + 1 if bucket else 1
+    length = rng.randint(lower, LENGTH_BOUNDS[bucket])
+    offset = rng.randrange(len(corpus) - length)
+    return corpus[offset:offset + length]
+
+
+def generate_messages(count, database=db, rooms=100, users=1000, months=6,
+                      room_exponent=1.1, user_exponent=1.1, batch_size=10000,
+                      seed=1, now=None):
+    """Insert `count` synthetic messages. Returns the number inserted."""
+    rng = random.Random(seed)
+    corpus = " ".join(rng.choice(WORDS) for _ in range(20000))
+    room_names = [f"room-{rank}" for rank in range(rooms)]
+    user_names = [f"user-{rank}" for rank in range(users)]
+    room_weights = zipf_weights(rooms, room_exponent)
+    user_weights = zipf_weights(users, user_exponent)
+
+    end = now or utcnow()
+    start = end - timedelta(days=30 * months)
+    step = (end - start) / max(count, 1)
+
+    members = {}
+    inserted = 0
+    while inserted < count:
+        size = min(batch_size, count - inserted)
+        picked_rooms = rng.choices(room_names, cum_weights=room_weights, k=size)
+        picked_users = rng.choices(user_names, cum_weights=user_weights, k=size)
+        buckets = rng.choices(range(len(LENGTH_BUCKETS)), LENGTH_SHARES, k=size)
+        # Random moments within this batch's slice of the time range, in id order
+        offsets = sorted(rng.random() * size for _ in range(size))
+
+        with database.engine.begin() as conn:
+            members.update(member_ids(conn, set(zip(picked_rooms, picked_users)) - members.keys()))
+            conn.execute(insert(Chat), [{
+                "room": room,
+                "member_id": members[room, username],
+                "created_at": start + step * (inserted + offset),
+                "message": message_text(rng, corpus, bucket),
+            } for room, username, offset, bucket
+                in zip(picked_rooms, picked_users, offsets, buckets)])
+
+        inserted += size
+        log.info("Generated %d of %d messages", inserted, count)
+    return inserted
@@ -0,0 +1,197 @@
+"""Group commit for posted messages.
+
+With WRITE_BUFFER_ENABLED, POST handlers hand their message to the buffer and
+wait. A single writer thread collects messages for up to WRITE_BUFFER_FLUSH_MS
+or WRITE_BUFFER_MAX_BATCH messages and inserts them in one transaction, so a
+burst of posts costs one commit (one log flush on MySQL) instead of one each.
+Each request is answered only after the commit that contains its message, so
+a 201 still means the message is durable.
+
+A batch is one multi-row INSERT with the members resolved up front, the way
+/api/messages/batch inserts. The new ids come back through RETURNING where
+the dialect has it. MySQL has no RETURNING, so they are derived from the
+statement's first id: InnoDB gives the rows of a simple multi-row insert
+consecutive ids, `auto_increment_increment` apart.
+
+If a batch fails, its messages are retried one by one so a single bad row
+only fails its own request. At most WRITE_BUFFER_MAX_QUEUED messages wait for
+the writer; further posts are refused at once (WriteBufferFull) instead of
+queueing behind a growing backlog.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from prometheus_client import Counter, Histogram
+from sqlalchemy import insert, text
+from models import Chat, DATE_FORMAT, TIME_FORMAT, db, member_ids, retry_member_race
+
+log = logging.getLogger(__name__)
+
+WRITE_BUFFER_ENABLED = os.getenv('WRITE_BUFFER_ENABLED', 'false').lower() in ('1', 'true', 'yes', 'on')
+WRITE_BUFFER_MAX_BATCH = int(os.getenv('WRITE_BUFFER_MAX_BATCH', '100'))
+WRITE_BUFFER_FLUSH_MS = float(os.getenv('WRITE_BUFFER_FLUSH_MS', '5'))
+WRITE_BUFFER_TIMEOUT_SECONDS = float(os.getenv('WRITE_BUFFER_TIMEOUT_SECONDS', '10'))
+WRITE_BUFFER_MAX_QUEUED = int(os.getenv('WRITE_BUFFER_MAX_QUEUED', '1000'))
+
+BATCH_SIZE = Histogram('chatapp_write_batch_size', 'Messages committed per group commit',
+                       buckets=[1, 2, 5, 10, 20, 50, 100, 200, 500])
+FLUSH_SECONDS = Histogram('chatapp_write_flush_seconds', 'Time to insert and commit one batch')
+BATCH_FAILURES = Counter('chatapp_write_batch_failures_total',
+                         'Batches that failed and were retried message by message')
+REJECTED = Counter('chatapp_write_buffer_rejected_total',
+                   'Posts refused because the write buffer queue was full')
+
+
+class WriteBufferFull(RuntimeError):
+    """The writer is too far behind to take another message"""
+
+
+class PendingWrite:
+    """A message waiting for its batch to commit"""
+
+    def __init__(self, row):
+        self.row = row
+        self.event = None
+        self.error = None
+        self._done = threading.Event()
+
+    def resolve(self, event=None, error=None):
+        self.event = event
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=WRITE_BUFFER_TIMEOUT_SECONDS):
+        """Block until committed; returns the message's event payload (with its id)"""
+        if not self._done.wait(timeout):
+            raise TimeoutError("Message was not committed in time")
+        if self.error is not None:
+            raise self.error
+        return self.event
+
+
+class WriteBuffer:
+    def __init__(self, app, database=db, max_batch=WRITE_BUFFER_MAX_BATCH,
+                 flush_ms=WRITE_BUFFER_FLUSH_MS, max_queued=WRITE_BUFFER_MAX_QUEUED):
+        self.app = app
+        self.db = database
+        self.max_batch = max_batch
+        self.flush_seconds = flush_ms / 1000
+        self.queue = queue.Queue(maxsize=max_queued)
+        self._id_step = None
+        self._thread = None
+
+    def submit(self, **row):
+        """Queue a chat row for the next batch; raises WriteBufferFull when backed up"""
+        pending = PendingWrite(row)
+        try:
+            self.queue.put_nowait(pending)
+        except queue.Full:
+            REJECTED.inc()
+            raise WriteBufferFull(f"{self.queue.maxsize} messages already waiting") from None
+        return pending
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='chat-write-buffer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flush what is queued, then stop the writer thread"""
+        self.queue.put(None)
+        if self._thread:
+            self._thread.join(timeout=WRITE_BUFFER_TIMEOUT_SECONDS)
+
+    def _run(self):
+        while True:
+            batch, stopping = self._collect()
+            if batch:
+                with self.app.app_context():
+                    self.flush(batch)
+                    self.db.session.remove()
+            if stopping:
+                return
+
+    def _collect(self):
+        """Wait for a first message, then gather more until the batch is full or due"""
+        first = self.queue.get()
+        if first is None:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if pending is None:
+                return batch, True
+            batch.append(pending)
+        return batch, False
+
+    def flush(self, batch):
+        """Insert and commit `batch`, then release everyone waiting on it"""
+        start = time.perf_counter()
+        try:
+            events = self._insert([pending.row for pending in batch])
+        except Exception:
+            self.db.session.rollback()
+            BATCH_FAILURES.inc()
+            log.warning("Batch of %d messages failed, retrying one by one", len(batch),
+                        exc_info=True)
+            for pending in batch:
+                self._flush_one(pending)
+        else:
+            for pending, event in zip(batch, events):
+                pending.resolve(event)
+        finally:
+            BATCH_SIZE.observe(len(batch))
+            FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+    def _flush_one(self, pending):
+        try:
+            event, = self._insert([pending.row])
+        except Exception as e:
+            self.db.session.rollback()
+            pending.resolve(error=e)
+        else:
+            pending.resolve(event)
+
+    def _insert(self, rows):
+        return retry_member_race(self.db.session, lambda: self._insert_once(rows))
+
+    def _insert_once(self, rows):
+        conn = self.db.session.connection()
+        members = member_ids(conn, {(row['room'], row['username']) for row in rows})
+        chat_rows = [{"room": row['room'], "message": row['message'],
+                      "created_at": row['created_at'],
+                      "member_id": members[row['room'], row['username']]}
+                     for row in rows]
+
+        if conn.dialect.insert_returning:
+            ids = list(conn.execute(
+                insert(Chat).returning(Chat.id, sort_by_parameter_order=True), chat_rows
+            ).scalars())
+        else:
+            # One statement, so InnoDB hands out the ids in one consecutive run
+            result = conn.execute(insert(Chat).values(chat_rows))
+            if result.rowcount != len(chat_rows):
+                raise RuntimeError(f"Inserted {result.rowcount} of {len(chat_rows)} messages")
+            step = self._auto_increment_step(conn)
+            ids = [result.lastrowid + step * index for index in range(len(chat_rows))]
+        self.db.session.commit()
+
+        return [{"id": message_id, "room": row['room'],
+                 "date": row['created_at'].strftime(DATE_FORMAT),
+                 "time": row['created_at'].strftime(TIME_FORMAT),
+                 "username": row['username'], "message": row['message']}
+                for message_id, row in zip(ids, rows)]
+
+    def _auto_increment_step(self, conn):
+        if self._id_step is None:
+            self._id_step = conn.execute(text("SELECT @@auto_increment_increment")).scalar()
+        return self._id_step
@@ -0,0 +1,111 @@
+"""Micro-benchmarks for code that runs on every request.
+
+Run with pytest-benchmark (see the README's Micro-Benchmarks section):
+
+    PYTHONPATH=app pytest benchmarks/bench_hot_paths.py --benchmark-autosave
+    PYTHONPATH=app pytest benchmarks/bench_hot_paths.py --benchmark-compare --benchmark-compare-fail=median:10%
+"""
+import logging
+import os
+
+import pytest
+from flask import current_app
+
+from app import StructuredLogger
+from log_pipeline import start_log_pipeline
+from models import Chat, db
+from routes import MAX_PAGE_SIZE, safe_log
+from stats import ChatStats
+
+# Seeded by conftest.py with 1/100 of the messages
+HOT_ROOM = 'room-0'
+LOG_FIELDS = dict(room=HOT_ROOM, username='user-1', message_length=42)
+
+
+@pytest.fixture(scope='module')
+def structured_logger():
+    """StructuredLogger with the production queue pipeline, writing to /dev/null"""
+    devnull = open(os.devnull, 'w')
+    listener = start_log_pipeline(logging.getLogger('chatapp-benchmark'), stream=devnull)
+    yield StructuredLogger('chatapp-benchmark')
+    listener.stop()
+    devnull.close()
+
+
+@pytest.fixture
+def request_context(small, structured_logger):
+    """A POST request context on an app logging through the structured logger"""
+    logger = small.logger
+    small.logger = structured_logger
+    with small.test_request_context(f'/api/chat/{HOT_ROOM}', method='POST',
+                                    headers={'X-Request-ID': 'benchmark'}):
+        yield small
+    small.logger = logger
+
+
+def test_structured_log(benchmark, request_context, structured_logger):
+    benchmark(structured_logger.log, "INFO", "Message sent successfully", **LOG_FIELDS)
+
+
+def test_structured_log_filtered(benchmark, request_context, structured_logger):
+    """DEBUG lines are dropped by the level check before any work is done"""
+    benchmark(structured_logger.log, "DEBUG", "Retrieved messages for room", **LOG_FIELDS)
+
+
+def test_safe_log(benchmark, request_context):
+    benchmark(safe_log, "INFO", "Message sent successfully", **LOG_FIELDS)
+
+
+def test_chat_to_dict(benchmark, small):
+    entry = db.session.execute(db.select(Chat).limit(1)).scalar()
+    benchmark(entry.to_dict)
+
+
+@pytest.mark.parametrize('page_size', [50, MAX_PAGE_SIZE])
+def test_history_formatting(benchmark, small, page_size):
+    """The text body of a GET page, as built in the GET branch of chat()"""
+    entries = db.session.execute(
+        db.select(Chat).order_by(Chat.id.desc()).limit(page_size)).scalars().all()
+    assert len(entries) == page_size
+    benchmark(lambda: "\n".join(entry.to_line() for entry in entries))
+
+
+def test_history_page(benchmark, seeded):
+    """GET /api/chat/<room>?limit=50: query, formatting and response"""
+    client = seeded.test_client()
+    response = benchmark(client.get, f'/api/chat/{HOT_ROOM}?limit=50')
+    assert response.status_code == 200
+
+
+def test_incremental_poll(benchmark, seeded):
+    """GET /api/chat/<room>?after_id=<newest>: the 204 a caught-up poller gets"""
+    client = seeded.test_client()
+    newest = client.get(f'/api/chat/{HOT_ROOM}?limit=1').headers['X-Last-Message-Id']
+    response = benchmark(client.get, f'/api/chat/{HOT_ROOM}?after_id={newest}')
+    assert response.status_code == 204
+
+
+def test_full_history(benchmark, seeded):
+    """GET /api/chat/<room>: the streamed full history of one room"""
+    client = seeded.test_client()
+    body = benchmark.pedantic(lambda: client.get(f'/api/chat/{HOT_ROOM}').data,
+                              rounds=5, warmup_rounds=1)
+    assert body
+
+
+def test_metrics_json(benchmark, seeded):
+    """GET /metrics/json with the snapshot cache disabled, so it is rebuilt every call"""
+    stats, current_app.stats = current_app.stats, ChatStats(db, cache_ttl=0)
+    try:
+        client = seeded.test_client()
+        response = benchmark(client.get, '/metrics/json')
+        assert response.status_code == 200
+    finally:
+        current_app.stats = stats
+
+
+def test_stats_reconcile(benchmark, seeded):
+    """Rebuilding the /metrics/json counters from the table"""
+    stats = ChatStats(db)
+    benchmark.pedantic(stats.reconcile, rounds=3, warmup_rounds=1)
+    assert stats.total_messages
@@ -0,0 +1,125 @@
+"""Fixtures for the micro-benchmarks.
+
+Each data size in BENCHMARK_SIZES (default 1k, 100k and 1M messages) gets an
+app backed by its own in-memory SQLite database, seeded once per session
+across ROOMS rooms with USERS_PER_ROOM users each and timestamps spread over
+the last 30 days.
+"""
+import os
+import random
+import sys
+from datetime import timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import insert
+
+# The app modules import each other by name, like under gunicorn's chdir
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+from models import Chat, db, member_ids, utcnow
+
+SIZES = [int(size) for size in os.getenv('BENCHMARK_SIZES', '1000,100000,1000000').split(',')]
+ROOMS = 100
+USERS_PER_ROOM = 20
+SEED_BATCH = 50000
+
+
+class MockMetrics:
+    def labels(self, **kwargs):
+        return self
+    def inc(self):
+        pass
+    def set(self, value):
+        pass
+    def observe(self, value):
+        pass
+
+
+def create_benchmark_app():
+    """The app the way the unit tests build it, on an in-memory SQLite database"""
+    app = Flask(__name__)
+
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    app.metrics = {name: MockMetrics() for name in (
+        'messages_sent', 'username_changes', 'chat_clears',
+        'database_connection', 'message_length')}
+
+    with app.app_context():
+        from routes import register_routes
+        register_routes(app, db)
+
+    return app
+
+
+def seed_messages(count, rng=None):
+    """Insert `count` messages round-robin over the rooms, oldest first"""
+    rng = rng or random.Random(count)
+    with db.engine.begin() as conn:
+        ids = member_ids(conn, [(f"room-{room}", f"user-{user}")
+                                for room in range(ROOMS) for user in range(USERS_PER_ROOM)])
+
+    start = utcnow() - timedelta(days=30)
+    step = timedelta(days=30) / count
+    for offset in range(0, count, SEED_BATCH):
+        rows = []
+        for i in range(offset, min(offset + SEED_BATCH, count)):
+            room = f"room-{i % ROOMS}"
+            rows.append({
+                "room": room,
+                "member_id": ids[room, f"user-{rng.randrange(USERS_PER_ROOM)}"],
+                "created_at": start + step * i,
+                "message": "x" * rng.randint(10, 200),
+            })
+        with db.engine.begin() as conn:
+            conn.execute(insert(Chat), rows)
+
+
+@pytest.fixture(scope='session', params=SIZES, ids=lambda size: f"{size}rows")
+def seeded_app(request):
+    """App whose database holds `request.param` messages"""
+    app = create_benchmark_app()
+    with app.app_context():
+        db.create_all()
+        seed_messages(request.param)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def seeded(seeded_app):
+    """Active app context of a seeded app"""
+    with seeded_app.app_context():
+        yield seeded_app
+        db.session.remove()
+
+
+@pytest.fixture(scope='session')
+def small_app():
+    """App seeded with 1000 messages, for benchmarks that do not depend on table size"""
+    app = create_benchmark_app()
+    with app.app_context():
+        db.create_all()
+        seed_messages(1000)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def small(small_app):
+    with small_app.app_context():
+        yield small_app
+        db.session.remove()
@@ -15,7 +15,21 @@ let currentUsername = ""
 let pollInterval
 let lastMessageCount = 0
 let messageCache = []
-let lastUsernameHash = ""
+let historyEtag = null
+let roomGeneration = null
+let lastMessageId = 0
+let pollCount = 0
+let pollInFlight = false
+let eventSource = null
+let streamErrors = 0
+
+// Every Nth poll does a full reload to pick up renames/clears made by others
+const RESYNC_EVERY_POLLS = 15
+// Polling interval without a stream, and the slower safety-net poll with one
+const POLL_INTERVAL_MS = 2000
+const STREAM_SAFETY_POLL_MS = 10000
+// Consecutive stream errors before giving up and polling instead
+const MAX_STREAM_ERRORS = 3
 
 /**
  * Initialize the application
@@ -47,15 +61,15 @@ function joinRoom() {
     "roomInfo"
   ).textContent = `Room: ${room} | User: ${username}`
 
-  // Load messages and start polling
-  loadMessages()
-  startPolling()
+  // Load history, then follow new messages via the stream (or polling)
+  loadMessages().then(startStreaming)
 }
 
 /**
  * Leave the current room
  */
 function leaveRoom() {
+  stopStreaming()
   clearInterval(pollInterval)
   currentRoom = ""
   currentUsername = ""
@@ -63,7 +77,10 @@ function leaveRoom() {
   // Reset cache and counters
   messageCache = []
   lastMessageCount = 0
-  lastUsernameHash = ""
+  historyEtag = null
+  roomGeneration = null
+  lastMessageId = 0
+  pollCount = 0
 
   // Reset UI
   document.getElementById("joinForm").style.display = "block"
@@ -102,8 +119,10 @@ function sendMessage() {
         showError("Error sending message: " + data.error)
       } else {
         messageInput.value = ""
-        // Force immediate refresh to show the new message
-        setTimeout(loadMessages, 100)
+        // An open stream delivers the new message; otherwise fetch it now
+        if (!eventSource || eventSource.readyState !== EventSource.OPEN) {
+          setTimeout(pollMessages, 100)
+        }
       }
     })
     .catch((error) => {
@@ -113,35 +132,58 @@ function sendMessage() {
 }
 
 /**
- * Generate a simple hash of all usernames in messages
- * @param {Array} messages - Array of message strings
- * @returns {string} - Simple hash of usernames
+ * Read the message cursor returned by the server
+ * @param {Response} response - Fetch response
+ * @returns {number} - Id of the last message included in the response
  */
-function generateUsernameHash(messages) {
-  const usernames = messages
-    .map((msg) => {
-      const match = msg.match(/^\[(.+?) (.+?)\] (.+?): (.+)$/)
-      return match ? match[3] : ""
-    })
-    .filter(Boolean)
-
-  return usernames.sort().join("|")
+function readLastMessageId(response) {
+  const header = response.headers.get("X-Last-Message-Id")
+  const id = parseInt(header, 10)
+  return Number.isNaN(id) ? lastMessageId : id
 }
 
 /**
- * Load messages from the server (enhanced with username change detection)
+ * Load the full room history from the server.
+ *
+ * The request is conditional: an unchanged room answers 304 without a body.
+ * A new X-Room-Generation means existing lines changed (a rename or a clear),
+ * so the display is rebuilt instead of appended to.
  */
 function loadMessages() {
-  fetch(`/api/chat/${currentRoom}`)
-    .then((response) => response.text())
+  const room = currentRoom
+  const headers = {}
+  if (historyEtag && messageCache.length > 0) {
+    headers["If-None-Match"] = historyEtag
+  }
+
+  return fetch(`/api/chat/${room}`, { headers })
+    .then((response) => {
+      if (room !== currentRoom || response.status === 304) {
+        // Nothing changed since our copy (or the user left the room)
+        return null
+      }
+      lastMessageId = readLastMessageId(response)
+      historyEtag = response.headers.get("ETag")
+
+      const generation = response.headers.get("X-Room-Generation")
+      if (generation !== roomGeneration) {
+        if (roomGeneration !== null) {
+          console.log("Room history changed, forcing full refresh")
+        }
+        messageCache = [] // Force full refresh
+        roomGeneration = generation
+      }
+      return response.text()
+    })
     .then((data) => {
+      if (data === null) return
+
       const messagesContainer = document.getElementById("chatMessages")
 
       if (!data.trim()) {
         // Messages were cleared or empty
         messageCache = []
         lastMessageCount = 0
-        lastUsernameHash = ""
         messagesContainer.innerHTML =
           '<div class="empty-state">No messages yet. Start the conversation!</div>'
         return
@@ -149,25 +191,10 @@ function loadMessages() {
 
       const messages = data.trim().split("\n")
 
-      // Check if usernames have changed (indicating external username update)
-      const currentUsernameHash = generateUsernameHash(messages)
-      const usernamesChanged =
-        lastUsernameHash && currentUsernameHash !== lastUsernameHash
-
-      // Force refresh if usernames changed or message count changed
-      if (
-        messages.length !== lastMessageCount ||
-        usernamesChanged ||
-        messageCache.length === 0
-      ) {
-        if (usernamesChanged) {
-          console.log("Username change detected, forcing full refresh")
-          messageCache = [] // Force full refresh
-        }
-
+      // Refresh if the message count changed or the cache was dropped
+      if (messages.length !== lastMessageCount || messageCache.length === 0) {
         updateMessagesDisplay(messages, messagesContainer)
         lastMessageCount = messages.length
-        lastUsernameHash = currentUsernameHash
       }
     })
     .catch((error) => {
@@ -176,6 +203,78 @@ function loadMessages() {
     })
 }
 
+/**
+ * Fetch only the messages posted after the last known message id
+ */
+function pollMessages() {
+  if (!currentRoom || pollInFlight) return
+
+  pollInFlight = true
+  const room = currentRoom
+  const cursor = lastMessageId
+
+  fetch(`/api/chat/${room}?after_id=${cursor}`)
+    .then((response) => {
+      if (room !== currentRoom || response.status === 204) {
+        // Nothing new since our cursor (or the user left the room)
+        return null
+      }
+      if (lastMessageId !== cursor) {
+        // The stream appended messages meanwhile; poll again from its cursor
+        return { data: "", hasMore: true }
+      }
+      lastMessageId = readLastMessageId(response)
+      const hasMore = response.headers.get("X-Has-More") === "true"
+      return response.text().then((data) => ({ data, hasMore }))
+    })
+    .then((result) => {
+      pollInFlight = false
+      if (!result) return
+
+      if (result.data.trim()) {
+        const messages = result.data.trim().split("\n")
+        appendMessages(messages, document.getElementById("chatMessages"))
+      }
+
+      if (result.hasMore) {
+        pollMessages()
+      }
+    })
+    .catch((error) => {
+      pollInFlight = false
+      console.error("Error polling messages:", error)
+    })
+}
+
+/**
+ * Append newly fetched messages to the display
+ * @param {Array} messages - Array of message strings
+ * @param {HTMLElement} messagesContainer - Container element
+ */
+function appendMessages(messages, messagesContainer) {
+  if (messageCache.length === 0) {
+    // Drop the empty-state placeholder
+    messagesContainer.innerHTML = ""
+  }
+
+  messages.forEach((messageText) => {
+    const messageElement = parseMessage(messageText)
+    if (messageElement) {
+      messagesContainer.appendChild(messageElement)
+      messageCache.push({
+        text: messageText,
+        element: messageElement,
+      })
+    }
+  })
+
+  lastMessageCount = messageCache.length
+
+  setTimeout(() => {
+    messagesContainer.scrollTop = messagesContainer.scrollHeight
+  }, 50) // Small delay to ensure DOM is updated
+}
+
 /**
  * Update messages display efficiently
  * @param {Array} messages - Array of message strings
@@ -330,12 +429,95 @@ function clearChat() {
     })
 }
 
+/**
+ * Format a pushed message the same way the history endpoint does
+ * @param {Object} data - Message payload from the stream
+ * @returns {string} - Message line
+ */
+function formatMessage(data) {
+  return `[${data.date} ${data.time}] ${data.username}: ${data.message}`
+}
+
+/**
+ * Follow room events pushed by the server, falling back to polling
+ */
+function startStreaming() {
+  if (!currentRoom) return
+
+  if (!window.EventSource) {
+    startPolling(POLL_INTERVAL_MS)
+    return
+  }
+
+  eventSource = new EventSource(
+    `/api/chat/${currentRoom}/stream?after_id=${lastMessageId}`
+  )
+
+  eventSource.addEventListener("message", (event) => {
+    const data = JSON.parse(event.data)
+    if (data.id <= lastMessageId) return
+
+    lastMessageId = data.id
+    appendMessages(
+      [formatMessage(data)],
+      document.getElementById("chatMessages")
+    )
+  })
+
+  // Renames and clears change existing lines, so reload the history
+  eventSource.addEventListener("rename", () => loadMessages())
+  eventSource.addEventListener("clear", () => loadMessages())
+  // A batch of messages was imported: fetch them from our cursor
+  eventSource.addEventListener("bulk", () => pollMessages())
+
+  eventSource.onopen = () => {
+    streamErrors = 0
+  }
+
+  // A full server answers 503, which closes the stream: poll instead
+  eventSource.onerror = () => {
+    streamErrors += 1
+    if (
+      eventSource.readyState === EventSource.CLOSED ||
+      streamErrors >= MAX_STREAM_ERRORS
+    ) {
+      console.warn("Message stream unavailable, falling back to polling")
+      stopStreaming()
+      startPolling(POLL_INTERVAL_MS)
+    }
+  }
+
+  // Slow safety-net poll for anything the stream missed
+  startPolling(STREAM_SAFETY_POLL_MS)
+}
+
+/**
+ * Close the event stream if one is open
+ */
+function stopStreaming() {
+  if (eventSource) {
+    eventSource.close()
+    eventSource = null
+  }
+  streamErrors = 0
+}
+
 /**
  * Start polling for new messages
+ * @param {number} intervalMs - Polling interval in milliseconds
  */
-function startPolling() {
-  // Poll every 2 seconds for new messages
-  pollInterval = setInterval(loadMessages, 2000)
+function startPolling(intervalMs = POLL_INTERVAL_MS) {
+  clearInterval(pollInterval)
+
+  // Poll for new messages, with a periodic full resync
+  pollInterval = setInterval(() => {
+    pollCount += 1
+    if (pollCount % RESYNC_EVERY_POLLS === 0) {
+      loadMessages()
+    } else {
+      pollMessages()
+    }
+  }, intervalMs)
 }
 
 /**
@@ -0,0 +1,204 @@
+import unittest
+import json
+from flask import Flask
+from models import db, Chat, ChatEvent
+from hub import MessageHub
+from backplane import (DatabaseBackplane, LocalBackplane, RedisBackplane,
+                       create_backplane)
+
+
+def create_test_app(backplane_kind='database'):
+    """Create a test Flask app whose routes publish through the given backplane"""
+    app = Flask(__name__)
+
+    # Test configuration - use SQLite instead of MySQL
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    class MockMetrics:
+        def labels(self, **kwargs):
+            return self
+        def inc(self):
+            pass
+        def set(self, value):
+            pass
+        def observe(self, value):
+            pass
+
+    app.metrics = {
+        'messages_sent': MockMetrics(),
+        'username_changes': MockMetrics(),
+        'chat_clears': MockMetrics(),
+        'active_rooms': MockMetrics(),
+        'total_users': MockMetrics(),
+        'database_connection': MockMetrics(),
+        'messages_today': MockMetrics(),
+        'message_length': MockMetrics()
+    }
+
+    app.hub = MessageHub()
+    app.backplane = create_backplane(app.hub, backplane_kind, db)
+
+    with app.app_context():
+        from routes import register_routes
+        register_routes(app, db)
+
+    return app
+
+
+def drain(subscription):
+    events = []
+    while True:
+        item = subscription.get(timeout=0)
+        if item is None:
+            return events
+        events.append(item)
+
+
+class FakeRedis:
+    """Records published payloads instead of talking to a Redis server"""
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, channel, payload):
+        self.published.append((channel, payload))
+
+
+class TestBackplaneFactory(unittest.TestCase):
+    """Test cases for backplane selection"""
+
+    def test_known_backplanes(self):
+        hub = MessageHub()
+        self.assertIsInstance(create_backplane(hub, 'local'), LocalBackplane)
+        self.assertIsInstance(create_backplane(hub, 'DATABASE'), DatabaseBackplane)
+
+    def test_unknown_backplane(self):
+        with self.assertRaises(ValueError):
+            create_backplane(MessageHub(), 'carrier-pigeon')
+
+
+class TestDatabaseBackplane(unittest.TestCase):
+    """Test cases for relaying events between replicas through MySQL tables"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.app = create_test_app('database')
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # A second replica sharing the same database
+        self.other_hub = MessageHub()
+        self.other = DatabaseBackplane(self.other_hub, db)
+        self.other.reset_cursors()
+        self.app.backplane.reset_cursors()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_messages_reach_every_replica_once(self):
+        """Test messages posted on one replica are delivered on all of them"""
+        local = self.app.hub.subscribe('general')
+        remote = self.other_hub.subscribe('general')
+
+        self.client.post('/api/chat/general', data={'username': 'alice', 'msg': 'Hi'})
+        self.client.post('/api/chat/general', data={'username': 'bob', 'msg': 'Hey'})
+
+        # Nothing is delivered until the poller runs, not even locally
+        self.assertEqual(drain(local), [])
+
+        self.assertEqual(self.app.backplane.poll_once(), 2)
+        self.assertEqual(self.other.poll_once(), 2)
+        self.assertEqual(self.other.poll_once(), 0)
+
+        for subscription in (local, remote):
+            events = drain(subscription)
+            self.assertEqual([data['message'] for _, data in events], ['Hi', 'Hey'])
+
+    def test_rename_and_clear_events(self):
+        """Test renames and clears are relayed through the chat_event table"""
+        self.client.post('/api/chat/general', data={'username': 'alice', 'msg': 'Hi'})
+        self.other.poll_once()
+        remote = self.other_hub.subscribe('general')
+
+        self.client.put('/api/chat/general', data={
+            'old_username': 'alice', 'new_username': 'alicia'})
+        self.client.delete('/api/chat/general')
+        self.other.poll_once()
+
+        events = drain(remote)
+        self.assertEqual([event for event, _ in events], ['rename', 'clear'])
+        self.assertEqual(events[0][1]['new_username'], 'alicia')
+        self.assertEqual(db.session.query(ChatEvent).count(), 2)
+
+    def test_removals_relayed(self):
+        """Test bulk events without rows to poll (retention) go through chat_event"""
+        remote = self.other_hub.subscribe('general')
+
+        self.app.backplane.publish('general', 'bulk', {"removed": 5})
+        self.app.backplane.publish('general', 'bulk', {"messages": 1, "counts": []})
+        self.other.poll_once()
+
+        self.assertEqual(drain(remote), [('bulk', {"removed": 5})])
+
+    def test_late_commit_behind_cursor_is_delivered(self):
+        """Test a lower id committed after a higher one is still delivered"""
+        first = Chat(room='general', username='alice', message='First')
+        second = Chat(room='general', username='alice', message='Second')
+        third = Chat(room='general', username='alice', message='Third')
+        db.session.add_all([first, second, third])
+        db.session.commit()
+        ids = [first.id, second.id, third.id]
+
+        # Simulate the middle row not being visible yet on the first poll
+        db.session.delete(second)
+        db.session.commit()
+        remote = self.other_hub.subscribe('general')
+        self.other.poll_once()
+        self.assertEqual([data['id'] for _, data in drain(remote)], [ids[0], ids[2]])
+
+        db.session.add(Chat(id=ids[1], room='general', username='alice', message='Second'))
+        db.session.commit()
+        self.other.poll_once()
+        self.assertEqual([data['id'] for _, data in drain(remote)], [ids[1]])
+
+
+class TestRedisBackplane(unittest.TestCase):
+    """Test cases for the Redis pub/sub adapter"""
+
+    def test_publish_delivers_locally_and_relays(self):
+        hub = MessageHub()
+        subscription = hub.subscribe('general')
+        redis_client = FakeRedis()
+        backplane = RedisBackplane(hub, client=redis_client, channel='events')
+
+        backplane.publish('general', 'message', {'id': 1})
+
+        self.assertEqual(drain(subscription), [('message', {'id': 1})])
+        channel, payload = redis_client.published[0]
+        self.assertEqual(channel, 'events')
+        self.assertEqual(json.loads(payload)['origin'], backplane.node_id)
+
+    def test_receive_skips_own_events(self):
+        hub = MessageHub()
+        subscription = hub.subscribe('general')
+        sender = RedisBackplane(MessageHub(), client=FakeRedis())
+        receiver = RedisBackplane(hub, client=FakeRedis())
+        sender.publish('general', 'clear', {})
+        raw = sender.client.published[0][1]
+
+        self.assertFalse(sender.receive(raw))
+        self.assertTrue(receiver.receive(raw))
+        self.assertEqual(drain(subscription), [('clear', {})])
+
+
+if __name__ == '__main__':
+    unittest.main()
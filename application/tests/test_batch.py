@@ -0,0 +1,169 @@
+import unittest
+import json
+from unittest.mock import patch
+from flask import Flask
+from models import db, Chat
+from ingest import parse_batch, validate_item
+
+
+def create_test_app():
+    """Create a test Flask app that doesn't try to connect to MySQL"""
+    app = Flask(__name__)
+
+    # Test configuration - use SQLite instead of MySQL
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    class MockMetrics:
+        def labels(self, **kwargs):
+            return self
+        def inc(self, amount=1):
+            pass
+        def set(self, value):
+            pass
+        def observe(self, value):
+            pass
+
+    app.metrics = {
+        'messages_sent': MockMetrics(),
+        'username_changes': MockMetrics(),
+        'chat_clears': MockMetrics(),
+        'database_connection': MockMetrics(),
+        'message_length': MockMetrics()
+    }
+
+    with app.app_context():
+        from routes import register_routes
+        register_routes(app, db)
+
+    return app
+
+
+class TestBatchParsing(unittest.TestCase):
+    """Test cases for batch bodies and item validation"""
+
+    def test_json_array(self):
+        items = parse_batch(b'[{"room": "a"}, 1]', 'application/json')
+        self.assertEqual(items, [({"room": "a"}, None), (1, None)])
+
+    def test_ndjson_reports_bad_lines(self):
+        items = parse_batch(b'{"room": "a"}\n\nnot json\n', 'application/x-ndjson')
+        self.assertEqual(items[0], ({"room": "a"}, None))
+        self.assertEqual(len(items), 2)
+        self.assertIsNone(items[1][0])
+        self.assertIn('invalid JSON', items[1][1])
+
+    def test_created_at_normalized_to_utc(self):
+        row, error = validate_item({"room": "a", "username": "u", "msg": "Hi",
+                                    "created_at": "2025-05-26T14:00:00+02:00"})
+        self.assertIsNone(error)
+        self.assertEqual(row['created_at'].isoformat(), '2025-05-26T12:00:00')
+
+    def test_invalid_items(self):
+        cases = [
+            ("not an object", "expected an object"),
+            ({"username": "u", "msg": "Hi"}, "room is required"),
+            ({"room": "a", "msg": "Hi"}, "username is required"),
+            ({"room": "a" * 51, "username": "u", "msg": "Hi"}, "room must be at most 50 characters"),
+            ({"room": "a", "username": "u"}, "msg is required"),
+            ({"room": "a", "username": "u", "msg": "Hi", "created_at": "yesterday"},
+             "created_at must be an ISO 8601 timestamp"),
+        ]
+        for item, expected in cases:
+            self.assertEqual(validate_item(item), (None, expected))
+
+
+class TestBatchEndpoint(unittest.TestCase):
+    """Test cases for POST /api/messages/batch"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.app = create_test_app()
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_batch_inserts_all_messages(self):
+        """Test a valid batch for several rooms is inserted"""
+        subscription = self.app.hub.subscribe('room1')
+        response = self.client.post('/api/messages/batch', json=[
+            {"room": "room1", "username": "bot", "msg": "One"},
+            {"room": "room2", "username": "bot", "message": "Two"},
+            {"room": "room1", "username": "bot", "msg": "Three",
+             "created_at": "2025-05-26T12:00:00Z"},
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual(data['inserted'], 3)
+        self.assertEqual({result['status'] for result in data['results']}, {'created'})
+
+        history = self.client.get('/api/chat/room1').data.decode().split('\n')
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history[1], '[2025-05-26 12:00:00] bot: Three')
+
+        # One event per room, not per message
+        event, data = subscription.get(timeout=0)
+        self.assertEqual((event, data['messages']), ('bulk', 2))
+        self.assertIn(['bot', '2025-05-26', 1], data['counts'])
+        self.assertIsNone(subscription.get(timeout=0))
+
+    def test_ndjson_batch(self):
+        """Test NDJSON bodies are accepted"""
+        body = '\n'.join(json.dumps({"room": "room1", "username": "bot", "msg": f"M{i}"})
+                         for i in range(3))
+        response = self.client.post('/api/messages/batch', data=body,
+                                    content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 201)
+        with self.app.app_context():
+            self.assertEqual(db.session.query(Chat).count(), 3)
+
+    def test_partial_batch(self):
+        """Test valid items are inserted and invalid ones reported"""
+        response = self.client.post('/api/messages/batch', json=[
+            {"room": "room1", "username": "bot", "msg": "Valid"},
+            {"room": "room1", "msg": "No username"},
+        ])
+
+        self.assertEqual(response.status_code, 207)
+        data = json.loads(response.data)
+        self.assertEqual((data['inserted'], data['rejected']), (1, 1))
+        self.assertEqual(data['results'][1],
+                         {"index": 1, "status": "invalid", "error": "username is required"})
+
+    def test_batch_without_valid_items(self):
+        """Test batches with nothing to insert are rejected"""
+        response = self.client.post('/api/messages/batch', json=[{"room": "room1"}])
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/api/messages/batch', json={"room": "room1"})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/api/messages/batch', data='[',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_too_large(self):
+        """Test batches over the item limit are rejected"""
+        with patch('routes.BATCH_MAX_ITEMS', 2):
+            response = self.client.post('/api/messages/batch', json=[
+                {"room": "room1", "username": "bot", "msg": str(i)} for i in range(3)])
+
+        self.assertEqual(response.status_code, 413)
+        with self.app.app_context():
+            self.assertEqual(db.session.query(Chat).count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
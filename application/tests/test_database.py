@@ -0,0 +1,193 @@
+import unittest
+import os
+import tempfile
+from flask import Flask
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, exc, text
+from models import db, Chat, member_ids
+from database import (InstrumentedQueuePool, PRIMARY_COOKIE, READ_BIND,
+                      engine_options_from_env, pool_class)
+
+
+def create_test_app():
+    """Create a test Flask app with a separate database standing in for the replica"""
+    app = Flask(__name__)
+
+    # Test configuration - use SQLite instead of MySQL
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_BINDS'] = {READ_BIND: 'sqlite:///:memory:'}
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    class MockMetrics:
+        def labels(self, **kwargs):
+            return self
+        def inc(self):
+            pass
+        def set(self, value):
+            pass
+        def observe(self, value):
+            pass
+
+    app.metrics = {
+        'messages_sent': MockMetrics(),
+        'username_changes': MockMetrics(),
+        'chat_clears': MockMetrics(),
+        'database_connection': MockMetrics(),
+        'message_length': MockMetrics()
+    }
+
+    with app.app_context():
+        from routes import register_routes
+        register_routes(app, db)
+
+    return app
+
+
+def sample(name, bind):
+    return REGISTRY.get_sample_value(name, {'bind': bind}) or 0
+
+
+class TestEngineOptions(unittest.TestCase):
+    """Test cases for pool settings read from the environment"""
+
+    def test_defaults(self):
+        options = engine_options_from_env(environ={})
+
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertEqual(options['pool_size'], 10)
+        self.assertEqual(options['max_overflow'], 20)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertLess(options['pool_recycle'], 28800)  # MySQL wait_timeout
+
+    def test_overrides(self):
+        options = engine_options_from_env('replica', environ={
+            'DB_POOL_SIZE': '3',
+            'DB_MAX_OVERFLOW': '0',
+            'DB_POOL_TIMEOUT': '2.5',
+            'DB_POOL_RECYCLE': '600',
+            'DB_POOL_PRE_PING': 'false'
+        })
+
+        self.assertEqual(options['poolclass'].bind_name, 'replica')
+        self.assertEqual(options['pool_size'], 3)
+        self.assertEqual(options['max_overflow'], 0)
+        self.assertEqual(options['pool_timeout'], 2.5)
+        self.assertEqual(options['pool_recycle'], 600)
+        self.assertFalse(options['pool_pre_ping'])
+
+
+class TestInstrumentedPool(unittest.TestCase):
+    """Test cases for pool metrics"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        url = 'sqlite:///' + os.path.join(self.directory.name, 'pool.db')
+        self.engine = create_engine(url, poolclass=pool_class('test'),
+                                    pool_size=1, max_overflow=1, pool_timeout=0.01)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_checkout_and_overflow_gauges(self):
+        """Test gauges follow connections checked out and returned"""
+        first = self.engine.connect()
+        first.execute(text('SELECT 1'))
+        self.assertEqual(sample('chatapp_db_pool_checked_out', 'test'), 1)
+        self.assertEqual(sample('chatapp_db_pool_overflow', 'test'), 0)
+
+        second = self.engine.connect()
+        self.assertEqual(sample('chatapp_db_pool_checked_out', 'test'), 2)
+        self.assertEqual(sample('chatapp_db_pool_overflow', 'test'), 1)
+
+        second.close()
+        first.close()
+        self.assertEqual(sample('chatapp_db_pool_checked_out', 'test'), 0)
+
+    def test_wait_time_and_timeouts(self):
+        """Test checkouts are timed and exhausted pools count timeouts"""
+        waits = sample('chatapp_db_pool_wait_seconds_count', 'test')
+        timeouts = sample('chatapp_db_pool_timeouts_total', 'test')
+
+        connections = [self.engine.connect(), self.engine.connect()]
+        with self.assertRaises(exc.TimeoutError):
+            self.engine.connect()
+        for connection in connections:
+            connection.close()
+
+        self.assertEqual(sample('chatapp_db_pool_wait_seconds_count', 'test'), waits + 3)
+        self.assertEqual(sample('chatapp_db_pool_timeouts_total', 'test'), timeouts + 1)
+
+    def test_recreated_pool_keeps_bind_label(self):
+        """Test the label survives the engine rebuilding its pool"""
+        self.engine.dispose()
+        self.assertEqual(self.engine.pool.bind_name, 'test')
+
+
+class TestReadReplica(unittest.TestCase):
+    """Test cases for routing room history reads to the replica"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.app = create_test_app()
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            db.metadata.create_all(db.engines[READ_BIND])
+            # The replica only has what was replicated before the test
+            with db.engines[READ_BIND].begin() as conn:
+                member_id = member_ids(conn, [('general', 'alice')])['general', 'alice']
+                conn.execute(Chat.__table__.insert().values(
+                    room='general', member_id=member_id, message='Replicated'))
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with self.app.app_context():
+            db.session.remove()
+            db.metadata.drop_all(db.engines[READ_BIND])
+            db.drop_all()
+        # init_app() registered an (empty) metadata for the bind on the shared
+        # db object; other test apps have no such bind
+        db.metadatas.pop(READ_BIND, None)
+
+    def test_reads_go_to_replica(self):
+        """Test history is served by the replica for clients that did not write"""
+        response = self.client.get('/api/chat/general')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('alice: Replicated', response.data.decode())
+
+    def test_writer_reads_own_writes(self):
+        """Test the posting client reads from the primary until the cookie expires"""
+        response = self.client.post('/api/chat/general', data={'username': 'bob', 'msg': 'Hi'})
+        self.assertIn(PRIMARY_COOKIE, response.headers.get('Set-Cookie', ''))
+
+        response = self.client.get('/api/chat/general')
+        self.assertEqual(response.data.decode().splitlines()[-1][-7:], 'bob: Hi')
+
+        # Another client still reads the (lagging) replica
+        other = self.app.test_client()
+        self.assertNotIn('bob: Hi', other.get('/api/chat/general').data.decode())
+
+        self.client.delete_cookie(PRIMARY_COOKIE)
+        self.assertNotIn('bob: Hi', self.client.get('/api/chat/general').data.decode())
+
+    def test_replica_failure_falls_back_to_primary(self):
+        """Test reads are retried on the primary when the replica is unavailable"""
+        with self.app.app_context():
+            Chat.__table__.drop(db.engines[READ_BIND])
+        self.client.post('/api/chat/general', data={'username': 'bob', 'msg': 'Hi'})
+        self.client.delete_cookie(PRIMARY_COOKIE)
+
+        response = self.client.get('/api/chat/general')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('bob: Hi', response.data.decode())
+
+
+if __name__ == '__main__':
+    unittest.main()
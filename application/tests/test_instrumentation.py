@@ -0,0 +1,101 @@
+import unittest
+from flask import Flask
+from prometheus_client import REGISTRY
+from models import db
+
+
+def create_test_app():
+    """Create a test Flask app that doesn't try to connect to MySQL"""
+    app = Flask(__name__)
+
+    # Test configuration - use SQLite instead of MySQL
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    class MockMetrics:
+        def labels(self, **kwargs):
+            return self
+        def inc(self):
+            pass
+        def set(self, value):
+            pass
+        def observe(self, value):
+            pass
+
+    app.metrics = {
+        'messages_sent': MockMetrics(),
+        'username_changes': MockMetrics(),
+        'chat_clears': MockMetrics(),
+        'database_connection': MockMetrics(),
+        'message_length': MockMetrics()
+    }
+
+    with app.app_context():
+        from routes import register_routes
+        register_routes(app, db)
+
+    return app
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Test cases for handler, phase and query-count histograms"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.app = create_test_app()
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_handler_time_per_endpoint_and_method(self):
+        """Test total handler time is recorded per endpoint and method"""
+        posts = sample('chatapp_handler_seconds_count', endpoint='chat', method='POST')
+        gets = sample('chatapp_handler_seconds_count', endpoint='chat', method='GET')
+
+        self.client.post('/api/chat/general', data={'username': 'alice', 'msg': 'Hi'})
+        self.client.get('/api/chat/general')
+
+        self.assertEqual(sample('chatapp_handler_seconds_count', endpoint='chat', method='POST'), posts + 1)
+        self.assertEqual(sample('chatapp_handler_seconds_count', endpoint='chat', method='GET'), gets + 1)
+
+    def test_phases(self):
+        """Test the write, publish and serialize phases of a post are recorded"""
+        before = {phase: sample('chatapp_phase_seconds_count', endpoint='chat',
+                                method='POST', phase=phase)
+                  for phase in ('write', 'publish', 'serialize', 'db')}
+
+        self.client.post('/api/chat/general', data={'username': 'alice', 'msg': 'Hi'})
+
+        for phase, count in before.items():
+            self.assertEqual(sample('chatapp_phase_seconds_count', endpoint='chat',
+                                    method='POST', phase=phase), count + 1, phase)
+
+    def test_queries_counted_per_request(self):
+        """Test the SQL statements of each request are counted"""
+        count = sample('chatapp_db_queries_per_request_count', endpoint='chat', method='GET')
+        total = sample('chatapp_db_queries_per_request_sum', endpoint='chat', method='GET')
+
+        self.client.get('/api/chat/general')
+
+        self.assertEqual(sample('chatapp_db_queries_per_request_count',
+                                endpoint='chat', method='GET'), count + 1)
+        self.assertEqual(sample('chatapp_db_queries_per_request_sum',
+                                endpoint='chat', method='GET'), total + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
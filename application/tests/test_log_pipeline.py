@@ -0,0 +1,123 @@
+import unittest
+import io
+import json
+import logging
+import queue
+from datetime import datetime
+from unittest.mock import patch
+from prometheus_client import REGISTRY
+from log_pipeline import AccessLogPolicy, BoundedQueueHandler, JsonFormatter, dumps, start_log_pipeline
+
+
+def dropped(level):
+    return REGISTRY.get_sample_value('chatapp_log_records_dropped_total', {'level': level}) or 0
+
+
+def make_record(message, structured=None, level=logging.INFO):
+    record = logging.LogRecord('chatapp.test', level, __file__, 0, message, None, None)
+    if structured is not None:
+        record.structured = structured
+    return record
+
+
+class TestJsonFormatter(unittest.TestCase):
+    """Test cases for serializing structured records"""
+
+    def test_structured_record(self):
+        line = JsonFormatter().format(make_record('Hi', {"message": "Hi", "room": "general"}))
+        self.assertEqual(json.loads(line), {"message": "Hi", "room": "general"})
+
+    def test_plain_record(self):
+        self.assertEqual(JsonFormatter('%(message)s').format(make_record('plain')), 'plain')
+
+    def test_unserializable_values_are_stringified(self):
+        line = dumps({"at": datetime(2025, 1, 2, 3, 4, 5)})
+        self.assertIn('2025-01-02', json.loads(line)['at'])
+
+
+class TestBoundedQueueHandler(unittest.TestCase):
+    """Test cases for the full-queue policies"""
+
+    def test_drop_policy_counts_dropped_records(self):
+        handler = BoundedQueueHandler(queue.Queue(maxsize=1), policy='drop')
+        before = dropped('WARNING')
+
+        handler.handle(make_record('first', level=logging.WARNING))
+        handler.handle(make_record('second', level=logging.WARNING))
+
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertEqual(dropped('WARNING'), before + 1)
+
+    def test_block_policy_waits_then_drops(self):
+        handler = BoundedQueueHandler(queue.Queue(maxsize=1), policy='block', block_seconds=0.01)
+        before = dropped('ERROR')
+
+        handler.handle(make_record('first', level=logging.ERROR))
+        handler.handle(make_record('second', level=logging.ERROR))
+
+        self.assertEqual(dropped('ERROR'), before + 1)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            BoundedQueueHandler(queue.Queue(), policy='panic')
+
+    def test_records_are_not_formatted_on_the_caller(self):
+        structured = {"message": "Hi"}
+        handler = BoundedQueueHandler(queue.Queue(), policy='drop')
+        handler.handle(make_record('Hi', structured))
+
+        self.assertIs(handler.queue.get_nowait().structured, structured)
+
+
+class TestLogPipeline(unittest.TestCase):
+    """Test cases for the queue-to-stream pipeline"""
+
+    def test_records_written_by_listener(self):
+        logger = logging.getLogger('chatapp.test.pipeline')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        stream = io.StringIO()
+        listener = start_log_pipeline(logger, stream=stream)
+        try:
+            logger.info('Hi', extra={"structured": {"message": "Hi", "room": "general"}})
+            logger.debug('Not enabled', extra={"structured": {"message": "Not enabled"}})
+        finally:
+            listener.stop()
+            logger.handlers.clear()
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual([json.loads(line)['message'] for line in lines], ['Hi'])
+
+
+class TestAccessLogPolicy(unittest.TestCase):
+    """Test cases for access-log exclusion and sampling"""
+
+    def setUp(self):
+        self.policy = AccessLogPolicy.from_env(
+            exclude='/health, /metrics',
+            rates='/static=0.1, /static/app.js=0, /api/chat=0.5',
+            default_rate=1.0)
+
+    def test_excluded_paths(self):
+        self.assertIsNone(self.policy.sample('/health', 200))
+        self.assertIsNone(self.policy.sample('/metrics', 200))
+        # Exclusions are exact paths
+        self.assertEqual(self.policy.sample('/metrics/json', 200), 1.0)
+
+    def test_longest_prefix_wins(self):
+        self.assertEqual(self.policy.rate_for('/static/app.js'), 0)
+        self.assertEqual(self.policy.rate_for('/static/styles.css'), 0.1)
+        self.assertEqual(self.policy.rate_for('/'), 1.0)
+
+    def test_sampling(self):
+        with patch('log_pipeline.random.random', return_value=0.3):
+            self.assertEqual(self.policy.sample('/api/chat/general', 200), 0.5)
+            self.assertIsNone(self.policy.sample('/static/styles.css', 200))
+
+    def test_server_errors_always_logged(self):
+        self.assertEqual(self.policy.sample('/health', 503), 1.0)
+        self.assertEqual(self.policy.sample('/static/app.js', 500), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
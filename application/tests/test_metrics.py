@@ -1,8 +1,14 @@
 import unittest
 import json
+import os
+import tempfile
+from unittest.mock import patch
 from flask import Flask
-from models import db, Chat
+from datetime import timedelta
+from models import db, Chat, utcnow
 from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_client import CollectorRegistry
+from collectors import ChatGaugeCollector, MultiprocessChatMetrics
 
 
 
@@ -155,6 +161,27 @@ class TestMetricsEndpoint(unittest.TestCase):
         self.assertIn('active_users_today', data['usage_stats'])
         self.assertIn('recent_messages_7d', data['usage_stats'])
         
+    def test_json_metrics_time_windows(self):
+        """Test today and 7-day counts are computed from created_at"""
+        now = utcnow()
+        with self.app.app_context():
+            messages = [
+                Chat(room='test', created_at=now, username='user1', message='Now'),
+                Chat(room='test', created_at=now - timedelta(days=3),
+                     username='user2', message='This week'),
+                Chat(room='test', created_at=now - timedelta(days=30),
+                     username='user3', message='Last month'),
+            ]
+            db.session.add_all(messages)
+            db.session.commit()
+
+        response = self.client.get('/metrics/json')
+        data = json.loads(response.data)
+
+        self.assertEqual(data['usage_stats']['messages_today'], 1)
+        self.assertEqual(data['usage_stats']['active_users_today'], 1)
+        self.assertEqual(data['usage_stats']['recent_messages_7d'], 2)
+
     def test_json_metrics_system_health(self):
         """Test system health information in JSON metrics"""
         response = self.client.get('/metrics/json')
@@ -169,6 +196,19 @@ class TestMetricsEndpoint(unittest.TestCase):
         self.assertIn('total_records', health)
         self.assertIsInstance(health['total_records'], int)
         
+    def test_json_metrics_conditional(self):
+        """Test unchanged counters answer If-None-Match with an empty 304"""
+        response = self.client.get('/metrics/json')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        response = self.client.get('/metrics/json', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        response = self.client.get('/metrics/json', headers={'If-None-Match': 'W/"stale"'})
+        self.assertEqual(response.status_code, 200)
+
     def test_backward_compatibility_metrics_endpoint(self):
         """Test that /metrics endpoint still exists and returns Prometheus format"""
         response = self.client.get('/metrics')
@@ -183,5 +223,70 @@ class TestMetricsEndpoint(unittest.TestCase):
         )
 
 
+class TestGaugeCollector(unittest.TestCase):
+    """Test cases for the scrape-time room/user/message gauges"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.app = create_test_app()
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def scrape(self, collector):
+        registry = CollectorRegistry()
+        registry.register(collector)
+        return {name: registry.get_sample_value(name) for name in (
+            'chatapp_active_rooms', 'chatapp_total_users', 'chatapp_messages_today')}
+
+    def test_gauges_computed_at_scrape_time(self):
+        """Test gauges reflect the database when scraped"""
+        self.client.post('/api/chat/room1', data={'username': 'alice', 'msg': 'Hi'})
+        self.client.post('/api/chat/room2', data={'username': 'bob', 'msg': 'Hey'})
+        db.session.add(Chat(room='room1', username='carol', message='Old',
+                            created_at=utcnow() - timedelta(days=2)))
+        db.session.commit()
+
+        values = self.scrape(ChatGaugeCollector(self.app, db, interval=0))
+
+        self.assertEqual(values, {
+            'chatapp_active_rooms': 2,
+            'chatapp_total_users': 3,
+            'chatapp_messages_today': 2
+        })
+
+    def test_gauges_refreshed_at_most_once_per_interval(self):
+        """Test scrapes within the interval reuse the cached values"""
+        collector = ChatGaugeCollector(self.app, db, interval=3600)
+        self.assertEqual(self.scrape(collector)['chatapp_active_rooms'], 0)
+
+        self.client.post('/api/chat/room1', data={'username': 'alice', 'msg': 'Hi'})
+        self.assertEqual(self.scrape(collector)['chatapp_active_rooms'], 0)
+
+        collector.interval = 0
+        self.assertEqual(self.scrape(collector)['chatapp_active_rooms'], 1)
+
+    def test_multiprocess_metrics_include_collector(self):
+        """Test gunicorn multiprocess mode still exposes the scrape-time gauges"""
+        self.client.post('/api/chat/room1', data={'username': 'alice', 'msg': 'Hi'})
+        app = Flask(__name__)
+
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': directory}):
+            MultiprocessChatMetrics(
+                app, collectors=[ChatGaugeCollector(self.app, db, interval=0)])
+            response = app.test_client().get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('chatapp_active_rooms 1.0', response.data.decode())
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,190 @@
+import unittest
+from datetime import datetime
+from flask import Flask
+from sqlalchemy import inspect, text
+from models import db, Chat, RoomMember, history_line, legacy_columns, legacy_fields, with_legacy
+from migrations import (MIGRATIONS, LegacyBackfill, backfill_created_at, backfill_members,
+                        run_migrations, schema_version)
+
+
+def create_test_app():
+    """Create a test Flask app backed by an empty in-memory SQLite database"""
+    app = Flask(__name__)
+
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    return app
+
+
+class TestMigrations(unittest.TestCase):
+    """Test cases for the schema migration runner"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.app = create_test_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        db.session.remove()
+        db.drop_all()
+        with db.engine.begin() as conn:
+            schema_version.drop(conn, checkfirst=True)
+        legacy_columns.clear()
+        self.app_context.pop()
+
+    def chat_indexes(self):
+        return {index['name'] for index in inspect(db.engine).get_indexes('chat')}
+
+    def test_fresh_database(self):
+        """Test migrating an empty database creates tables and indexes"""
+        applied = run_migrations(db)
+
+        self.assertEqual(applied, sorted(version for version, _, _ in MIGRATIONS))
+        self.assertTrue({'chat', 'room_member'} <= set(inspect(db.engine).get_table_names()))
+        self.assertTrue({'ix_chat_room_id', 'ix_chat_member_id',
+                         'ix_chat_created_at'} <= self.chat_indexes())
+        self.assertNotIn('ix_chat_date', self.chat_indexes())
+
+    def test_migrations_are_recorded(self):
+        """Test applied versions are stored and not re-applied"""
+        run_migrations(db)
+
+        with db.engine.connect() as conn:
+            versions = conn.execute(
+                schema_version.select().order_by(schema_version.c.version)
+            ).all()
+        self.assertEqual(len(versions), len(MIGRATIONS))
+
+        self.assertEqual(run_migrations(db), [])
+
+    def test_legacy_table_gets_indexes(self):
+        """Test a pre-migration chat table is upgraded in place"""
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE chat ("
+                "id INTEGER PRIMARY KEY, room VARCHAR(50) NOT NULL, "
+                "date VARCHAR(50) NOT NULL, time VARCHAR(50) NOT NULL, "
+                "username VARCHAR(50) NOT NULL, message TEXT NOT NULL)"
+            ))
+            conn.execute(text(
+                "INSERT INTO chat (room, date, time, username, message) "
+                "VALUES ('general', '2025-05-26', '12:00:00', 'alice', 'Hello')"
+            ))
+
+        self.assertEqual(self.chat_indexes(), set())
+
+        run_migrations(db)
+
+        self.assertTrue({'ix_chat_room_id', 'ix_chat_room_username',
+                         'ix_chat_member_id', 'ix_chat_created_at'} <= self.chat_indexes())
+        with db.engine.connect() as conn:
+            self.assertEqual(conn.execute(text("SELECT COUNT(*) FROM chat")).scalar(), 1)
+
+        # Legacy date/time strings and usernames are converted after startup
+        chat = db.session.execute(db.select(Chat)).scalar_one()
+        self.assertIsNone(chat.created_at)
+        self.assertIsNone(chat.member_id)
+        self.assertEqual(LegacyBackfill(db).run_once(), (1, 1))
+        db.session.expire_all()
+        chat = db.session.execute(db.select(Chat)).scalar_one()
+        self.assertEqual(chat.created_at, datetime(2025, 5, 26, 12, 0, 0))
+        self.assertEqual(chat.to_dict()['date'], '2025-05-26')
+        self.assertEqual(chat.to_dict()['time'], '12:00:00')
+
+        # Legacy usernames become room members
+        self.assertEqual(chat.username, 'alice')
+        self.assertEqual(chat.member.room, 'general')
+
+    def test_rows_from_old_pods_readable(self):
+        """Test rows with only the legacy columns are read through them until backfilled"""
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE chat ("
+                "id INTEGER PRIMARY KEY, room VARCHAR(50) NOT NULL, "
+                "date VARCHAR(50) NOT NULL, time VARCHAR(50) NOT NULL, "
+                "username VARCHAR(50) NOT NULL, message TEXT NOT NULL)"
+            ))
+        run_migrations(db)
+        self.assertEqual(legacy_columns, {'date', 'time', 'username'})
+
+        # Written by a pod of the previous release during the rollout
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO chat (room, date, time, username, message) "
+                "VALUES ('general', '2025-05-27', '08:00:00', 'bob', 'From an old pod')"
+            ))
+
+        entry, = with_legacy(db.session.execute(db.select(Chat, *legacy_fields())))
+        self.assertEqual(entry.to_line(), "[2025-05-27 08:00:00] bob: From an old pod")
+        self.assertEqual(entry.to_dict()['time'], '08:00:00')
+        row = db.session.execute(
+            db.select(Chat.created_at, RoomMember.username, Chat.message, *legacy_fields())
+            .outerjoin(Chat.member)).one()
+        self.assertEqual(history_line(row), "[2025-05-27 08:00:00] bob: From an old pod")
+
+        self.assertEqual(LegacyBackfill(db).run_once(), (1, 1))
+        db.session.expire_all()
+        self.assertEqual(db.session.execute(db.select(Chat)).scalar_one().member.username, 'bob')
+
+    def test_backfill_created_at_batches(self):
+        """Test the backfill converts rows across several batches"""
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE chat ("
+                "id INTEGER PRIMARY KEY, room VARCHAR(50) NOT NULL, "
+                "date VARCHAR(50) NOT NULL, time VARCHAR(50) NOT NULL, "
+                "username VARCHAR(50) NOT NULL, message TEXT NOT NULL, "
+                "created_at DATETIME)"
+            ))
+            for i in range(7):
+                conn.execute(text(
+                    "INSERT INTO chat (room, date, time, username, message) "
+                    "VALUES ('general', '2025-05-26', :time, 'alice', 'Hello')"
+                ), {"time": f"12:00:0{i}"})
+
+        with db.engine.connect() as conn:
+            self.assertEqual(backfill_created_at(conn, batch_size=3), 7)
+            self.assertEqual(backfill_created_at(conn, batch_size=3), 0)
+            missing = conn.execute(text(
+                "SELECT COUNT(*) FROM chat WHERE created_at IS NULL")).scalar()
+        self.assertEqual(missing, 0)
+
+    def test_backfill_members_batches(self):
+        """Test messages are linked to one member per room and username across batches"""
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE chat ("
+                "id INTEGER PRIMARY KEY, room VARCHAR(50) NOT NULL, "
+                "username VARCHAR(50) NOT NULL, message TEXT NOT NULL, "
+                "member_id INTEGER)"
+            ))
+            RoomMember.__table__.create(conn)
+            for i in range(7):
+                conn.execute(text(
+                    "INSERT INTO chat (room, username, message) "
+                    "VALUES (:room, :username, 'Hello')"
+                ), {"room": 'general' if i < 5 else 'other',
+                    "username": 'alice' if i % 2 else 'bob'})
+
+        with db.engine.connect() as conn:
+            self.assertEqual(backfill_members(conn, batch_size=3), 7)
+            self.assertEqual(backfill_members(conn, batch_size=3), 0)
+            members = conn.execute(text(
+                "SELECT room, username FROM room_member ORDER BY room, username")).all()
+            mismatched = conn.execute(text(
+                "SELECT COUNT(*) FROM chat JOIN room_member m ON m.id = chat.member_id "
+                "WHERE m.room != chat.room OR m.username != chat.username")).scalar()
+        self.assertEqual([tuple(member) for member in members],
+                         [('general', 'alice'), ('general', 'bob'),
+                          ('other', 'alice'), ('other', 'bob')])
+        self.assertEqual(mismatched, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
 import unittest
 from datetime import datetime, timezone
 from flask import Flask
-from models import db, Chat
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import CreateTable
+from models import db, Chat, RoomMember
 
 
 class TestChatModel(unittest.TestCase):
@@ -66,6 +68,36 @@ class TestChatModel(unittest.TestCase):
         
         self.assertEqual(chat.to_dict(), expected_dict)
         
+    def test_chat_date_time_from_created_at(self):
+        """Test date and time are derived from the created_at timestamp"""
+        chat = Chat(
+            room='test_room',
+            created_at=datetime(2025, 5, 26, 23, 59, 58, 123456),
+            username='test_user',
+            message='Hello, World!'
+        )
+
+        self.assertEqual(chat.date, '2025-05-26')
+        self.assertEqual(chat.time, '23:59:58')
+        self.assertEqual(chat.to_line(), '[2025-05-26 23:59:58] test_user: Hello, World!')
+
+    def test_chat_created_at_from_date_time(self):
+        """Test setting legacy date and time fields builds created_at"""
+        chat = Chat(room='test_room', time='08:30:00', date='2025-01-02',
+                    username='test_user', message='Hi')
+
+        self.assertEqual(chat.created_at, datetime(2025, 1, 2, 8, 30, 0))
+
+    def test_chat_created_at_default(self):
+        """Test created_at defaults to the current UTC time on insert"""
+        before = datetime.now(timezone.utc).replace(tzinfo=None)
+        chat = Chat(room='test_room', username='test_user', message='Hi')
+        db.session.add(chat)
+        db.session.commit()
+        after = datetime.now(timezone.utc).replace(tzinfo=None)
+
+        self.assertTrue(before <= chat.created_at <= after)
+
     def test_chat_database_operations(self):
         """Test basic database operations"""
         # Create a chat entry
@@ -167,6 +199,40 @@ class TestChatModel(unittest.TestCase):
         self.assertEqual(len(retrieved.username), 50)
         self.assertEqual(len(retrieved.message), 1000)
 
+    def test_messages_share_room_member(self):
+        """Test messages from one username in a room reference the same member"""
+        db.session.add_all([
+            Chat(room='general', username='user1', message='First'),
+            Chat(room='general', username='user1', message='Second'),
+            Chat(room='general', username='user2', message='Third'),
+        ])
+        db.session.commit()
+
+        self.assertEqual(db.session.query(RoomMember).count(), 2)
+
+        member = db.session.execute(
+            db.select(RoomMember).filter_by(room='general', username='user1')
+        ).scalar_one()
+        member.username = 'renamed'
+        db.session.commit()
+        db.session.expunge_all()
+
+        messages = db.session.execute(
+            db.select(Chat).filter_by(room='general').order_by(Chat.id)
+        ).scalars().all()
+        self.assertEqual([chat.username for chat in messages], ['renamed', 'renamed', 'user2'])
+
+    def test_usernames_differing_in_case_are_different_members(self):
+        """Test 'bob' and 'Bob' get their own members, byte-compared on MySQL too"""
+        with self.app.app_context():
+            db.session.add_all([Chat(room='general', username='Bob', message='Hi'),
+                                Chat(room='general', username='bob', message='Hey')])
+            db.session.commit()
+
+            self.assertEqual(db.session.query(RoomMember).count(), 2)
+        ddl = str(CreateTable(RoomMember.__table__).compile(dialect=mysql.dialect()))
+        self.assertIn('username VARCHAR(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin', ddl)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
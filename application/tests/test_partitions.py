@@ -0,0 +1,58 @@
+import unittest
+from datetime import datetime
+from flask import Flask
+from models import db
+from partitions import (add_months, ensure_partitions, partition_definitions, partition_status,
+                        plan_partitions)
+
+
+class TestPartitionPlanning(unittest.TestCase):
+    """Test cases for monthly partition planning and DDL"""
+
+    def test_add_months_across_years(self):
+        self.assertEqual(add_months(datetime(2025, 11, 1), 3), datetime(2026, 2, 1))
+        self.assertEqual(add_months(datetime(2025, 1, 1), -1), datetime(2024, 12, 1))
+
+    def test_definitions_end_with_catch_all(self):
+        self.assertEqual(
+            partition_definitions([datetime(2025, 12, 1), datetime(2026, 1, 1)]),
+            "PARTITION p202512 VALUES LESS THAN ('2026-01-01'), "
+            "PARTITION p202601 VALUES LESS THAN ('2026-02-01'), "
+            "PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+
+    def test_upcoming_months_added(self):
+        """Test months up to `months_ahead` after the current one are planned"""
+        to_add, to_drop = plan_partitions(['p202504', 'p202505', 'pmax'],
+                                          datetime(2025, 5, 26), months_ahead=2,
+                                          retention_months=0)
+
+        self.assertEqual(to_add, [datetime(2025, 6, 1), datetime(2025, 7, 1)])
+        self.assertEqual(to_drop, [])
+
+    def test_up_to_date(self):
+        """Test nothing is planned when enough months exist"""
+        self.assertEqual(plan_partitions(['p202505', 'p202506', 'pmax'], datetime(2025, 5, 26),
+                                         months_ahead=1, retention_months=0), ([], []))
+
+    def test_expired_months_dropped(self):
+        """Test months older than the retention are dropped and the catch-all kept"""
+        existing = ['p202501', 'p202502', 'p202503', 'p202504', 'p202505', 'pmax']
+        _, to_drop = plan_partitions(existing, datetime(2025, 5, 26),
+                                     months_ahead=0, retention_months=2)
+
+        self.assertEqual(to_drop, ['p202501', 'p202502'])
+
+    def test_requires_mysql(self):
+        """Test partitioning is refused on databases other than MySQL"""
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        db.init_app(app)
+
+        with app.app_context(), self.assertRaises(RuntimeError):
+            ensure_partitions(db)
+        with app.app_context(), self.assertRaises(RuntimeError):
+            partition_status(db)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import unittest
+import json
+from unittest.mock import patch
+from flask import Flask
+from models import db, Chat, RoomMember, RoomState, member_ids
+from purge import RoomPurger, clear_room
+
+
+def create_test_app():
+    """Create a test Flask app that doesn't try to connect to MySQL"""
+    app = Flask(__name__)
+
+    # Test configuration - use SQLite instead of MySQL
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    class MockMetrics:
+        def labels(self, **kwargs):
+            return self
+        def inc(self):
+            pass
+        def set(self, value):
+            pass
+        def observe(self, value):
+            pass
+
+    app.metrics = {
+        'messages_sent': MockMetrics(),
+        'username_changes': MockMetrics(),
+        'chat_clears': MockMetrics(),
+        'database_connection': MockMetrics(),
+        'message_length': MockMetrics()
+    }
+
+    with app.app_context():
+        from routes import register_routes
+        register_routes(app, db)
+
+    return app
+
+
+def add_messages(room, count):
+    db.session.add_all([Chat(room=room, username='alice', message=f'Message {i}')
+                        for i in range(count)])
+    db.session.commit()
+
+
+class TestRoomClear(unittest.TestCase):
+    """Test cases for watermark clears and the background purge"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.app = create_test_app()
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_clear_hides_without_deleting(self):
+        """Test a clear hides the room's messages at once and leaves other rooms alone"""
+        with self.app.app_context():
+            add_messages('big', 5)
+            add_messages('other', 2)
+
+        response = self.client.delete('/api/chat/big')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('5 messages removed', json.loads(response.data)['message'])
+        self.assertEqual(self.client.get('/api/chat/big').data.decode(), '')
+        self.assertEqual(self.client.get('/api/chat/big?limit=10').data.decode(), '')
+        self.assertEqual(len(self.client.get('/api/chat/other').data.decode().split('\n')), 2)
+        with self.app.app_context():
+            # Rows are still there until the purge runs
+            self.assertEqual(db.session.query(Chat).filter_by(room='big').count(), 5)
+
+    def test_messages_after_clear_visible(self):
+        """Test messages posted after a clear are shown and a second clear only counts them"""
+        with self.app.app_context():
+            add_messages('general', 3)
+            self.assertEqual(clear_room('general'), 3)
+            add_messages('general', 1)
+
+        history = self.client.get('/api/chat/general').data.decode()
+        self.assertEqual(history.split(': ')[-1], 'Message 0')
+
+        with self.app.app_context():
+            self.assertEqual(clear_room('general'), 1)
+            self.assertEqual(clear_room('general'), 0)
+
+    def test_purge_in_batches(self):
+        """Test hidden messages are deleted batch by batch and progress is reported"""
+        with self.app.app_context():
+            add_messages('big', 5)
+            add_messages('other', 2)
+            clear_room('big')
+            add_messages('big', 1)
+
+        progress = json.loads(self.client.get('/api/chat/big/clear').data)
+        self.assertEqual((progress['status'], progress['pending_messages']), ('purging', 5))
+
+        purger = RoomPurger(db, batch_size=2)
+        with self.app.app_context():
+            self.assertEqual([purger.purge_once() for _ in range(5)], [2, 2, 1, 0, None])
+            state = db.session.get(RoomState, 'big')
+            self.assertEqual(state.purged_through_id, state.cleared_through_id)
+            self.assertEqual(db.session.query(Chat).filter_by(room='big').count(), 1)
+            self.assertEqual(db.session.query(Chat).filter_by(room='other').count(), 2)
+            # alice still has a message in both rooms
+            self.assertEqual(db.session.query(RoomMember).count(), 2)
+
+        progress = json.loads(self.client.get('/api/chat/big/clear').data)
+        self.assertEqual((progress['status'], progress['pending_messages']), ('idle', 0))
+
+    def test_purge_deletes_orphaned_members(self):
+        """Test members left without messages are deleted once their room is purged"""
+        with self.app.app_context():
+            add_messages('general', 2)
+            clear_room('general')
+            db.session.add(Chat(room='general', username='bob', message='After the clear'))
+            db.session.commit()
+
+            RoomPurger(db).purge_all()
+
+            members = db.session.execute(db.select(RoomMember.username)).scalars().all()
+            self.assertEqual(members, ['bob'])
+
+    def test_post_retried_when_member_deleted_meanwhile(self):
+        """Test a post whose member the purge deleted after the lookup still succeeds"""
+        calls = []
+
+        def purged_after_lookup(connection, pairs):
+            ids = member_ids(connection, pairs)
+            calls.append(ids)
+            if len(calls) == 1:
+                # The purge deletes the member before the message is inserted
+                connection.execute(db.delete(RoomMember))
+            return ids
+
+        with self.app.app_context():
+            db.session.execute(db.text('PRAGMA foreign_keys = ON'))
+            with patch('models.member_ids', side_effect=purged_after_lookup):
+                response = self.client.post('/api/chat/general',
+                                            data={'username': 'alice', 'msg': 'Hello'})
+
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(calls), 2)
+            self.assertEqual(db.session.query(Chat).one().username, 'alice')
+            db.session.execute(db.text('PRAGMA foreign_keys = OFF'))
+
+    def test_lock_released_on_its_own_connection(self):
+        """Test the purge lock is taken and released on one connection across commits"""
+        with self.app.app_context():
+            add_messages('big', 3)
+            clear_room('big')
+
+        purger = RoomPurger(db, batch_size=2)
+        connections = []
+        purger._acquire = lambda conn: connections.append(conn) or True
+        purger._release = connections.append
+        with self.app.app_context():
+            self.assertEqual(purger.purge_once(), 2)
+
+        self.assertEqual(len(connections), 2)
+        self.assertIs(connections[0], connections[1])
+
+    def test_progress_of_room_never_cleared(self):
+        """Test rooms that were never cleared report nothing pending"""
+        response = self.client.get('/api/chat/quiet/clear')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['status'], 'idle')
+
+
+if __name__ == '__main__':
+    unittest.main()
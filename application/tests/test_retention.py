@@ -0,0 +1,165 @@
+import unittest
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from flask import Flask
+from models import db, Chat, RoomMember
+from purge import clear_room
+from retention import Archive, RetentionPolicy, apply_retention, parse_limits
+
+NOW = datetime(2025, 5, 26, 12, 0, 0)
+
+
+def create_test_app():
+    """Create a test Flask app backed by an in-memory SQLite database"""
+    app = Flask(__name__)
+
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    return app
+
+
+def add_message(room, days_old, message='Hello'):
+    db.session.add(Chat(room=room, username='alice', message=message,
+                        created_at=NOW - timedelta(days=days_old)))
+    db.session.commit()
+
+
+def read_archive(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        return [json.loads(line) for line in archive]
+
+
+class TestRetentionPolicy(unittest.TestCase):
+    """Test cases for parsing retention limits"""
+
+    def test_parse_limits(self):
+        self.assertEqual(parse_limits('30d'), (30.0, None))
+        self.assertEqual(parse_limits('1000'), (None, 1000))
+        self.assertEqual(parse_limits('7d/500'), (7.0, 500))
+        self.assertEqual(parse_limits('0d/0'), (None, None))
+
+    def test_room_overrides_default(self):
+        policy = RetentionPolicy.from_env(max_age_days='90', max_messages='0',
+                                          rooms='bots=7d/1000, archive=0d')
+        self.assertEqual(policy.limits_for('general'), (90.0, None))
+        self.assertEqual(policy.limits_for('bots'), (7.0, 1000))
+        self.assertEqual(policy.limits_for('archive'), (None, None))
+        self.assertTrue(policy.applies_to_all_rooms())
+        self.assertFalse(RetentionPolicy.from_env('0', '0', 'bots=7d').applies_to_all_rooms())
+
+
+class TestApplyRetention(unittest.TestCase):
+    """Test cases for archiving and deleting expired messages"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.app = create_test_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = Archive(self.directory.name, s3_uri='')
+
+    def tearDown(self):
+        """Clean up after tests"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.directory.cleanup()
+
+    def remaining(self, room):
+        return [chat.message for chat in db.session.execute(
+            db.select(Chat).filter_by(room=room).order_by(Chat.id)).scalars()]
+
+    def test_max_age_archives_in_batches(self):
+        """Test old messages are archived batch by batch before they are deleted"""
+        for i in range(5):
+            add_message('general', 40, f'Old {i}')
+        add_message('general', 1, 'New')
+        add_message('other', 40, 'Other room')
+
+        removed = apply_retention(RetentionPolicy(rooms={'general': (30, None)}),
+                                  self.archive, db, batch_size=2, now=NOW)
+
+        self.assertEqual(removed, {'general': 5})
+        self.assertEqual(self.remaining('general'), ['New'])
+        self.assertEqual(self.remaining('other'), ['Other room'])
+
+        files = sorted(os.listdir(os.path.join(self.directory.name, 'general')))
+        self.assertEqual(files, ['chat-1-2.ndjson.gz', 'chat-3-4.ndjson.gz', 'chat-5-5.ndjson.gz'])
+        first = read_archive(os.path.join(self.directory.name, 'general', files[0]))
+        self.assertEqual(first[0], {"id": 1, "room": "general", "created_at": "2025-04-16T12:00:00",
+                                    "username": "alice", "message": "Old 0"})
+
+    def test_max_messages_keeps_newest(self):
+        """Test only the newest messages of each room are kept"""
+        for i in range(4):
+            add_message('general', 0, f'Message {i}')
+        add_message('quiet', 0, 'Only one')
+
+        removed = apply_retention(RetentionPolicy(max_messages=2), self.archive, db, now=NOW)
+
+        self.assertEqual(removed, {'general': 2})
+        self.assertEqual(self.remaining('general'), ['Message 2', 'Message 3'])
+        self.assertEqual(self.remaining('quiet'), ['Only one'])
+
+    def test_members_without_messages_deleted(self):
+        """Test members whose messages were all removed are deleted"""
+        add_message('general', 40)
+        db.session.add(Chat(room='general', username='bob', message='Recent',
+                            created_at=NOW - timedelta(days=1)))
+        db.session.commit()
+
+        apply_retention(RetentionPolicy(max_age_days=30), self.archive, db, now=NOW)
+
+        members = db.session.execute(db.select(RoomMember.username)).scalars().all()
+        self.assertEqual(members, ['bob'])
+
+    def test_dry_run(self):
+        """Test a dry run reports without archiving or deleting"""
+        add_message('general', 40)
+
+        removed = apply_retention(RetentionPolicy(max_age_days=30), None, db,
+                                  dry_run=True, now=NOW)
+
+        self.assertEqual(removed, {'general': 1})
+        self.assertEqual(len(self.remaining('general')), 1)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_cleared_messages_left_to_purge(self):
+        """Test messages hidden by a room clear are not archived"""
+        add_message('general', 40)
+        clear_room('general')
+
+        self.assertEqual(apply_retention(RetentionPolicy(max_age_days=30), self.archive,
+                                         db, now=NOW), {})
+
+    def test_s3_upload(self):
+        """Test batches are uploaded and the local copy removed when S3 is configured"""
+        class FakeS3:
+            uploads = []
+
+            def upload_file(self, path, bucket, key):
+                self.uploads.append((read_archive(path), bucket, key))
+
+        s3 = FakeS3()
+        archive = Archive(self.directory.name, 's3://chat-archive/prod/', s3_client=s3)
+        add_message('general room', 40)
+
+        apply_retention(RetentionPolicy(max_age_days=30), archive, db, now=NOW)
+
+        rows, bucket, key = s3.uploads[0]
+        self.assertEqual((bucket, key), ('chat-archive', 'prod/general_room/chat-1-1.ndjson.gz'))
+        self.assertEqual(rows[0]['room'], 'general room')
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, 'general_room')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+import time
+import unittest
+from flask import Flask
+from prometheus_client import REGISTRY
+from sqlalchemy import event
+from database import PRIMARY_COOKIE
+from hub import ALL_ROOMS
+from models import db, Chat
+from room_cache import RoomCache
+
+
+def create_test_app(room_cache):
+    """Create a test Flask app with a room cache, on an in-memory SQLite database"""
+    app = Flask(__name__)
+
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    class MockMetrics:
+        def labels(self, **kwargs):
+            return self
+        def inc(self):
+            pass
+        def set(self, value):
+            pass
+        def observe(self, value):
+            pass
+
+    app.metrics = {
+        'messages_sent': MockMetrics(),
+        'username_changes': MockMetrics(),
+        'chat_clears': MockMetrics(),
+        'database_connection': MockMetrics(),
+        'message_length': MockMetrics()
+    }
+
+    from hub import MessageHub
+    app.hub = MessageHub()
+    app.room_cache = room_cache
+    app.hub.add_listener(room_cache.on_event)
+
+    with app.app_context():
+        from routes import register_routes
+        register_routes(app, db)
+
+    return app
+
+
+def sample(name):
+    return REGISTRY.get_sample_value(f'chatapp_room_cache_{name}_total') or 0
+
+
+def messages(room, count, start=1):
+    """`load()` result of a room holding messages start..start+count-1"""
+    def load():
+        return start + count - 1, 0, [(i, f"[{room}] message {i}") for i in range(start, start + count)]
+    return load
+
+
+class TestRoomCache(unittest.TestCase):
+    """Test cases for the cache of recent room messages"""
+
+    def test_lru_eviction(self):
+        """Test the least recently read room is evicted once over the byte bound"""
+        cache = RoomCache(room_messages=10)
+        cache.page('a', messages('a', 10))
+        cache.max_bytes = cache.size * 2
+        cache.page('b', messages('b', 10))
+        cache.page('a', messages('a', 10))
+        evictions = sample('evictions')
+
+        cache.page('c', messages('c', 10))
+
+        self.assertEqual(sample('evictions') - evictions, 1)
+        self.assertEqual(set(cache._rooms), {'a', 'c'})
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+    def test_append_in_order(self):
+        """Test new messages are appended once, in id order, and old ones roll off"""
+        cache = RoomCache(room_messages=3)
+        cache.page('a', messages('a', 4))
+        message = {"date": "2025-05-26", "time": "12:00:00", "username": "bob"}
+
+        cache.add_message('a', dict(message, id=6, message="six"))
+        cache.add_message('a', dict(message, id=5, message="five"))
+        cache.add_message('a', dict(message, id=6, message="six"))
+
+        page = cache.page('a', None, after_id=3)
+        self.assertEqual(page.lines, ["[a] message 4",
+                                      "[2025-05-26 12:00:00] bob: five",
+                                      "[2025-05-26 12:00:00] bob: six"])
+        self.assertEqual(page.last_id, 6)
+        # Message 3 rolled off: older cursors go to the database
+        self.assertIsNone(cache.page('a', None, after_id=2))
+        self.assertIsNone(cache.page('a', None))
+
+    def test_write_during_load_not_cached(self):
+        """Test a snapshot loaded while the room changed is served but not kept"""
+        cache = RoomCache()
+
+        def load():
+            cache.invalidate('a')
+            return messages('a', 2)()
+
+        page = cache.page('a', load)
+
+        self.assertEqual(len(page.lines), 2)
+        self.assertEqual(len(cache), 0)
+
+    def test_post_during_load_kept(self):
+        """Test messages posted while a room loads are added to its snapshot"""
+        cache = RoomCache()
+
+        def load():
+            cache.add_message('a', {"id": 3, "date": "2025-05-26", "time": "12:00:00",
+                                    "username": "bob", "message": "three"})
+            return messages('a', 2)()
+
+        cache.page('a', load)
+
+        self.assertEqual(len(cache), 1)
+        page = cache.page('a', None, after_id=2)
+        self.assertEqual(page.lines, ["[2025-05-26 12:00:00] bob: three"])
+        self.assertEqual(cache.page('a', None).last_id, 3)
+
+    def test_dropped_partitions_clear_cache(self):
+        """Test events for every room empty the cache"""
+        cache = RoomCache()
+        cache.page('a', messages('a', 2))
+        cache.page('b', messages('b', 2))
+
+        cache.on_event(ALL_ROOMS, 'bulk', {"dropped_partitions": ['p202501']})
+
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+
+class TestRoomCacheRoutes(unittest.TestCase):
+    """Test cases for history reads served from the room cache"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.cache = RoomCache(room_messages=3)
+        self.app = create_test_app(self.cache)
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            self.queries = 0
+
+            def count(*args):
+                self.queries += 1
+            event.listen(db.engine, 'before_cursor_execute', count)
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def post(self, username, message):
+        response = self.client.post('/api/chat/general', data={'username': username, 'msg': message})
+        self.assertEqual(response.status_code, 201)
+
+    def test_reads_served_from_memory(self):
+        """Test polls, tails and conditional reads of a loaded room skip the database"""
+        self.post('alice', 'Hello')
+        self.post('bob', 'Hi')
+        first = self.client.get('/api/chat/general')
+        self.post('alice', 'How are you?')
+        hits, misses = sample('hits'), sample('misses')
+        self.queries = 0
+
+        poll = self.client.get('/api/chat/general?after_id=2')
+        tail = self.client.get('/api/chat/general?limit=2')
+        full = self.client.get('/api/chat/general')
+        unchanged = self.client.get('/api/chat/general', headers={'If-None-Match': full.headers['ETag']})
+        idle = self.client.get('/api/chat/general?after_id=3')
+
+        self.assertEqual(self.queries, 0)
+        self.assertEqual(sample('hits') - hits, 5)
+        self.assertEqual(sample('misses') - misses, 0)
+        self.assertEqual(len(first.get_data(as_text=True).split('\n')), 2)
+        self.assertTrue(poll.get_data(as_text=True).endswith('alice: How are you?'))
+        self.assertEqual(poll.headers['X-Last-Message-Id'], '3')
+        self.assertEqual(len(tail.get_data(as_text=True).split('\n')), 2)
+        self.assertEqual(full.headers['ETag'], '"3.0"')
+        self.assertEqual(len(full.get_data(as_text=True).split('\n')), 3)
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(idle.status_code, 204)
+
+    def test_reads_past_cache_use_database(self):
+        """Test reads reaching below the cached messages are answered from the database"""
+        for i in range(5):
+            self.post('alice', f'Message {i}')
+
+        tail = self.client.get('/api/chat/general?limit=2')
+        longer = self.client.get('/api/chat/general?limit=4')
+        full = self.client.get('/api/chat/general')
+        old_cursor = self.client.get('/api/chat/general?after_id=1')
+
+        self.assertEqual(tail.get_data(as_text=True).count('\n'), 1)
+        self.assertEqual(longer.get_data(as_text=True).count('\n'), 3)
+        self.assertEqual(full.get_data(as_text=True).count('\n'), 4)
+        self.assertEqual(full.headers['ETag'], '"5.0"')
+        self.assertEqual(old_cursor.get_data(as_text=True).count('\n'), 3)
+
+    def test_pinned_reads_skip_cache(self):
+        """Test clients pinned to the primary after a write bypass the cache"""
+        self.post('alice', 'Hello')
+        self.client.get('/api/chat/general')
+        with self.app.app_context():
+            # Written through another worker: no event reaches this cache
+            db.session.add(Chat(room='general', username='bob', message='Elsewhere'))
+            db.session.commit()
+
+        cached = self.client.get('/api/chat/general?after_id=1')
+        self.client.set_cookie(PRIMARY_COOKIE, str(time.time() + 60))
+        pinned = self.client.get('/api/chat/general?after_id=1')
+
+        self.assertEqual(cached.status_code, 204)
+        self.assertIn('bob: Elsewhere', pinned.get_data(as_text=True))
+
+    def test_invalidated_on_rename_and_clear(self):
+        """Test renames and clears are visible on the next read"""
+        self.post('alice', 'Hello')
+        self.client.get('/api/chat/general')
+
+        self.client.put('/api/chat/general', data={'old_username': 'alice', 'new_username': 'carol'})
+        renamed = self.client.get('/api/chat/general')
+        self.client.delete('/api/chat/general')
+        cleared = self.client.get('/api/chat/general')
+
+        self.assertIn('carol: Hello', renamed.get_data(as_text=True))
+        self.assertEqual(renamed.headers['ETag'], '"1.1"')
+        self.assertEqual(cleared.get_data(as_text=True), '')
+        self.assertEqual(cleared.headers['ETag'], '"1.2"')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
 import unittest
 import json
+from datetime import datetime, timezone
+from unittest.mock import patch
 from flask import Flask
-from models import db, Chat
+from models import db, Chat, RoomMember
 
 
 def create_test_app():
@@ -89,6 +91,16 @@ class TestChatRoutes(unittest.TestCase):
         self.assertEqual(chat_data['username'], 'test_user')
         self.assertEqual(chat_data['message'], 'Hello, World!')
         
+    def test_post_message_timestamp(self):
+        """Test posted messages are stamped with the current time"""
+        response = self.client.post('/api/chat/test_room', data={
+            'username': 'test_user',
+            'msg': 'Hello, World!'
+        })
+
+        data = json.loads(response.data)
+        self.assertEqual(data['date'], datetime.now(timezone.utc).strftime('%Y-%m-%d'))
+
     def test_post_message_missing_username(self):
         """Test posting message without username"""
         response = self.client.post('/api/chat/test_room', data={
@@ -141,6 +153,159 @@ class TestChatRoutes(unittest.TestCase):
         self.assertIn('user2: Second message', content)
         self.assertIn('[2025-05-26 12:00:00]', content)
         
+    def _add_messages(self, room, count):
+        """Insert `count` sequential messages into `room` and return their ids"""
+        with self.app.app_context():
+            entries = [
+                Chat(room=room, date='2025-05-26', time=f'12:00:{i:02d}',
+                     username='user1', message=f'Message {i}')
+                for i in range(count)
+            ]
+            db.session.add_all(entries)
+            db.session.commit()
+            return [entry.id for entry in entries]
+
+    def test_get_messages_reports_cursor(self):
+        """Test full history fetch returns the last message id header"""
+        ids = self._add_messages('test_room', 3)
+
+        response = self.client.get('/api/chat/test_room')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Last-Message-Id'], str(ids[-1]))
+
+    def test_get_messages_after_cursor(self):
+        """Test incremental fetch returns only messages newer than the cursor"""
+        ids = self._add_messages('test_room', 5)
+
+        response = self.client.get(f'/api/chat/test_room?after_id={ids[2]}')
+
+        self.assertEqual(response.status_code, 200)
+        lines = response.data.decode().split('\n')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Message 3', lines[0])
+        self.assertIn('Message 4', lines[1])
+        self.assertEqual(response.headers['X-Last-Message-Id'], str(ids[-1]))
+        self.assertNotIn('X-Has-More', response.headers)
+
+    def test_get_messages_since_alias(self):
+        """Test `since` works as an alias for `after_id`"""
+        ids = self._add_messages('test_room', 2)
+
+        response = self.client.get(f'/api/chat/test_room?since={ids[0]}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Message 1', response.data.decode())
+        self.assertNotIn('Message 0', response.data.decode())
+
+    def test_get_messages_no_new_messages(self):
+        """Test incremental fetch with nothing new returns 204"""
+        ids = self._add_messages('test_room', 2)
+
+        response = self.client.get(f'/api/chat/test_room?after_id={ids[-1]}')
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['X-Last-Message-Id'], str(ids[-1]))
+
+    def test_get_messages_paginated(self):
+        """Test incremental fetch honours the page size and flags more pages"""
+        ids = self._add_messages('test_room', 5)
+
+        response = self.client.get('/api/chat/test_room?after_id=0&limit=2')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data.decode().split('\n')), 2)
+        self.assertEqual(response.headers['X-Last-Message-Id'], str(ids[1]))
+        self.assertEqual(response.headers['X-Has-More'], 'true')
+
+    def test_get_messages_tail_limit(self):
+        """Test `limit` without a cursor returns the most recent messages"""
+        ids = self._add_messages('test_room', 5)
+
+        response = self.client.get('/api/chat/test_room?limit=2')
+
+        self.assertEqual(response.status_code, 200)
+        lines = response.data.decode().split('\n')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Message 3', lines[0])
+        self.assertIn('Message 4', lines[1])
+        self.assertEqual(response.headers['X-Last-Message-Id'], str(ids[-1]))
+
+    def test_get_full_history_streamed_in_chunks(self):
+        """Test the full history is streamed chunk by chunk with unchanged content"""
+        ids = self._add_messages('test_room', 5)
+        self._add_messages('other_room', 2)
+
+        with patch('routes.HISTORY_CHUNK_ROWS', 2):
+            response = self.client.get('/api/chat/test_room', buffered=False)
+            chunks = [chunk.decode() for chunk in response.response]
+
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(response.headers['X-Last-Message-Id'], str(ids[-1]))
+        self.assertEqual(''.join(chunks), '\n'.join(
+            f'[2025-05-26 12:00:{i:02d}] user1: Message {i}' for i in range(5)))
+
+    def test_get_messages_invalid_cursor(self):
+        """Test invalid cursor parameters are rejected"""
+        response = self.client.get('/api/chat/test_room?after_id=abc')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get('/api/chat/test_room?limit=-1')
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_history_conditional(self):
+        """Test an unchanged room answers If-None-Match with an empty 304"""
+        ids = self._add_messages('test_room', 3)
+
+        response = self.client.get('/api/chat/test_room')
+        etag = response.headers['ETag']
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+
+        response = self.client.get('/api/chat/test_room', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['X-Last-Message-Id'], str(ids[-1]))
+
+        # Proxies that compress the body hand the validator back as a weak one
+        response = self.client.get('/api/chat/test_room?limit=2',
+                                   headers={'If-None-Match': f'W/{etag}'})
+        self.assertEqual(response.status_code, 304)
+
+        self.client.post('/api/chat/test_room', data={'username': 'user2', 'msg': 'New'})
+        response = self.client.get('/api/chat/test_room', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('user2: New', response.data.decode())
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_history_generation_on_rename_and_clear(self):
+        """Test renames and clears change the room version without new messages"""
+        self._add_messages('test_room', 2)
+        self._add_messages('other_room', 1)
+
+        first = self.client.get('/api/chat/test_room')
+        other = self.client.get('/api/chat/other_room').headers['ETag']
+        self.assertEqual(first.headers['X-Room-Generation'], '0')
+
+        self.client.put('/api/chat/test_room', data={'old_username': 'user1',
+                                                     'new_username': 'user9'})
+        renamed = self.client.get('/api/chat/test_room',
+                                  headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(renamed.status_code, 200)
+        self.assertEqual(renamed.headers['X-Room-Generation'], '1')
+        self.assertIn('user9', renamed.data.decode())
+
+        self.client.delete('/api/chat/test_room')
+        cleared = self.client.get('/api/chat/test_room',
+                                  headers={'If-None-Match': renamed.headers['ETag']})
+        self.assertEqual(cleared.status_code, 200)
+        self.assertEqual(cleared.headers['X-Room-Generation'], '2')
+        self.assertEqual(cleared.data, b'')
+
+        response = self.client.get('/api/chat/other_room', headers={'If-None-Match': other})
+        self.assertEqual(response.status_code, 304)
+
     def test_delete_room_messages(self):
         """Test deleting all messages in a room"""
         # Add test messages
@@ -242,6 +407,24 @@ class TestChatRoutes(unittest.TestCase):
         data = json.loads(response.data)
         self.assertIn('Username already exists', data['error'])
         
+    def test_update_username_to_name_of_cleared_member(self):
+        """Test a name only used by cleared messages can be taken"""
+        self.client.post('/api/chat/test_room', data={'username': 'alice', 'msg': 'Before'})
+        self.client.delete('/api/chat/test_room')
+        self.client.post('/api/chat/test_room', data={'username': 'bob', 'msg': 'After'})
+
+        response = self.client.put('/api/chat/test_room', data={
+            'old_username': 'bob',
+            'new_username': 'alice'
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/chat/test_room').data.decode().split('] ')[1],
+                         'alice: After')
+        with self.app.app_context():
+            members = db.session.execute(db.select(RoomMember.username)).scalars().all()
+            self.assertEqual(members, ['alice'])
+
     def test_update_nonexistent_username(self):
         """Test updating username that doesn't exist"""
         response = self.client.put('/api/chat/test_room', data={
@@ -254,6 +437,32 @@ class TestChatRoutes(unittest.TestCase):
         data = json.loads(response.data)
         self.assertIn('No messages found', data['error'])
 
+    def test_update_username_renames_member_only(self):
+        """Test a rename updates the room member, not each message"""
+        with self.app.app_context():
+            for i in range(3):
+                db.session.add(Chat(room='test_room', username='old_user', message=f'Message {i}'))
+            db.session.add(Chat(room='other_room', username='old_user', message='Elsewhere'))
+            db.session.commit()
+            member_ids = set(db.session.execute(
+                db.select(Chat.member_id).filter_by(room='test_room')).scalars())
+
+        response = self.client.put('/api/chat/test_room', data={
+            'old_username': 'old_user',
+            'new_username': 'new_user'
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['messages_updated'], 3)
+        with self.app.app_context():
+            self.assertEqual(len(member_ids), 1)
+            member = db.session.get(RoomMember, member_ids.pop())
+            self.assertEqual((member.room, member.username), ('test_room', 'new_user'))
+            # The same name in another room is a different member
+            self.assertEqual(db.session.execute(
+                db.select(RoomMember.username).filter_by(room='other_room')
+            ).scalar_one(), 'old_user')
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,235 @@
+import threading
+import unittest
+from datetime import timedelta
+from unittest.mock import patch
+from flask import Flask
+from models import db, Chat, utcnow
+from hub import MessageHub
+from stats import ChatStats
+
+
+def create_test_app():
+    """Create a test Flask app that doesn't try to connect to MySQL"""
+    app = Flask(__name__)
+
+    # Test configuration - use SQLite instead of MySQL
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    return app
+
+
+def add_message(room, username, created_at=None):
+    entry = Chat(room=room, username=username, message='Hello',
+                 created_at=created_at or utcnow())
+    db.session.add(entry)
+    db.session.commit()
+    return entry
+
+
+class TestChatStats(unittest.TestCase):
+    """Test cases for the incrementally maintained metrics"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.app = create_test_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.hub = MessageHub()
+        self.stats = ChatStats(db, cache_ttl=0)
+        self.hub.add_listener(self.stats.on_event)
+
+    def tearDown(self):
+        """Clean up after tests"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def publish(self, entry):
+        self.hub.publish(entry.room, 'message', entry.to_event())
+
+    def test_first_snapshot_reconciles(self):
+        """Test counters are loaded from the database on first use"""
+        add_message('general', 'alice')
+        add_message('general', 'bob')
+        add_message('random', 'alice', utcnow() - timedelta(days=30))
+
+        usage = self.stats.snapshot()['usage_stats']
+
+        self.assertEqual(usage['total_messages'], 3)
+        self.assertEqual(usage['total_rooms'], 2)
+        self.assertEqual(usage['total_users'], 2)
+        self.assertEqual(usage['messages_today'], 2)
+        self.assertEqual(usage['recent_messages_7d'], 2)
+
+    def test_new_messages_counted_without_queries(self):
+        """Test messages published after loading update the counters in memory"""
+        self.stats.snapshot()
+        entry = add_message('general', 'carol')
+        self.publish(entry)
+
+        with patch.object(self.stats, 'reconcile') as reconcile:
+            stats = self.stats.snapshot()
+            reconcile.assert_not_called()
+
+        self.assertEqual(stats['usage_stats']['total_messages'], 1)
+        self.assertEqual(stats['usage_stats']['active_users_today'], 1)
+        self.assertEqual(stats['top_users'], [{"username": "carol", "message_count": 1}])
+
+    def test_already_reconciled_messages_ignored(self):
+        """Test events for messages included in the last reconciliation are not double counted"""
+        entry = add_message('general', 'alice')
+        self.stats.snapshot()
+        self.publish(entry)
+
+        self.assertEqual(self.stats.snapshot()['usage_stats']['total_messages'], 1)
+
+    def test_rename_moves_counts(self):
+        """Test a rename moves the old name's counts in that room without a rebuild"""
+        add_message('general', 'alice')
+        add_message('general', 'alice')
+        add_message('random', 'alice')
+        self.stats.snapshot()
+
+        with patch.object(self.stats, 'reconcile') as reconcile:
+            self.hub.publish('general', 'rename', {"old_username": "alice",
+                                                   "new_username": "alicia"})
+            stats = self.stats.snapshot()
+            reconcile.assert_not_called()
+
+        self.assertEqual(stats['top_users'], [{"username": "alicia", "message_count": 2},
+                                              {"username": "alice", "message_count": 1}])
+        self.assertEqual(stats['usage_stats']['total_users'], 2)
+        self.assertEqual(stats['usage_stats']['active_users_today'], 2)
+
+    def test_clear_subtracts_room(self):
+        """Test a clear subtracts the room's counts without a rebuild"""
+        add_message('general', 'alice')
+        add_message('general', 'bob')
+        add_message('random', 'alice')
+        self.stats.snapshot()
+
+        with patch.object(self.stats, 'reconcile') as reconcile:
+            self.hub.publish('general', 'clear', {"messages_deleted": 2})
+            stats = self.stats.snapshot()
+            reconcile.assert_not_called()
+
+        usage = stats['usage_stats']
+        self.assertEqual((usage['total_messages'], usage['total_rooms'], usage['total_users']),
+                         (1, 1, 1))
+        self.assertEqual((usage['messages_today'], usage['active_users_today']), (1, 1))
+        self.assertEqual(stats['top_rooms'], [{"room": "random", "message_count": 1}])
+
+    def test_batch_counts_added(self):
+        """Test a batch event adds the counts it carries without a rebuild"""
+        self.stats.snapshot()
+        today = self.stats._today()
+
+        with patch.object(self.stats, 'reconcile') as reconcile:
+            self.hub.publish('general', 'bulk', {"messages": 3, "counts": [
+                ["bot", today, 2], ["bot", "2020-01-01", 1]]})
+            stats = self.stats.snapshot()
+            reconcile.assert_not_called()
+
+        usage = stats['usage_stats']
+        self.assertEqual((usage['total_messages'], usage['messages_today']), (3, 2))
+        self.assertEqual(stats['top_users'], [{"username": "bot", "message_count": 3}])
+
+    def test_removals_trigger_rebuild(self):
+        """Test retention and partition drops, which carry no counts, schedule a rebuild"""
+        entry = add_message('general', 'alice')
+        self.stats.snapshot()
+
+        db.session.delete(entry)
+        db.session.commit()
+        self.hub.publish('general', 'bulk', {"removed": 1})
+
+        self.assertTrue(self.stats.dirty)
+        self.assertEqual(self.stats.snapshot()['usage_stats']['total_messages'], 0)
+
+    def test_change_during_reconcile_schedules_another(self):
+        """Test a rename arriving while counters are rebuilt schedules another rebuild"""
+        add_message('general', 'alice')
+        self.stats.snapshot()
+        self.stats._reconciling = True
+
+        self.hub.publish('general', 'rename', {"old_username": "alice",
+                                               "new_username": "alicia"})
+
+        self.assertTrue(self.stats.dirty)
+
+    def test_messages_after_midnight_kept(self):
+        """Test messages counted after midnight survive the next snapshot"""
+        add_message('general', 'alice')
+        self.stats.snapshot()
+        tomorrow = (utcnow() + timedelta(days=1)).strftime('%Y-%m-%d')
+
+        with patch.object(self.stats, '_today', return_value=tomorrow):
+            self.stats.record_message('general', 'bob', tomorrow)
+            usage = self.stats.snapshot()['usage_stats']
+
+        self.assertEqual((usage['messages_today'], usage['active_users_today']), (1, 1))
+
+    def test_loaded_by_background_thread(self):
+        """Test the first snapshot waits for the thread's load instead of rebuilding itself"""
+        add_message('general', 'alice')
+        stats = ChatStats(db, cache_ttl=0, load_wait=5)
+        stats.start(self.app)
+        try:
+            with patch.object(stats, 'reconcile', wraps=stats.reconcile) as reconcile:
+                usage = stats.snapshot()['usage_stats']
+                reconcile.assert_not_called()
+        finally:
+            stats.stop()
+
+        self.assertEqual(usage['total_messages'], 1)
+
+    def test_one_rebuild_at_a_time(self):
+        """Test concurrent first snapshots share one rebuild"""
+        add_message('general', 'alice')
+        rebuild = self.stats._reconcile
+        started, release = threading.Event(), threading.Event()
+
+        def slow_rebuild():
+            started.set()
+            release.wait(5)
+            rebuild()
+
+        results = []
+
+        def snapshot():
+            with self.app.app_context():
+                results.append(self.stats.snapshot())
+
+        with patch.object(self.stats, '_reconcile', side_effect=slow_rebuild) as reconcile:
+            first = threading.Thread(target=snapshot)
+            first.start()
+            started.wait(5)
+            second = threading.Thread(target=snapshot)
+            second.start()
+            release.set()
+            first.join(5)
+            second.join(5)
+
+        self.assertEqual(reconcile.call_count, 1)
+        self.assertEqual([result['usage_stats']['total_messages'] for result in results], [1, 1])
+
+    def test_snapshot_cached_within_ttl(self):
+        """Test snapshots are served from the cache until the TTL expires"""
+        stats = ChatStats(db, cache_ttl=60)
+        first = stats.snapshot()
+
+        # Rows written behind the engine's back are not visible until a rebuild
+        add_message('general', 'alice')
+        self.assertIs(stats.snapshot(), first)
+
+        stats.invalidate()
+        self.assertEqual(stats.snapshot()['usage_stats']['total_messages'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
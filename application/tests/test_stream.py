@@ -0,0 +1,216 @@
+import unittest
+import json
+from unittest.mock import patch
+from flask import Flask
+from models import db, Chat
+from hub import MessageHub
+
+
+def create_test_app():
+    """Create a test Flask app that doesn't try to connect to MySQL"""
+    app = Flask(__name__)
+
+    # Test configuration - use SQLite instead of MySQL
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    class MockMetrics:
+        def labels(self, **kwargs):
+            return self
+        def inc(self):
+            pass
+        def set(self, value):
+            pass
+        def observe(self, value):
+            pass
+
+    app.metrics = {
+        'messages_sent': MockMetrics(),
+        'username_changes': MockMetrics(),
+        'chat_clears': MockMetrics(),
+        'active_rooms': MockMetrics(),
+        'total_users': MockMetrics(),
+        'database_connection': MockMetrics(),
+        'messages_today': MockMetrics(),
+        'message_length': MockMetrics()
+    }
+
+    with app.app_context():
+        from routes import register_routes
+        register_routes(app, db)
+
+    return app
+
+
+def read_events(response, count):
+    """Read `count` SSE frames (excluding the retry preamble) from a streamed response"""
+    events = []
+    for chunk in response.response:
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if chunk.startswith('retry:'):
+            continue
+        events.append(chunk)
+        if len(events) == count:
+            break
+    return events
+
+
+def parse_event(frame):
+    fields = {}
+    for line in frame.strip().split('\n'):
+        key, _, value = line.partition(': ')
+        fields[key] = value
+    if 'data' in fields:
+        fields['data'] = json.loads(fields['data'])
+    return fields
+
+
+class TestMessageHub(unittest.TestCase):
+    """Test cases for the in-process fan-out hub"""
+
+    def test_publish_to_room_subscribers(self):
+        """Test events reach every subscriber of the room and only that room"""
+        hub = MessageHub()
+        first = hub.subscribe('general')
+        second = hub.subscribe('general')
+        other = hub.subscribe('random')
+
+        delivered = hub.publish('general', 'message', {'id': 1})
+
+        self.assertEqual(delivered, 2)
+        self.assertEqual(first.get(timeout=0), ('message', {'id': 1}))
+        self.assertEqual(second.get(timeout=0), ('message', {'id': 1}))
+        self.assertIsNone(other.get(timeout=0))
+
+    def test_unsubscribe(self):
+        """Test unsubscribed streams stop receiving events"""
+        hub = MessageHub()
+        subscription = hub.subscribe('general')
+        hub.unsubscribe(subscription)
+        hub.unsubscribe(subscription)
+
+        self.assertEqual(hub.publish('general', 'message', {'id': 1}), 0)
+        self.assertEqual(hub.subscriber_count(), 0)
+
+    def test_slow_subscriber_overflow(self):
+        """Test a full subscriber queue is flagged instead of blocking publishers"""
+        hub = MessageHub(max_queued=1)
+        subscription = hub.subscribe('general')
+
+        hub.publish('general', 'message', {'id': 1})
+        hub.publish('general', 'message', {'id': 2})
+
+        self.assertTrue(subscription.overflowed)
+
+    def test_listeners_receive_all_rooms(self):
+        """Test listeners see events from every room and failures are contained"""
+        hub = MessageHub()
+        seen = []
+        hub.add_listener(lambda room, event, data: 1 / 0)
+        hub.add_listener(lambda room, event, data: seen.append((room, event)))
+
+        hub.publish('general', 'message', {'id': 1})
+        hub.publish('random', 'clear', {})
+
+        self.assertEqual(seen, [('general', 'message'), ('random', 'clear')])
+
+
+class TestChatStream(unittest.TestCase):
+    """Test cases for the Server-Sent Events endpoint"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.app = create_test_app()
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_stream_headers(self):
+        """Test the stream is served as unbuffered text/event-stream"""
+        response = self.client.get('/api/chat/general/stream', buffered=False)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertEqual(response.headers['X-Accel-Buffering'], 'no')
+        response.close()
+
+    def test_stream_backlog_from_last_event_id(self):
+        """Test reconnecting clients receive messages after Last-Event-ID"""
+        with self.app.app_context():
+            entries = [Chat(room='general', date='2025-05-26', time='12:00:00',
+                            username='alice', message=f'Message {i}') for i in range(3)]
+            db.session.add_all(entries)
+            db.session.commit()
+            ids = [entry.id for entry in entries]
+
+        response = self.client.get('/api/chat/general/stream', buffered=False,
+                                   headers={'Last-Event-ID': str(ids[0])})
+        events = [parse_event(frame) for frame in read_events(response, 2)]
+        response.close()
+
+        self.assertEqual([event['id'] for event in events], [str(ids[1]), str(ids[2])])
+        self.assertEqual(events[0]['data']['message'], 'Message 1')
+
+    def test_stream_receives_posted_messages(self):
+        """Test messages posted after connecting are pushed to the stream"""
+        response = self.client.get('/api/chat/general/stream', buffered=False)
+        self.assertEqual(self.app.hub.subscriber_count('general'), 1)
+
+        self.client.post('/api/chat/general', data={'username': 'alice', 'msg': 'Hi'})
+        self.client.put('/api/chat/general', data={
+            'old_username': 'alice', 'new_username': 'alicia'})
+        self.client.delete('/api/chat/general')
+
+        events = [parse_event(frame) for frame in read_events(response, 3)]
+        response.close()
+
+        self.assertEqual([event['event'] for event in events], ['message', 'rename', 'clear'])
+        self.assertEqual(events[0]['data']['message'], 'Hi')
+        self.assertEqual(events[1]['data']['new_username'], 'alicia')
+        self.assertEqual(self.app.hub.subscriber_count('general'), 0)
+
+    def test_stream_heartbeat(self):
+        """Test idle streams send keep-alive comments"""
+        with patch('routes.STREAM_HEARTBEAT_SECONDS', 0.01):
+            response = self.client.get('/api/chat/general/stream', buffered=False)
+            frames = read_events(response, 1)
+            response.close()
+
+        self.assertEqual(frames, [': keep-alive\n\n'])
+
+    def test_streams_capped_per_worker(self):
+        """Test streams past the per-worker cap are refused so requests keep threads"""
+        with patch('routes.STREAM_MAX_PER_WORKER', 1):
+            first = self.client.get('/api/chat/general/stream', buffered=False)
+            second = self.client.get('/api/chat/random/stream', buffered=False)
+            health = self.client.get('/health')
+            first.close()
+            third = self.client.get('/api/chat/random/stream', buffered=False)
+            third.close()
+
+        self.assertEqual(second.status_code, 503)
+        self.assertIn('Retry-After', second.headers)
+        self.assertEqual(health.status_code, 200)
+        self.assertEqual(third.status_code, 200)
+
+    def test_stream_invalid_last_event_id(self):
+        """Test malformed Last-Event-ID headers are rejected"""
+        response = self.client.get('/api/chat/general/stream',
+                                   headers={'Last-Event-ID': 'abc'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.app.hub.subscriber_count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
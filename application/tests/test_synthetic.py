@@ -0,0 +1,86 @@
+import unittest
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import func, select
+from models import db, Chat, RoomMember
+from synthetic import LENGTH_BUCKETS, generate_messages
+
+NOW = datetime(2025, 5, 26, 12, 0, 0)
+
+
+def create_test_app():
+    """Create a test Flask app backed by an in-memory SQLite database"""
+    app = Flask(__name__)
+
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    return app
+
+
+class TestGenerateMessages(unittest.TestCase):
+    """Test cases for the synthetic data generator"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.app = create_test_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def counts(self, column):
+        return dict(db.session.execute(
+            select(column, func.count(Chat.id)).join(Chat.member).group_by(column)).all())
+
+    def test_zipf_activity(self):
+        """Test the first-ranked rooms and users are the busiest"""
+        inserted = generate_messages(3000, rooms=20, users=50, batch_size=700, now=NOW)
+
+        self.assertEqual(inserted, 3000)
+        self.assertEqual(db.session.query(Chat).count(), 3000)
+        rooms = self.counts(Chat.room)
+        users = self.counts(RoomMember.username)
+        self.assertEqual(max(rooms, key=rooms.get), 'room-0')
+        self.assertEqual(max(users, key=users.get), 'user-0')
+        self.assertGreater(rooms['room-0'], 3 * rooms['room-10'])
+
+    def test_lengths_and_dates(self):
+        """Test message lengths stay inside the histogram buckets and dates follow ids"""
+        generate_messages(2000, months=3, batch_size=500, now=NOW)
+
+        rows = db.session.execute(select(Chat.created_at, Chat.message).order_by(Chat.id)).all()
+        lengths = [len(row.message) for row in rows]
+        self.assertGreaterEqual(min(lengths), 1)
+        self.assertLessEqual(max(lengths), LENGTH_BUCKETS[-1][0])
+        self.assertGreater(sum(length <= 50 for length in lengths), len(lengths) / 2)
+
+        dates = [row.created_at for row in rows]
+        self.assertEqual(dates, sorted(dates))
+        self.assertGreaterEqual(dates[0], NOW - timedelta(days=90))
+        self.assertLessEqual(dates[-1], NOW)
+        self.assertGreater(dates[-1] - dates[0], timedelta(days=80))
+
+    def test_reproducible(self):
+        """Test the same seed generates the same messages"""
+        generate_messages(200, seed=7, now=NOW)
+        first = db.session.execute(select(Chat.room, Chat.message).order_by(Chat.id)).all()
+        db.session.execute(Chat.__table__.delete())
+        db.session.commit()
+
+        generate_messages(200, seed=7, now=NOW)
+        second = db.session.execute(select(Chat.room, Chat.message).order_by(Chat.id)).all()
+
+        self.assertEqual(first, second)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+import json
+import threading
+from flask import Flask
+from prometheus_client import REGISTRY
+from models import db, Chat, utcnow
+from write_buffer import WriteBuffer, WriteBufferFull
+
+
+def create_test_app():
+    """Create a test Flask app that doesn't try to connect to MySQL"""
+    app = Flask(__name__)
+
+    # Test configuration - use SQLite instead of MySQL
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    class MockMetrics:
+        def labels(self, **kwargs):
+            return self
+        def inc(self):
+            pass
+        def set(self, value):
+            pass
+        def observe(self, value):
+            pass
+
+    app.metrics = {
+        'messages_sent': MockMetrics(),
+        'username_changes': MockMetrics(),
+        'chat_clears': MockMetrics(),
+        'database_connection': MockMetrics(),
+        'message_length': MockMetrics()
+    }
+
+    with app.app_context():
+        from routes import register_routes
+        register_routes(app, db)
+
+    return app
+
+
+def row(message, username='alice'):
+    return dict(room='general', created_at=utcnow(), username=username, message=message)
+
+
+class TestWriteBuffer(unittest.TestCase):
+    """Test cases for group-committing posted messages"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.app = create_test_app()
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        if self.app.write_buffer is not None:
+            self.app.write_buffer.stop()
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_batch_committed_together(self):
+        """Test queued messages are committed as one batch and all get ids"""
+        buffer = WriteBuffer(self.app, db, max_batch=3, flush_ms=1000)
+        batches = REGISTRY.get_sample_value('chatapp_write_batch_size_count') or 0
+        pending = [buffer.submit(**row(f'Message {i}')) for i in range(3)]
+
+        buffer.start()
+        events = [item.wait(timeout=5) for item in pending]
+        buffer.stop()
+
+        self.assertEqual([event['message'] for event in events],
+                         ['Message 0', 'Message 1', 'Message 2'])
+        self.assertEqual(len({event['id'] for event in events}), 3)
+        self.assertEqual(REGISTRY.get_sample_value('chatapp_write_batch_size_count'), batches + 1)
+
+    def test_failed_batch_retried_per_message(self):
+        """Test one bad message only fails its own request"""
+        buffer = WriteBuffer(self.app, db, max_batch=3, flush_ms=1000)
+        good = buffer.submit(**row('Good'))
+        bad = buffer.submit(**row('Bad', username=None))
+        other = buffer.submit(**row('Also good'))
+
+        buffer.start()
+        self.assertEqual(good.wait(timeout=5)['message'], 'Good')
+        self.assertEqual(other.wait(timeout=5)['message'], 'Also good')
+        with self.assertRaises(Exception):
+            bad.wait(timeout=5)
+        buffer.stop()
+
+        with self.app.app_context():
+            self.assertEqual(db.session.query(Chat).count(), 2)
+
+    def test_concurrent_posts_through_buffer(self):
+        """Test POSTs answer after their batch commits"""
+        self.app.write_buffer = WriteBuffer(self.app, db, max_batch=10, flush_ms=20)
+        self.app.write_buffer.start()
+        responses = []
+
+        def post(i):
+            client = self.app.test_client()
+            responses.append(client.post('/api/chat/general',
+                                         data={'username': 'alice', 'msg': f'Message {i}'}))
+
+        threads = [threading.Thread(target=post, args=(i,)) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [201] * 5)
+        self.assertEqual(json.loads(responses[0].data)['room'], 'general')
+        history = self.client.get('/api/chat/general').data.decode().split('\n')
+        self.assertEqual(len(history), 5)
+
+    def test_full_queue_refuses_posts(self):
+        """Test posts are refused with 503 instead of queueing behind a full buffer"""
+        self.app.write_buffer = WriteBuffer(self.app, db, max_batch=10, flush_ms=1, max_queued=1)
+        waiting = self.app.write_buffer.submit(**row('Waiting'))
+
+        response = self.client.post('/api/chat/general',
+                                    data={'username': 'alice', 'msg': 'Refused'})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        with self.assertRaises(WriteBufferFull):
+            self.app.write_buffer.submit(**row('Also refused'))
+
+        self.app.write_buffer.start()
+        self.assertEqual(waiting.wait(timeout=5)['message'], 'Waiting')
+
+
+if __name__ == '__main__':
+    unittest.main()
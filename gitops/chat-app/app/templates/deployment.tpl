@@ -36,6 +36,13 @@ spec:
         envFrom:
         - secretRef:
             name: {{ .Release.Name }}-mysql-uri
+        {{- with .Values.appEnv }}
+        env:
+        {{- range $name, $value := . }}
+        - name: {{ $name }}
+          value: {{ $value | quote }}
+        {{- end }}
+        {{- end }}
         ports:
         - containerPort: 5000
         readinessProbe:
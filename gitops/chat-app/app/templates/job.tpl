@@ -34,6 +34,11 @@ spec:
 
               MYSQL_URI="${USERNAME}:${PASSWORD}@${MYSQL_HOST}:${MYSQL_PORT}/${DATABASE}"
 
+              # Room history reads go to the replicas (architecture: replication)
+              MYSQL_READ_HOST={{ .Release.Name }}-mysql-secondary.{{ include "chat.app.mysql.namespace" . }}.svc.cluster.local
+              MYSQL_READ_URI="${USERNAME}:${PASSWORD}@${MYSQL_READ_HOST}:${MYSQL_PORT}/${DATABASE}"
+
               kubectl create secret -n {{ include "chat.app.namespace" . }} generic {{ .Release.Name }}-mysql-uri \
                 --from-literal=MYSQL_URI="$MYSQL_URI" \
+                --from-literal=MYSQL_READ_URI="$MYSQL_READ_URI" \
                 --dry-run=client -o yaml | kubectl apply -f -
\ No newline at end of file
@@ -0,0 +1,53 @@
+{{- if .Values.partitions.enabled }}
+{{- $labels := include "chat.app.labels" . | fromYaml }}
+{{- $merged := merge $labels (dict "tier" "partitions") }}
+
+apiVersion: batch/v1
+kind: CronJob
+metadata:
+  labels:
+    {{- toYaml $merged | nindent 4 }}
+  name: {{ .Release.Name }}-partitions
+  namespace: {{ include "chat.app.namespace" . }}
+spec:
+  schedule: {{ .Values.partitions.schedule | quote }}
+  concurrencyPolicy: Forbid
+  successfulJobsHistoryLimit: 3
+  failedJobsHistoryLimit: 3
+  jobTemplate:
+    spec:
+      backoffLimit: 2
+      template:
+        metadata:
+          labels:
+            {{- toYaml $merged | nindent 12 }}
+        spec:
+          restartPolicy: OnFailure
+          containers:
+          - image: 793786247026.dkr.ecr.ap-south-1.amazonaws.com/erik/chat-app:{{ .Values.appVersion | default "latest" }}
+            name: {{ .Release.Name }}-partitions
+            imagePullPolicy: IfNotPresent
+            command: ["flask", "partitions", "maintain"]
+            envFrom:
+            - secretRef:
+                name: {{ .Release.Name }}-mysql-uri
+            env:
+            # A one-off process: no multiprocess metrics or purge thread. It
+            # uses the app's backplane so the pods hear about removed messages
+            - name: PROMETHEUS_MULTIPROC_DIR
+              value: ""
+            - name: CHAT_BACKPLANE
+              value: {{ .Values.appEnv.CHAT_BACKPLANE | default "local" | quote }}
+            {{- with .Values.appEnv.REDIS_URL }}
+            - name: REDIS_URL
+              value: {{ . | quote }}
+            {{- end }}
+            - name: ROOM_PURGE_ENABLED
+              value: "false"
+            - name: PARTITION_MONTHS_AHEAD
+              value: {{ .Values.partitions.monthsAhead | quote }}
+            - name: PARTITION_RETENTION_MONTHS
+              value: {{ .Values.partitions.retentionMonths | quote }}
+            resources:
+              {{- include "chat.app.resources" . | indent 4 }}
+{{- end }}
@@ -0,0 +1,79 @@
+{{- if .Values.retention.enabled }}
+{{- if not (or .Values.retention.archiveClaim .Values.retention.archiveS3Uri) }}
+{{- fail "retention.enabled needs retention.archiveClaim or retention.archiveS3Uri: the job deletes archived rows, and an archive left in the pod is lost when it exits" }}
+{{- end }}
+{{- $labels := include "chat.app.labels" . | fromYaml }}
+{{- $merged := merge $labels (dict "tier" "retention") }}
+
+apiVersion: batch/v1
+kind: CronJob
+metadata:
+  labels:
+    {{- toYaml $merged | nindent 4 }}
+  name: {{ .Release.Name }}-retention
+  namespace: {{ include "chat.app.namespace" . }}
+spec:
+  schedule: {{ .Values.retention.schedule | quote }}
+  concurrencyPolicy: Forbid
+  successfulJobsHistoryLimit: 3
+  failedJobsHistoryLimit: 3
+  jobTemplate:
+    spec:
+      backoffLimit: 2
+      template:
+        metadata:
+          labels:
+            {{- toYaml $merged | nindent 12 }}
+        spec:
+          restartPolicy: OnFailure
+          {{- with .Values.retention.serviceAccountName }}
+          serviceAccountName: {{ . }}
+          {{- end }}
+          containers:
+          - image: 793786247026.dkr.ecr.ap-south-1.amazonaws.com/erik/chat-app:{{ .Values.appVersion | default "latest" }}
+            name: {{ .Release.Name }}-retention
+            imagePullPolicy: IfNotPresent
+            command: ["flask", "retention"]
+            envFrom:
+            - secretRef:
+                name: {{ .Release.Name }}-mysql-uri
+            env:
+            # A one-off process: no multiprocess metrics or purge thread. It
+            # uses the app's backplane so the pods hear about removed messages
+            - name: PROMETHEUS_MULTIPROC_DIR
+              value: ""
+            - name: CHAT_BACKPLANE
+              value: {{ .Values.appEnv.CHAT_BACKPLANE | default "local" | quote }}
+            {{- with .Values.appEnv.REDIS_URL }}
+            - name: REDIS_URL
+              value: {{ . | quote }}
+            {{- end }}
+            - name: ROOM_PURGE_ENABLED
+              value: "false"
+            - name: RETENTION_MAX_AGE_DAYS
+              value: {{ .Values.retention.maxAgeDays | quote }}
+            - name: RETENTION_MAX_MESSAGES
+              value: {{ .Values.retention.maxMessages | quote }}
+            - name: RETENTION_ROOM_POLICIES
+              value: {{ .Values.retention.roomPolicies | quote }}
+            - name: RETENTION_BATCH_SIZE
+              value: {{ .Values.retention.batchSize | quote }}
+            - name: RETENTION_ARCHIVE_DIR
+              value: /archive
+            - name: RETENTION_ARCHIVE_S3_URI
+              value: {{ .Values.retention.archiveS3Uri | quote }}
+            volumeMounts:
+            - name: archive
+              mountPath: /archive
+            resources:
+              {{- include "chat.app.resources" . | indent 4 }}
+          volumes:
+          - name: archive
+            {{- if .Values.retention.archiveClaim }}
+            persistentVolumeClaim:
+              claimName: {{ .Values.retention.archiveClaim }}
+            {{- else }}
+            # Staging only: each batch is uploaded to S3 before it is deleted
+            emptyDir: {}
+            {{- end }}
+{{- end }}